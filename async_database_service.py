@@ -0,0 +1,355 @@
+import asyncio
+import json
+import threading
+from typing import List, Optional, Dict, Any, Awaitable
+from urllib.parse import quote
+
+import aiohttp
+
+from src.database_config import db_config
+from src.models.inventory import BaseModel
+from src.services.database_service import DatabaseService, UnknownWarehouse, db_service
+from src.services.product_cache import can_serve_selector
+from src.services.sales_rollups import ROLLUP_PREFIX, summarize
+
+class AsyncDatabaseService:
+    """asyncio counterpart of DatabaseService for running independent lookups concurrently.
+
+    Method names and return values match DatabaseService. The in-process
+    caches and write listeners are shared with the synchronous service it
+    wraps, so both see the same documents. All coroutines run on one
+    background event loop; Flask views call them through `run_async`.
+    """
+
+    def __init__(self, service: DatabaseService):
+        self.service = service
+        self.db_name = service.db_name
+        self.base_url = f"{db_config.server_url.rstrip('/')}/{quote(self.db_name, safe='')}"
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """One keep-alive client session per loop, sized like the sync connection pool"""
+        if self._session is None or self._session.closed:
+            auth = None
+            if db_config.username and db_config.password:
+                auth = aiohttp.BasicAuth(db_config.username, db_config.password)
+            self._session = aiohttp.ClientSession(
+                auth=auth,
+                connector=aiohttp.TCPConnector(limit=db_config.pool_size),
+                timeout=aiohttp.ClientTimeout(total=db_config.request_timeout),
+                json_serialize=json.dumps
+            )
+        return self._session
+
+    async def _request(self, method: str, path: str, **kwargs):
+        """Send a request to the database and return (status, headers, decoded JSON body)"""
+        session = await self._get_session()
+        async with session.request(method, f'{self.base_url}/{path}', **kwargs) as response:
+            data = await response.json() if method != 'HEAD' else None
+            return response.status, response.headers, data
+
+    async def create_document(self, model: BaseModel) -> Optional[str]:
+        """Create a new document in the database"""
+        try:
+            doc_data = model.to_dict()
+            status, headers, data = await self._request('POST', '', json=doc_data)
+            if status not in (201, 202):
+                print(f"Error creating document: {data}")
+                return None
+            doc_data['_rev'] = data['rev']
+            self.service._notify(data['id'], doc_data)
+            return data['id']
+        except Exception as e:
+            print(f"Error creating document: {e}")
+            return None
+
+    async def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Get a document by ID"""
+        if self.service.product_cache.is_fresh():
+            cached = self.service.product_cache.get(doc_id)
+            if cached is not None:
+                return cached
+
+        # Stale cache entries are simply refetched rather than revalidated
+        cached = self.service.document_cache.get(doc_id, lambda doc_id, rev: False)
+        if cached is not None:
+            return cached
+
+        try:
+            status, headers, data = await self._request('GET', quote(doc_id, safe=''))
+            if status == 404:
+                return None
+            if status != 200:
+                print(f"Error getting document {doc_id}: {data}")
+                return None
+            self.service.document_cache.put(data)
+            return data
+        except Exception as e:
+            print(f"Error getting document {doc_id}: {e}")
+            return None
+
+    async def get_documents(self, doc_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Get many documents in one _all_docs request, in input order (None for missing ones)"""
+        if not doc_ids:
+            return []
+
+        try:
+            status, headers, data = await self._request(
+                'POST', '_all_docs', params={'include_docs': 'true'},
+                json={'keys': list(dict.fromkeys(doc_ids))}
+            )
+            found = {}
+            for row in data.get('rows', []):
+                doc = row.get('doc')
+                if doc:
+                    found[row['id']] = doc
+                    self.service.document_cache.put(doc)
+            return [dict(found[doc_id]) if doc_id in found else None for doc_id in doc_ids]
+        except Exception as e:
+            print(f"Error getting documents {doc_ids}: {e}")
+            return [None for _ in doc_ids]
+
+    async def update_document(self, model: BaseModel, rev: Optional[str] = None) -> bool:
+        """Update an existing document; without `rev` the current revision is read first"""
+        try:
+            doc_path = quote(model._id, safe='')
+            if rev is None:
+                status, headers, data = await self._request('HEAD', doc_path)
+                if status != 200:
+                    return False
+                rev = headers.get('ETag', '').strip('"')
+
+            model._rev = rev
+            model.update_timestamp()
+            doc_data = model.to_dict()
+            status, headers, data = await self._request('PUT', doc_path, json=doc_data)
+            if status not in (201, 202):
+                print(f"Error updating document: {data}")
+                return False
+            model._rev = doc_data['_rev'] = data['rev']
+            self.service._notify(model._id, doc_data)
+            return True
+        except Exception as e:
+            print(f"Error updating document: {e}")
+            return False
+
+    async def delete_document(self, doc_id: str) -> bool:
+        """Delete a document by ID"""
+        try:
+            doc_path = quote(doc_id, safe='')
+            status, headers, data = await self._request('GET', doc_path)
+            if status != 200:
+                return False
+            # The same typed tombstone as DatabaseService.delete_document, so
+            # filtered changes feeds still see the deletion
+            status, headers, data = await self._request('PUT', doc_path, json=self.service._tombstone(data))
+            if status not in (201, 202):
+                print(f"Error deleting document {doc_id}: {data}")
+                return False
+            self.service._notify(doc_id, None)
+            return True
+        except Exception as e:
+            print(f"Error deleting document {doc_id}: {e}")
+            return False
+
+    async def _find(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a Mango query and return the raw `_find` response"""
+        status, headers, data = await self._request('POST', '_find', json=query)
+        if status != 200:
+            raise RuntimeError(f"_find failed ({status}): {data}")
+        self.service.query_stats['queries'] += 1
+        return data
+
+    async def _find_all(self, query: Dict[str, Any], batch_size: int = 1000) -> List[Dict[str, Any]]:
+        """Every document matching a Mango query, following bookmarks"""
+        query = dict(query, limit=batch_size)
+        docs = []
+        while True:
+            data = await self._find(query)
+            batch = data.get('docs', [])
+            docs.extend(batch)
+            if len(batch) < batch_size or not data.get('bookmark'):
+                return docs
+            query['bookmark'] = data['bookmark']
+
+    async def find_documents(self, doc_type: str, limit: int = 100, skip: int = 0,
+                             selector: Optional[Dict] = None, fields: Optional[List[str]] = None,
+                             sort: Optional[List] = None) -> List[Dict[str, Any]]:
+        """Find documents by type with optional Mango selector, projection and sort"""
+        if (doc_type == 'product' and not fields and not sort
+                and can_serve_selector(selector) and self.service.product_cache.is_fresh()):
+            return self.service.product_cache.find(selector, limit, skip)
+
+        try:
+            query = self.service._build_query(doc_type, selector, fields, sort)
+            query['limit'] = limit
+            query['skip'] = skip
+            return (await self._find(query)).get('docs', [])
+        except Exception as e:
+            print(f"Error finding documents: {e}")
+            return []
+
+    async def get_low_stock_products(self, warehouse_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get products that are below their reorder point.
+
+        Raises UnknownWarehouse, like the sync version, once the low-stock
+        index is built.
+        """
+        if self.service.low_stock_index.built:
+            if warehouse_id and not self.service.low_stock_index.has_warehouse(warehouse_id):
+                raise UnknownWarehouse(warehouse_id)
+            return self.service.low_stock_index.get(warehouse_id)
+            
+        try:
+            if self.service.product_cache.is_fresh():
+                products = self.service.product_cache.all()
+            else:
+                products = await self._find_all(self.service._build_query('product'))
+
+            if self.service.stock_ledger_mode:
+                products = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self.service.overlay_ledger_stock(list(products), all_products=True))
+
+            results = []
+            for doc in products:
+                current_stock = doc.get('current_stock', {})
+                stock = current_stock.get(warehouse_id, 0) if warehouse_id else sum(current_stock.values())
+                if stock <= doc.get('reorder_point', 0):
+                    results.append(doc)
+            return results
+        except Exception as e:
+            print(f"Error getting low stock products: {e}")
+            return []
+
+    async def _view(self, name: str, **options) -> List[Dict[str, Any]]:
+        """Rows of a design document view; options are JSON encoded like couchdb-python does"""
+        design, view = name.split('/', 1)
+        params = {key: value if isinstance(value, str) else json.dumps(value)
+                  for key, value in options.items()}
+        status, headers, data = await self._request('GET', f'_design/{design}/_view/{view}', params=params)
+        if status != 200:
+            raise RuntimeError(f"View {name} failed ({status}): {data}")
+        return data.get('rows', [])
+
+    async def _load_sales_rollups(self, start_day: str, end_day: str,
+                                  warehouse_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Daily rollup documents in a day range, read as one _all_docs range"""
+        status, headers, data = await self._request('GET', '_all_docs', params={
+            'startkey': json.dumps(f'{ROLLUP_PREFIX}{start_day}:'),
+            'endkey': json.dumps(f'{ROLLUP_PREFIX}{end_day}:\ufff0'),
+            'include_docs': 'true'
+        })
+        if status != 200:
+            raise RuntimeError(f"Reading sales rollups failed ({status}): {data}")
+        self.service.sales_rollups.stats['reads'] += 1
+        return [row['doc'] for row in data.get('rows', [])
+                if row.get('doc') and (warehouse_id is None or row['doc'].get('warehouse_id') == warehouse_id)]
+
+    async def _sold_item(self, product_id: str, start_day: str, end_day: str) -> Dict[str, Any]:
+        """The first line item of a product sold in a day range, from the by_product_date view"""
+        rows = await self._view('sales_reports/by_product_date',
+                                startkey=[product_id, start_day],
+                                endkey=[product_id, end_day],
+                                reduce=False, include_docs=True, limit=1)
+        for row in rows:
+            for item in (row.get('doc') or {}).get('items', []):
+                if item.get('product_id') == product_id:
+                    return item
+        return {}
+
+    async def get_sales_summary(self, start_date: str, end_date: str,
+                                warehouse_id: Optional[str] = None, top: int = 10) -> Dict[str, Any]:
+        """Summarise sales between two days (inclusive).
+
+        Reads the daily rollups once they have been built (one small
+        document per day and warehouse); before that, both reduce views are
+        queried at once. Top products are named as they were sold, from a
+        line item of each in the range.
+        """
+        start_day, end_day = start_date[:10], end_date[:10]
+        warehouse_key = warehouse_id or None
+
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self.service.sales_rollups.is_built):
+            totals, product_sales = summarize(await self._load_sales_rollups(start_day, end_day, warehouse_key))
+            orders, revenue = totals['orders'], totals['revenue']
+            completed = totals['by_status'].get('completed', 0)
+            cancelled = totals['by_status'].get('cancelled', 0)
+            paid = totals['by_payment_status'].get('paid', 0)
+            pending = totals['by_payment_status'].get('pending', 0)
+        else:
+            totals_rows, item_rows = await asyncio.gather(
+                self._view('sales_reports/by_warehouse_date',
+                           startkey=[warehouse_key, start_day],
+                           endkey=[warehouse_key, end_day],
+                           reduce=True),
+                self._view('sales_reports/items_by_warehouse_date',
+                           startkey=[warehouse_key, start_day],
+                           endkey=[warehouse_key, end_day, {}],
+                           group_level=3)
+            )
+            orders, revenue, completed, cancelled, paid, pending = (
+                totals_rows[0]['value'] if totals_rows else [0, 0, 0, 0, 0, 0]
+            )
+
+            product_sales = {}
+            for row in item_rows:
+                totals = product_sales.setdefault(row['key'][2], [0, 0])
+                totals[0] += row['value'][0]
+                totals[1] += row['value'][1]
+
+        top_ids = sorted(product_sales, key=lambda pid: product_sales[pid][0], reverse=True)[:top]
+        sold_items = await asyncio.gather(*(self._sold_item(product_id, start_day, end_day)
+                                            for product_id in top_ids))
+        top_products = []
+        for product_id, item in zip(top_ids, sold_items):
+            top_products.append({
+                'product_id': product_id,
+                'product_name': item.get('product_name', ''),
+                'sku': item.get('sku', ''),
+                'total_quantity': product_sales[product_id][0],
+                'total_revenue': product_sales[product_id][1]
+            })
+
+        return {
+            'date_range': {
+                'start_date': start_date,
+                'end_date': end_date
+            },
+            'totals': {
+                'total_orders': orders,
+                'completed_orders': completed,
+                'cancelled_orders': cancelled,
+                'total_revenue': revenue
+            },
+            'payment_status': {
+                'paid_orders': paid,
+                'pending_orders': pending
+            },
+            'top_products': top_products
+        }
+
+    async def count_documents(self) -> Dict[str, int]:
+        """Number of documents of each type, from the types/by_type view"""
+        rows = await self._view('types/by_type', group=True)
+        return {row['key']: row['value'] for row in rows}
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """The background event loop shared by every Flask thread, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-db-loop', daemon=True).start()
+        return _loop
+
+def run_async(coroutine: Awaitable, timeout: Optional[float] = None):
+    """Run a coroutine on the background loop and wait for its result from synchronous code"""
+    future = asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+    return future.result(timeout if timeout is not None else db_config.request_timeout * 2)
+
+# Global async database service instance
+async_db_service = AsyncDatabaseService(db_service)
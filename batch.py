@@ -0,0 +1,82 @@
+from flask import Blueprint, jsonify, request, current_app
+from src.services.database_service import db_service
+
+batch_bp = Blueprint('batch', __name__)
+
+# Most sub-requests one batch may carry
+MAX_BATCH_SIZE = 500
+
+def _dispatch(method: str, path: str, body, headers) -> dict:
+    """Run one sub-request through the app in process and return its status and JSON body"""
+    app = current_app._get_current_object()
+    try:
+        with app.test_request_context(path, method=method, json=body, headers=headers or {}):
+            response = app.full_dispatch_request()
+            payload = response.get_json(silent=True)
+            if payload is None:
+                payload = response.get_data(as_text=True)
+        return {'status': response.status_code, 'body': payload}
+    except Exception as e:
+        return {'status': 500, 'body': {'success': False, 'error': str(e)}}
+
+@batch_bp.route('/batch', methods=['POST'])
+def run_batch():
+    """Run an ordered list of API requests in one call.
+
+    The body is {"requests": [{"method", "path", "body", "headers"}, ...]}
+    (or the bare list) and every sub-request gets its own
+    {"status", "body"} result, in order. Documents created by the
+    sub-requests are written together with _bulk_docs; they are flushed
+    before a GET and before anything reads them, so later sub-requests see
+    earlier ones. A create that fails when the buffer is written turns the
+    result of the sub-request that made it into a 500.
+    """
+    try:
+        data = request.json
+        subrequests = data.get('requests') if isinstance(data, dict) else data
+
+        if not isinstance(subrequests, list):
+            return jsonify({
+                'success': False,
+                'error': 'requests must be a list'
+            }), 400
+        if len(subrequests) > MAX_BATCH_SIZE:
+            return jsonify({
+                'success': False,
+                'error': f'At most {MAX_BATCH_SIZE} requests per batch'
+            }), 400
+
+        results = []
+        db_service.start_create_buffer()
+        try:
+            for index, subrequest in enumerate(subrequests):
+                method = str(subrequest.get('method') or 'GET').upper()
+                path = str(subrequest.get('path') or '')
+                if not path.startswith('/api/') or path.startswith('/api/batch'):
+                    results.append({'status': 400, 'body': {'success': False, 'error': 'Invalid path'}})
+                    continue
+
+                if method == 'GET':
+                    db_service.flush_creates()
+                db_service.tag_buffered_creates(index)
+                results.append(_dispatch(method, path, subrequest.get('body'), subrequest.get('headers')))
+        finally:
+            failures = db_service.stop_create_buffer()
+
+        for failure in failures:
+            results[failure['tag']] = {
+                'status': 500,
+                'body': {'success': False, 'error': f"Failed to save {failure['id']}: {failure.get('reason', '')}"}
+            }
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(results)
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -0,0 +1,116 @@
+"""Stock update contention benchmark.
+
+Many threads sell the same product at once, as tills do with a popular
+SKU, and the script reports throughput, conflicts and whether any update
+was lost. Each strategy starts from the same stock:
+
+  handler   - DatabaseService.apply_stock_delta (the stock/apply_delta update handler)
+  bulk-cas  - DatabaseService.update_product_stock_many (_bulk_docs with conflict retries)
+  naive     - read the product, change it and save it, without retrying
+
+Runs against the CouchDB in COUCHDB_URL using a scratch database that is
+dropped afterwards:
+
+    python benchmark_stock_contention.py --threads 50 --updates 20
+"""
+import argparse
+import sys
+import threading
+import time
+
+import couchdb
+
+from src.database_config import db_config
+from src.services.database_service import DatabaseService
+from src.models.inventory import Product
+
+def naive_update(service: DatabaseService, product_id: str, warehouse_id: str, quantity_change: int) -> bool:
+    """The old read-modify-write path: two round trips and no conflict handling"""
+    try:
+        doc = service.db[product_id]
+        stock = doc.get('current_stock', {})
+        stock[warehouse_id] = max(0, stock.get(warehouse_id, 0) + quantity_change)
+        doc['current_stock'] = stock
+        service.db.save(doc)
+        return True
+    except couchdb.ResourceConflict:
+        return False
+
+def run(service: DatabaseService, strategy: str, threads: int, updates: int, warehouse_id: str) -> dict:
+    """Sell one unit `updates` times from each of `threads` threads and measure the outcome"""
+    initial = threads * updates * 2
+    product = Product(name='Benchmark SKU', sku=f'BENCH-{strategy.upper()}',
+                      current_stock={warehouse_id: initial})
+    product_id = service.create_document(product)
+    service.stock_stats = dict.fromkeys(service.stock_stats, 0)
+    succeeded = [0] * threads
+
+    def worker(index: int):
+        for _ in range(updates):
+            if strategy == 'handler':
+                ok = service.apply_stock_delta(product_id, warehouse_id, -1)['ok']
+            elif strategy == 'bulk-cas':
+                results = service.update_product_stock_many(
+                    [{'product_id': product_id, 'warehouse_id': warehouse_id, 'quantity_change': -1}],
+                    movement_type='SALE', reference_type='benchmark'
+                )
+                ok = bool(results) and all(result['ok'] for result in results)
+            else:
+                ok = naive_update(service, product_id, warehouse_id, -1)
+            if ok:
+                succeeded[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - started
+
+    final = service.db[product_id]['current_stock'][warehouse_id]
+    applied = sum(succeeded)
+    return {
+        'strategy': strategy,
+        'attempted': threads * updates,
+        'succeeded': applied,
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(applied / elapsed, 1) if elapsed else 0.0,
+        'conflicts': service.stock_stats['conflicts'],
+        'retries': service.stock_stats['retries'],
+        'lost_updates': (initial - final) != applied,
+        'final_stock': final,
+        'expected_stock': initial - applied
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent stock updates on a single product')
+    parser.add_argument('--threads', type=int, default=20, help='concurrent tills')
+    parser.add_argument('--updates', type=int, default=25, help='sales per till')
+    parser.add_argument('--strategies', default='handler,bulk-cas,naive')
+    parser.add_argument('--database', default='inventory_stock_benchmark')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch database')
+    args = parser.parse_args()
+
+    service = DatabaseService(args.database)
+    if service.db is None:
+        print('Could not connect to CouchDB')
+        return 1
+
+    try:
+        print(f"{'strategy':<10} {'ok/total':>11} {'sec':>8} {'upd/s':>8} {'conflicts':>10} {'retries':>8}  stock")
+        for strategy in args.strategies.split(','):
+            result = run(service, strategy, args.threads, args.updates, 'bench-warehouse')
+            stock = f"{result['final_stock']} (expected {result['expected_stock']})"
+            if result['lost_updates']:
+                stock += ' LOST UPDATES'
+            print(f"{result['strategy']:<10} {result['succeeded']:>5}/{result['attempted']:<5} "
+                  f"{result['seconds']:>8} {result['updates_per_second']:>8} "
+                  f"{result['conflicts']:>10} {result['retries']:>8}  {stock}")
+    finally:
+        if not args.keep:
+            db_config.server.delete(args.database)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
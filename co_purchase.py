@@ -0,0 +1,216 @@
+import heapq
+import math
+import threading
+import time
+from typing import List, Optional, Dict, Any, Set, FrozenSet, Tuple
+
+class CoPurchaseIndex:
+    """Item-to-item recommendations from products bought in the same order.
+
+    `pairs` is a sparse, symmetric co-occurrence matrix kept as a dict of
+    dicts: pairs[a][b] is the number of orders holding both a and b, and
+    `counts[a]` the number holding a. Pairs are scored by cosine similarity
+    (co-count / sqrt(count_a * count_b)). The best `top_n` neighbours of a
+    product are kept as a list; an order change marks the lists its scores
+    affect (its products and their neighbours) and each is recomputed once,
+    on its next lookup, so `similar` is otherwise a dict lookup. Products
+    with no neighbours fall back to the best sellers in their category.
+
+    The index follows the `_changes` feed for sales orders and products
+    (`refresh`, every `refresh_interval` seconds on a background thread
+    once `start`ed) and is also told about local writes (`on_change`). The
+    products of every counted order are remembered, so an order seen twice
+    counts once and a cancelled or deleted order is subtracted again.
+    """
+
+    def __init__(self, db, top_n: int = 20, min_support: int = 1, refresh_interval: float = 30.0,
+                 batch_size: int = 5000):
+        self.db = db
+        self.top_n = top_n
+        self.min_support = min_support
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self.order_products: Dict[str, FrozenSet[str]] = {}
+        self.counts: Dict[str, int] = {}
+        self.pairs: Dict[str, Dict[str, int]] = {}
+        self.neighbours: Dict[str, List[Tuple[str, float]]] = {}
+        self._stale: Set[str] = set()
+        self.product_category: Dict[str, str] = {}
+        self.categories: Dict[str, Set[str]] = {}
+        self.inactive: Set[str] = set()
+        self.last_seq = None
+        self.stats = {'refreshes': 0, 'orders_applied': 0, 'lookups': 0, 'category_fallbacks': 0}
+
+    @property
+    def built(self) -> bool:
+        return self.last_seq is not None
+
+    def _add_pairs(self, products: FrozenSet[str], sign: int):
+        for product_id in products:
+            self.counts[product_id] = self.counts.get(product_id, 0) + sign
+            if not self.counts[product_id]:
+                del self.counts[product_id]
+            row = self.pairs.setdefault(product_id, {})
+            for other_id in products:
+                if other_id == product_id:
+                    continue
+                row[other_id] = row.get(other_id, 0) + sign
+                if not row[other_id]:
+                    del row[other_id]
+            if not row:
+                del self.pairs[product_id]
+
+    def _rank(self, product_id: str):
+        """Recompute the neighbour list of one product"""
+        count = self.counts.get(product_id, 0)
+        row = self.pairs.get(product_id, {})
+        scored = ((other_id, together / math.sqrt(count * self.counts[other_id]))
+                  for other_id, together in row.items() if together >= self.min_support)
+        best = heapq.nlargest(self.top_n, scored, key=lambda pair: (pair[1], pair[0]))
+        if best:
+            self.neighbours[product_id] = best
+        else:
+            self.neighbours.pop(product_id, None)
+
+    def apply_order(self, order_id: str, order: Optional[Dict[str, Any]]):
+        """Count an order's products, replacing what an earlier version of it counted"""
+        if order and not order.get('_deleted') and order.get('status') != 'cancelled':
+            products = frozenset(item.get('product_id') for item in order.get('items') or []
+                                 if item.get('product_id'))
+        else:
+            products = frozenset()
+
+        with self._lock:
+            previous = self.order_products.get(order_id, frozenset())
+            if products == previous:
+                return
+            self._add_pairs(previous, -1)
+            self._add_pairs(products, 1)
+            if products:
+                self.order_products[order_id] = products
+            else:
+                self.order_products.pop(order_id, None)
+            # Counts of these products changed, so their neighbours' scores did too
+            for product_id in previous | products:
+                self._stale.add(product_id)
+                self._stale.update(self.pairs.get(product_id, ()))
+            self.stats['orders_applied'] += 1
+
+    def apply_product(self, product_id: str, product: Optional[Dict[str, Any]]):
+        """Track a product's category and whether it can be recommended"""
+        with self._lock:
+            category_id = self.product_category.pop(product_id, None)
+            if category_id is not None:
+                self.categories[category_id].discard(product_id)
+            if not product or product.get('_deleted') or product.get('is_active') is False:
+                self.inactive.add(product_id)
+            else:
+                self.inactive.discard(product_id)
+            if product and not product.get('_deleted') and product.get('category_id'):
+                self.product_category[product_id] = product['category_id']
+                self.categories.setdefault(product['category_id'], set()).add(product_id)
+
+    def on_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """Write listener: apply local order and product writes once the index is built"""
+        if not self.built:
+            return
+        if doc is None:
+            # A deletion of some document; it may have been either
+            if doc_id in self.order_products:
+                self.apply_order(doc_id, None)
+            if doc_id in self.product_category or doc_id in self.counts:
+                self.apply_product(doc_id, None)
+        elif doc.get('type') == 'sales_order':
+            self.apply_order(doc_id, doc)
+        elif doc.get('type') == 'product':
+            self.apply_product(doc_id, doc)
+
+    def refresh(self) -> bool:
+        """Apply sales order and product changes since the last refresh (everything the first time).
+
+        Pages of the feed are read without holding the index lock, so
+        lookups and write listeners only wait while a page is applied.
+        """
+        if self.db is None:
+            return False
+
+        with self._refresh_lock:
+            since = self.last_seq or 0
+            try:
+                while True:
+                    data = self.db.changes(since=since, limit=self.batch_size,
+                                           include_docs='true', filter='_selector',
+                                           _selector={'selector': {'type': {'$in': ['sales_order', 'product']}}})
+                    results = data.get('results', [])
+                    with self._lock:
+                        for change in results:
+                            doc = None if change.get('deleted') else change.get('doc')
+                            if (change.get('doc') or {}).get('type') == 'product':
+                                self.apply_product(change['id'], doc)
+                            else:
+                                self.apply_order(change['id'], doc)
+                    since = data.get('last_seq', since)
+                    if not results or not data.get('pending'):
+                        break
+            except Exception as e:
+                print(f"Error refreshing co-purchase index: {e}")
+                return False
+            with self._lock:
+                self.last_seq = since
+                self.stats['refreshes'] += 1
+            return True
+
+    def start(self) -> bool:
+        """Build the index now, then pick up other processes' writes every `refresh_interval` seconds.
+
+        The periodic refreshes run on a background thread, never on a lookup.
+        """
+        built = self.refresh()
+        if self._thread and self._thread.is_alive():
+            return built
+
+        def run():
+            while True:
+                time.sleep(self.refresh_interval)
+                self.refresh()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return built
+
+    def similar(self, product_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Products bought with this one, best first, topped up from its category.
+
+        Each entry has `product_id`, `reason` ('co_purchase' or 'category')
+        and `score` (cosine similarity, or None for category entries).
+        """
+        with self._lock:
+            self.stats['lookups'] += 1
+            if product_id in self._stale:
+                self._rank(product_id)
+                self._stale.discard(product_id)
+            results = [{'product_id': other_id, 'reason': 'co_purchase', 'score': round(score, 4)}
+                       for other_id, score in self.neighbours.get(product_id, [])
+                       if other_id not in self.inactive][:limit]
+
+            category_id = self.product_category.get(product_id)
+            if len(results) < limit and category_id:
+                self.stats['category_fallbacks'] += 1
+                seen = {entry['product_id'] for entry in results} | {product_id}
+                members = (member for member in self.categories.get(category_id, ())
+                           if member not in seen and member not in self.inactive)
+                # Best sellers first; ties by id so the answer is stable
+                best = heapq.nsmallest(limit - len(results), members,
+                                       key=lambda member: (-self.counts.get(member, 0), member))
+                results.extend({'product_id': member, 'reason': 'category', 'score': None} for member in best)
+            return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index sizes and counters"""
+        with self._lock:
+            return dict(self.stats, built=self.built, orders=len(self.order_products),
+                        products=len(self.counts), pairs=sum(len(row) for row in self.pairs.values()) // 2,
+                        categories=len(self.categories))
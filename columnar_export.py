@@ -0,0 +1,209 @@
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
+
+import numpy as np
+
+from src.services.sales_analytics import parse_timestamps
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of each dataset as (name, kind); kinds are str, float, int and timestamp
+DATASETS = {
+    'sales_items': [
+        ('order_id', 'str'), ('order_rev', 'str'), ('order_date', 'timestamp'), ('warehouse_id', 'str'),
+        ('customer_id', 'str'), ('status', 'str'), ('payment_status', 'str'), ('payment_method', 'str'),
+        ('product_id', 'str'), ('sku', 'str'), ('product_name', 'str'), ('quantity', 'float'),
+        ('unit_price', 'float'), ('discount', 'float'), ('line_total', 'float'), ('export_batch', 'int')
+    ],
+    'inventory_movements': [
+        ('movement_id', 'str'), ('timestamp', 'timestamp'), ('product_id', 'str'), ('warehouse_id', 'str'),
+        ('quantity_change', 'float'), ('movement_type', 'str'), ('reference_id', 'str'),
+        ('reference_type', 'str'), ('notes', 'str'), ('export_batch', 'int')
+    ]
+}
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'npz': '.npz'}
+
+STATE_FILE = '_export_state.json'
+
+def available_format(requested: str = 'auto') -> str:
+    """The file format to write: Parquet when pyarrow is installed, NumPy .npz otherwise"""
+    if requested == 'auto':
+        return 'parquet' if pyarrow is not None else 'npz'
+    if requested not in FORMATS:
+        raise ValueError(f"Unknown format {requested}")
+    if requested != 'npz' and pyarrow is None:
+        raise ValueError(f"Format {requested} needs pyarrow")
+    return requested
+
+def _sales_item_rows(order: Dict[str, Any], batch: int) -> List[Dict[str, Any]]:
+    rows = []
+    for item in order.get('items') or []:
+        quantity = item.get('quantity') or 0
+        unit_price = item.get('unit_price') or 0
+        discount = item.get('discount') or 0
+        rows.append({
+            'order_id': order['_id'], 'order_rev': order.get('_rev', ''), 'order_date': order['order_date'],
+            'warehouse_id': order.get('warehouse_id') or '', 'customer_id': order.get('customer_id') or '',
+            'status': order.get('status') or '', 'payment_status': order.get('payment_status') or '',
+            'payment_method': order.get('payment_method') or '', 'product_id': item.get('product_id') or '',
+            'sku': item.get('sku') or '', 'product_name': item.get('product_name') or '',
+            'quantity': quantity, 'unit_price': unit_price, 'discount': discount,
+            'line_total': quantity * unit_price - discount, 'export_batch': batch
+        })
+    return rows
+
+def _movement_row(movement: Dict[str, Any], batch: int) -> Dict[str, Any]:
+    return {
+        'movement_id': movement['_id'], 'timestamp': movement['timestamp'],
+        'product_id': movement.get('product_id') or '', 'warehouse_id': movement.get('warehouse_id') or '',
+        'quantity_change': movement.get('quantity_change') or 0, 'movement_type': movement.get('movement_type') or '',
+        'reference_id': movement.get('reference_id') or '', 'reference_type': movement.get('reference_type') or '',
+        'notes': movement.get('notes') or '', 'export_batch': batch
+    }
+
+def to_columns(dataset: str, rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Typed NumPy columns for rows of a dataset"""
+    columns = {}
+    for name, kind in DATASETS[dataset]:
+        values = [row[name] for row in rows]
+        if kind == 'timestamp':
+            seconds = parse_timestamps(values)
+            column = seconds.astype('datetime64[s]')
+            column[seconds < 0] = np.datetime64('NaT')
+        elif kind == 'float':
+            column = np.array(values, dtype=np.float64)
+        elif kind == 'int':
+            column = np.array(values, dtype=np.int64)
+        else:
+            column = np.array(values, dtype=str)
+        columns[name] = column
+    return columns
+
+class ColumnarExporter:
+    """Exports sales line items and inventory movements to date-partitioned columnar files.
+
+    Reads the `_changes` feed one page at a time and writes each page as
+    `<out_dir>/<dataset>/date=YYYY-MM-DD/part-<batch>.<ext>` (the Hive
+    layout Parquet and Arrow readers understand), so memory use does not
+    grow with the database. The last exported sequence is kept in
+    `_export_state.json`, and the next run continues from there. A page
+    that was written but not recorded is written again under the same
+    name, so an interrupted run leaves no duplicates.
+
+    An order that changes after being exported (cancelled, paid, ...) is
+    exported again in a later batch; keep the row with the highest
+    `export_batch` per order_id for its latest state. Deletions are not
+    exported.
+    """
+
+    def __init__(self, db, out_dir: str, file_format: str = 'auto', batch_size: int = 5000,
+                 compression: str = 'zstd'):
+        self.db = db
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        self.compression = compression
+        self.state = self._load_state()
+        file_format = available_format(file_format if file_format != 'auto' else self.state.get('format', 'auto'))
+        if self.state.get('format', file_format) != file_format:
+            raise ValueError(f"{out_dir} holds a {self.state['format']} export; use the same format")
+        self.format = file_format
+
+    def _state_path(self) -> str:
+        return os.path.join(self.out_dir, STATE_FILE)
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self._state_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self):
+        path = self._state_path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _write(self, dataset: str, day: str, batch: int, rows: List[Dict[str, Any]]) -> str:
+        """Write one partition file, replacing it atomically; returns its path"""
+        directory = os.path.join(self.out_dir, dataset, f'date={day}')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'part-{batch:06d}{FORMATS[self.format]}')
+        columns = to_columns(dataset, rows)
+
+        with open(path + '.tmp', 'wb') as f:
+            if self.format == 'npz':
+                np.savez_compressed(f, **columns)
+            else:
+                table = pyarrow.table(columns)
+                if self.format == 'parquet':
+                    pyarrow.parquet.write_table(table, f, compression=self.compression)
+                else:
+                    options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+                    with pyarrow.ipc.new_file(f, table.schema, options=options) as writer:
+                        writer.write_table(table)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def export_page(self) -> Tuple[int, bool]:
+        """Export the next page of changes; returns (rows written, whether more changes are pending)"""
+        since = self.state.get('last_seq') or 0
+        batch = self.state.get('batch', 0)
+        data = self.db.changes(since=since, limit=self.batch_size, include_docs='true', filter='_selector',
+                               _selector={'selector': {'type': {'$in': ['sales_order', 'inventory_movement']}}})
+        results = data.get('results', [])
+
+        partitions = defaultdict(list)
+        for change in results:
+            doc = change.get('doc') or {}
+            if change.get('deleted'):
+                continue
+            if doc.get('type') == 'sales_order' and doc.get('order_date'):
+                partitions[('sales_items', doc['order_date'][:10])].extend(_sales_item_rows(doc, batch))
+            elif doc.get('type') == 'inventory_movement' and doc.get('timestamp'):
+                partitions[('inventory_movements', doc['timestamp'][:10])].append(_movement_row(doc, batch))
+
+        written = 0
+        rows_by_dataset = self.state.setdefault('rows', {})
+        for (dataset, day), rows in sorted(partitions.items()):
+            if rows:
+                self._write(dataset, day, batch, rows)
+                written += len(rows)
+                rows_by_dataset[dataset] = rows_by_dataset.get(dataset, 0) + len(rows)
+
+        if results:
+            self.state.update(last_seq=data.get('last_seq', since), batch=batch + 1, format=self.format,
+                              updated_at=datetime.utcnow().isoformat())
+            self._save_state()
+        return written, bool(results) and data.get('pending', 0) > 0
+
+    def run(self, max_batches: Optional[int] = None) -> Dict[str, Any]:
+        """Export everything changed since the last run (at most `max_batches` pages)"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        first_batch = self.state.get('batch', 0)
+        pages = rows = 0
+        more = True
+        while more and (max_batches is None or pages < max_batches):
+            try:
+                written, more = self.export_page()
+            except Exception as e:
+                print(f"Error exporting changes since {self.state.get('last_seq')}: {e}")
+                break
+            pages += 1
+            rows += written
+        return {
+            'batches': self.state.get('batch', 0) - first_batch,
+            'rows': rows,
+            'format': self.format,
+            'last_seq': self.state.get('last_seq'),
+            'complete': not more
+        }
@@ -0,0 +1,188 @@
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from couchdb import http, util
+
+class ThreadSafeCache(http.Cache):
+    """couchdb-python ETag response cache guarded by a lock"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            return super().get(url)
+
+    def put(self, url, response):
+        with self._lock:
+            super().put(url, response)
+
+    def remove(self, url):
+        with self._lock:
+            super().remove(url)
+
+class BoundedConnectionPool(http.ConnectionPool):
+    """Keep-alive HTTP connection pool with a size limit and usage counters.
+
+    At most `max_size` connections are checked out at once. A thread asking
+    for one while the pool is exhausted waits up to `wait_timeout` seconds
+    and then goes ahead with an extra connection (counted as an overflow)
+    rather than failing the request. Released connections are kept open
+    for reuse, up to `max_size` idle ones per host.
+
+    Slots are counted per checked-out connection, not with a bare counter:
+    couchdb-python closes some connections without releasing them (a chunked
+    response body dropped early), so a checked-out connection whose socket
+    has been closed no longer holds a slot. Connections left checked out by
+    a failed request are closed by PooledSession.request through `discard`.
+    """
+
+    # How often a waiting thread rechecks for connections closed behind the pool's back
+    RECHECK_INTERVAL = 0.1
+
+    def __init__(self, timeout, max_size: int = 20, wait_timeout: float = 5.0,
+                 disable_ssl_verification: bool = False):
+        super().__init__(timeout, disable_ssl_verification=disable_ssl_verification)
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.checked_out: Dict[int, Any] = {}  # id(conn) -> conn
+        self.stats = {'created': 0, 'reused': 0, 'waits': 0, 'wait_time': 0.0,
+                      'overflows': 0, 'discarded': 0, 'reclaimed': 0}
+        self._available = threading.Condition()
+        # Connections checked out by the current thread, for PooledSession.request
+        self.local = threading.local()
+
+    @property
+    def in_use(self) -> int:
+        """Checked-out connections that are still open"""
+        with self._available:
+            for key, conn in list(self.checked_out.items()):
+                if conn.sock is None:
+                    del self.checked_out[key]
+                    self.stats['reclaimed'] += 1
+            return len(self.checked_out)
+
+    def _track(self, conn):
+        with self._available:
+            self.checked_out[id(conn)] = conn
+        taken = getattr(self.local, 'conns', None)
+        if taken is not None:
+            taken.append(conn)
+
+    def get(self, url):
+        scheme, host = util.urlsplit(url, 'http', False)[:2]
+
+        with self._available:
+            if self.in_use >= self.max_size:
+                self.stats['waits'] += 1
+                started = time.time()
+                deadline = started + self.wait_timeout
+                while self.in_use >= self.max_size and time.time() < deadline:
+                    self._available.wait(min(self.RECHECK_INTERVAL, deadline - time.time()))
+                self.stats['wait_time'] += time.time() - started
+                if self.in_use >= self.max_size:
+                    self.stats['overflows'] += 1
+            conns = self.conns.setdefault((scheme, host), [])
+            conn = conns.pop(-1) if conns else None
+            if conn is not None:
+                self._track(conn)
+
+        if conn is not None:
+            self.stats['reused'] += 1
+            return conn
+
+        if scheme == 'http':
+            cls = http.HTTPConnection
+        elif scheme == 'https':
+            cls = http.InsecureHTTPSConnection if self.disable_ssl_verification else http.HTTPSConnection
+        else:
+            raise ValueError('%s is not a supported scheme' % scheme)
+        conn = cls(host, timeout=self.timeout)
+        conn.connect()
+        self._track(conn)
+
+        self.stats['created'] += 1
+        return conn
+
+    def release(self, url, conn):
+        scheme, host = util.urlsplit(url, 'http', False)[:2]
+        taken = getattr(self.local, 'conns', None)
+        if taken and conn in taken:
+            taken.remove(conn)
+        with self._available:
+            self.checked_out.pop(id(conn), None)
+            idle = self.conns.setdefault((scheme, host), [])
+            if conn.sock is not None and len(idle) < self.max_size:
+                idle.append(conn)
+                conn = None
+            self._available.notify()
+        if conn is not None:
+            self.stats['discarded'] += 1
+            conn.close()
+
+    def discard(self, conn):
+        """Close a connection that will not be released and free its slot"""
+        with self._available:
+            if self.checked_out.pop(id(conn), None) is None:
+                return
+            self.stats['discarded'] += 1
+            self._available.notify()
+        conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool usage: connections in use and idle, waits and connection reuse rate"""
+        with self._available:
+            idle = sum(len(conns) for conns in self.conns.values())
+            requests = self.stats['created'] + self.stats['reused']
+            return dict(self.stats,
+                        in_use=self.in_use,
+                        idle=idle,
+                        max_size=self.max_size,
+                        wait_time=round(self.stats['wait_time'], 3),
+                        reuse_rate=round(self.stats['reused'] / requests, 3) if requests else 0.0)
+
+class PooledSession(http.Session):
+    """couchdb-python session that can be shared between Flask threads.
+
+    Adds a bounded keep-alive connection pool, a per-request socket timeout
+    and retries on dropped keep-alive connections, and makes the response
+    cache thread safe.
+    """
+
+    def __init__(self, pool_size: int = 20, timeout: Optional[float] = 30.0,
+                 wait_timeout: float = 5.0, retry_delays: Optional[List[float]] = None):
+        super().__init__(timeout=timeout, retry_delays=retry_delays or [0, 0.2, 1])
+        self.pool_size = pool_size
+        self.wait_timeout = wait_timeout
+        self.cache = ThreadSafeCache()
+        self.connection_pool = BoundedConnectionPool(timeout, pool_size, wait_timeout)
+
+    def disable_ssl_verification(self):
+        self._disable_ssl_verification = True
+        self.connection_pool = BoundedConnectionPool(
+            self._timeout, self.pool_size, self.wait_timeout, disable_ssl_verification=True)
+
+    def request(self, *args, **kwargs):
+        """Send a request; connections it leaves checked out when it fails are closed and freed.
+
+        couchdb-python does not release the connection after a socket error
+        it does not retry (a timeout, say), which would hold its pool slot
+        for good.
+        """
+        pool = self.connection_pool
+        outer = getattr(pool.local, 'conns', None)
+        pool.local.conns = []
+        try:
+            return super().request(*args, **kwargs)
+        except Exception:
+            for conn in pool.local.conns:
+                pool.discard(conn)
+            raise
+        finally:
+            pool.local.conns = outer
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool metrics"""
+        return self.connection_pool.get_stats()
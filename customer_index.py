@@ -0,0 +1,213 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from typing import List, Optional, Dict, Any, Iterable, Set, Tuple
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def normalize_email(email: str) -> str:
+    """Email as compared for uniqueness: trimmed and lowercase"""
+    return (email or '').strip().lower()
+
+def normalize_phone(phone: str) -> str:
+    """Phone number as digits in international form, so Nigerian numbers match however they are written.
+
+    +234 803 123 4567, 2348031234567, 0803-123-4567, 803 123 4567 and
+    +234 (0) 803 123 4567 all become 2348031234567. Other numbers keep
+    their digits as given.
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('2340') and len(digits) == 14:
+        return '234' + digits[4:]
+    if digits.startswith('0') and len(digits) == 11:
+        return '234' + digits[1:]
+    if len(digits) == 10 and digits[0] in '789':
+        return '234' + digits
+    return digits
+
+def _phone_prefixes(query: str) -> List[str]:
+    """A partly typed phone number as prefixes of normalized numbers"""
+    digits = re.sub(r'\D', '', query)
+    if digits.startswith('2340'):
+        return ['234' + digits[4:]]
+    if digits.startswith('0'):
+        return ['234' + digits[1:]]
+    if digits[:1] in ('7', '8', '9'):
+        # Local number typed without the leading 0
+        return [digits, '234' + digits]
+    return [digits]
+
+class CustomerIndex:
+    """In-memory customer lookups: exact email and phone, prefix search over names.
+
+    Emails and normalized phone numbers map to the customers holding them
+    (a hash lookup, used for uniqueness checks). Name tokens, emails and
+    phone numbers are also kept in one sorted list of (key, customer_id),
+    so a prefix query is a binary search plus a walk over the matches.
+
+    Local writes arrive through `on_change`; writes by other processes are
+    picked up from the `_changes` feed by `refresh`, from the sequence the
+    index was built at.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self.built = False
+        self.last_seq = None
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.by_email: Dict[str, Set[str]] = {}
+        self.by_phone: Dict[str, Set[str]] = {}
+        self.keys: List[Tuple[str, str]] = []  # sorted ('n:token' / 'e:email' / 'p:phone', customer_id)
+        self.doc_keys: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Split text into lowercase alphanumeric tokens"""
+        return TOKEN_PATTERN.findall((text or '').lower())
+
+    def build(self, customers: Iterable[Dict[str, Any]], last_seq: Any = None):
+        """Replace the index contents with the given customers, read as of feed sequence `last_seq`"""
+        with self._lock:
+            self.documents.clear()
+            self.by_email.clear()
+            self.by_phone.clear()
+            self.doc_keys.clear()
+            keys = []
+            for customer in {customer['_id']: customer for customer in customers}.values():
+                keys.extend((key, customer['_id']) for key in self._index(customer))
+            # One sort rather than an insort per key
+            self.keys = sorted(keys)
+            self.last_seq = last_seq
+            self.built = True
+
+    def _index(self, customer: Dict[str, Any]) -> Set[str]:
+        """Record a customer in the lookups; returns its sorted-list keys for the caller to insert"""
+        customer_id = customer['_id']
+        email = normalize_email(customer.get('email'))
+        phone = normalize_phone(customer.get('phone'))
+        keys = {f'n:{token}' for token in self.tokenize(customer.get('name'))}
+        if email:
+            keys.add(f'e:{email}')
+        if phone:
+            keys.add(f'p:{phone}')
+
+        self.documents[customer_id] = customer
+        self.doc_keys[customer_id] = keys
+        if email:
+            self.by_email.setdefault(email, set()).add(customer_id)
+        if phone:
+            self.by_phone.setdefault(phone, set()).add(customer_id)
+        return keys
+
+    def add(self, customer: Dict[str, Any]):
+        """Index a customer, replacing any earlier version of it"""
+        with self._lock:
+            self.remove(customer['_id'])
+            for key in self._index(customer):
+                insort(self.keys, (key, customer['_id']))
+
+    def remove(self, customer_id: str):
+        """Drop a customer from the index"""
+        with self._lock:
+            customer = self.documents.pop(customer_id, None)
+            for key in self.doc_keys.pop(customer_id, set()):
+                index = bisect_left(self.keys, (key, customer_id))
+                if index < len(self.keys) and self.keys[index] == (key, customer_id):
+                    self.keys.pop(index)
+            if customer is None:
+                return
+            for mapping, value in ((self.by_email, normalize_email(customer.get('email'))),
+                                   (self.by_phone, normalize_phone(customer.get('phone')))):
+                holders = mapping.get(value)
+                if holders is not None:
+                    holders.discard(customer_id)
+                    if not holders:
+                        del mapping[value]
+
+    def on_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """DatabaseService listener: keep the index in step with customer writes"""
+        if doc is None or doc.get('_deleted'):
+            self.remove(doc_id)
+        else:
+            self.add(doc)
+
+    def refresh(self, db, batch_size: int = 5000) -> bool:
+        """Apply customer changes since the build or the last refresh, including other processes' writes"""
+        if not self.built or db is None:
+            return False
+
+        with self._refresh_lock:
+            since = self.last_seq or 0
+            try:
+                while True:
+                    data = db.changes(since=since, limit=batch_size, include_docs='true', filter='_selector',
+                                      _selector={'selector': {'type': 'customer'}})
+                    results = data.get('results', [])
+                    for change in results:
+                        self.on_change(change['id'], None if change.get('deleted') else change.get('doc'))
+                    since = data.get('last_seq', since)
+                    if not results or not data.get('pending'):
+                        break
+            except Exception as e:
+                print(f"Error refreshing customer index: {e}")
+                return False
+            self.last_seq = since
+            return True
+
+    def find_by_email(self, email: str) -> List[Dict[str, Any]]:
+        """Customers with this email, ignoring case and surrounding spaces"""
+        with self._lock:
+            return [self.documents[customer_id] for customer_id in self.by_email.get(normalize_email(email), ())]
+
+    def find_by_phone(self, phone: str) -> List[Dict[str, Any]]:
+        """Customers with this phone number, however it is written"""
+        with self._lock:
+            return [self.documents[customer_id] for customer_id in self.by_phone.get(normalize_phone(phone), ())]
+
+    def _prefix(self, prefix: str) -> Set[str]:
+        """Customers with a key starting with prefix"""
+        matches = set()
+        index = bisect_left(self.keys, (prefix,))
+        while index < len(self.keys) and self.keys[index][0].startswith(prefix):
+            matches.add(self.keys[index][1])
+            index += 1
+        return matches
+
+    def search(self, query: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Customers whose name words start with every query word, or whose email or phone starts with the query.
+
+        Exact email and phone matches come first, then by name.
+        """
+        query = (query or '').strip()
+        terms = self.tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            exact = (set(self.by_email.get(normalize_email(query), ()))
+                     | set(self.by_phone.get(normalize_phone(query), ())))
+            matches = set(exact)
+
+            by_name = self._prefix(f'n:{terms[0]}')
+            for term in terms[1:]:
+                if not by_name:
+                    break
+                by_name &= self._prefix(f'n:{term}')
+            matches |= by_name
+
+            matches |= self._prefix(f'e:{normalize_email(query)}')
+            if not re.search(r'[a-zA-Z@]', query):
+                for phone in _phone_prefixes(query):
+                    if len(phone) >= 3:
+                        matches |= self._prefix(f'p:{phone}')
+
+            ranked = sorted(matches, key=lambda customer_id: (
+                customer_id not in exact, (self.documents[customer_id].get('name') or '').lower(), customer_id))
+            return [self.documents[customer_id] for customer_id in ranked[:limit]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index sizes"""
+        with self._lock:
+            return {'built': self.built, 'customers': len(self.documents), 'emails': len(self.by_email),
+                    'phones': len(self.by_phone), 'keys': len(self.keys)}
@@ -1,6 +1,185 @@
 import couchdb
 import os
-from typing import Optional
+import threading
+from typing import Optional, Dict, Any
+from src.couchdb_pool import PooledSession
+
+# Mango indexes for common queries
+MANGO_INDEXES = [
+    # Plain listings by document type
+    {'index': {'fields': ['type']}, 'name': 'type-index'},
+    
+    # Product indexes
+    {'index': {'fields': ['type', 'sku']}, 'name': 'product-sku-index'},
+    {'index': {'fields': ['type', 'barcode']}, 'name': 'product-barcode-index'},
+    {'index': {'fields': ['type', 'category_id']}, 'name': 'product-category-index'},
+    
+    # Sales order indexes
+    {'index': {'fields': ['type', 'order_date']}, 'name': 'sales-order-date-index'},
+    {'index': {'fields': ['type', 'customer_id']}, 'name': 'sales-customer-index'},
+    
+    # Inventory movement indexes
+    {'index': {'fields': ['type', 'product_id', 'warehouse_id']}, 'name': 'inventory-movement-index'},
+    
+    # User indexes
+    {'index': {'fields': ['type', 'email']}, 'name': 'user-email-index'},
+    
+    # Idempotency keys, for purging expired ones
+    {'index': {'fields': ['type', 'expires_at']}, 'name': 'idempotency-expiry-index'},
+]
+
+# Design documents holding map/reduce views, keyed by design document id
+DESIGN_DOCUMENTS: Dict[str, Dict[str, Any]] = {
+    '_design/types': {
+        'language': 'javascript',
+        'views': {
+            'by_type': {
+                'map': 'function (doc) { if (doc.type) { emit(doc.type, null); } }',
+                'reduce': '_count'
+            }
+        }
+    },
+    
+    # Atomic stock changes. PUT _design/stock/_update/apply_delta/<product_id>
+    # with {"warehouse_id", "quantity_change", "updated_at"} adjusts one
+    # warehouse quantity inside CouchDB (refused with 409 when it would go
+    # below zero) and returns the new quantity and the updated product.
+    '_design/stock': {
+        'language': 'javascript',
+        'updates': {
+            'apply_delta': '''function (doc, req) {
+  if (!doc || doc.type !== 'product') {
+    return [null, {code: 404, json: {error: 'not_found', reason: 'Product not found'}}];
+  }
+  var change = JSON.parse(req.body);
+  var stock = doc.current_stock || {};
+  var previous = stock[change.warehouse_id] || 0;
+  var quantity = previous + change.quantity_change;
+  if (quantity < 0) {
+    return [null, {code: 409, json: {error: 'insufficient_stock', reason: 'Insufficient stock', quantity: previous}}];
+  }
+  stock[change.warehouse_id] = quantity;
+  doc.current_stock = stock;
+  if (change.updated_at) { doc.updated_at = change.updated_at; }
+  return [doc, {json: {ok: true, id: doc._id, previous: previous, quantity: quantity, doc: doc}}];
+}'''
+        }
+    },
+    
+    # Stock ledger. Sums movement quantities per [product_id, warehouse_id,
+    # created_at]; group_level=2 gives the stock per product and warehouse
+    # and a created_at range gives the change since a checkpoint.
+    '_design/ledger': {
+        'language': 'javascript',
+        'views': {
+            'stock': {
+                'map': '''function (doc) {
+  if (doc.type !== 'inventory_movement' || !doc.product_id) { return; }
+  emit([doc.product_id, doc.warehouse_id || '', doc.created_at], doc.quantity_change || 0);
+}''',
+                'reduce': '_sum'
+            }
+        }
+    },
+    
+    # Daily sales rollups. PUT _design/rollups/_update/apply/sales_rollup:<day>:<warehouse>
+    # with {"date", "warehouse_id", "orders", "revenue", "by_status",
+    # "by_payment_status", "products": {id: [quantity, revenue]}} adds the
+    # (signed) amounts to the rollup, creating it on first use. Entries that
+    # drop to zero are removed so the documents stay small.
+    '_design/rollups': {
+        'language': 'javascript',
+        'updates': {
+            'apply': '''function (doc, req) {
+  var delta = JSON.parse(req.body);
+  if (!doc) {
+    doc = {_id: req.id, type: 'sales_rollup', date: delta.date, warehouse_id: delta.warehouse_id,
+           orders: 0, revenue: 0, by_status: {}, by_payment_status: {}, products: {}};
+  }
+  function add(target, key, amount) {
+    var value = (target[key] || 0) + amount;
+    if (value) { target[key] = value; } else { delete target[key]; }
+  }
+  doc.orders += delta.orders || 0;
+  doc.revenue += delta.revenue || 0;
+  var key;
+  for (key in delta.by_status || {}) { add(doc.by_status, key, delta.by_status[key]); }
+  for (key in delta.by_payment_status || {}) { add(doc.by_payment_status, key, delta.by_payment_status[key]); }
+  for (key in delta.products || {}) {
+    var current = doc.products[key] || [0, 0];
+    var quantity = current[0] + delta.products[key][0];
+    var revenue = current[1] + delta.products[key][1];
+    if (quantity || revenue) { doc.products[key] = [quantity, revenue]; } else { delete doc.products[key]; }
+  }
+  doc.updated_at = delta.updated_at || doc.updated_at;
+  return [doc, {json: {ok: true, id: doc._id, orders: doc.orders}}];
+}'''
+        }
+    },
+    
+    # Sales reporting. Dates are bucketed by day (the first 10 characters of
+    # order_date). The warehouse views also emit every row under a null
+    # warehouse key, so a null prefix selects all warehouses.
+    '_design/sales_reports': {
+        'language': 'javascript',
+        'views': {
+            # [warehouse_id, day] -> [orders, revenue, completed, cancelled, paid, pending]
+            'by_warehouse_date': {
+                'map': '''function (doc) {
+  if (doc.type !== 'sales_order' || !doc.order_date) { return; }
+  var day = doc.order_date.substring(0, 10);
+  var cancelled = doc.status === 'cancelled';
+  var value = [
+    1,
+    cancelled ? 0 : (doc.total_amount || 0),
+    doc.status === 'completed' ? 1 : 0,
+    cancelled ? 1 : 0,
+    doc.payment_status === 'paid' ? 1 : 0,
+    doc.payment_status === 'pending' ? 1 : 0
+  ];
+  emit([doc.warehouse_id || '', day], value);
+  emit([null, day], value);
+}''',
+                'reduce': '_sum'
+            },
+            # [status, day] -> number of orders
+            'by_status_date': {
+                'map': '''function (doc) {
+  if (doc.type !== 'sales_order' || !doc.order_date) { return; }
+  emit([doc.status, doc.order_date.substring(0, 10)], null);
+}''',
+                'reduce': '_count'
+            },
+            # [product_id, day] -> [quantity, revenue] over orders that are not cancelled;
+            # read unreduced for the name and SKU a product was sold under
+            'by_product_date': {
+                'map': '''function (doc) {
+  if (doc.type !== 'sales_order' || !doc.order_date || doc.status === 'cancelled') { return; }
+  var day = doc.order_date.substring(0, 10);
+  (doc.items || []).forEach(function (item) {
+    var quantity = item.quantity || 0;
+    emit([item.product_id, day], [quantity, quantity * (item.unit_price || 0) - (item.discount || 0)]);
+  });
+}''',
+                'reduce': '_sum'
+            },
+            # [warehouse_id, day, product_id] -> [quantity, revenue], for top products over a date range
+            'items_by_warehouse_date': {
+                'map': '''function (doc) {
+  if (doc.type !== 'sales_order' || !doc.order_date || doc.status === 'cancelled') { return; }
+  var day = doc.order_date.substring(0, 10);
+  (doc.items || []).forEach(function (item) {
+    var quantity = item.quantity || 0;
+    var value = [quantity, quantity * (item.unit_price || 0) - (item.discount || 0)];
+    emit([doc.warehouse_id || '', day, item.product_id], value);
+    emit([null, day, item.product_id], value);
+  });
+}''',
+                'reduce': '_sum'
+            }
+        }
+    },
+}
 
 class CouchDBConfig:
     """CouchDB configuration and connection management"""
@@ -10,12 +189,33 @@ class CouchDBConfig:
         self.username = os.getenv('COUCHDB_USER', 'admin')
         self.password = os.getenv('COUCHDB_PASSWORD', 'password')
         self.server = None
+        self.session = None
         self.databases = {}
+        # Connection pool shared by every Flask thread
+        self.pool_size = int(os.getenv('COUCHDB_POOL_SIZE', '20'))
+        self.pool_wait_timeout = float(os.getenv('COUCHDB_POOL_WAIT_TIMEOUT', '5'))
+        self.request_timeout = float(os.getenv('COUCHDB_TIMEOUT', '30'))
+        self.retry_delays = [float(delay) for delay in os.getenv('COUCHDB_RETRY_DELAYS', '0,0.2,1').split(',') if delay]
+        self.indexed_databases = set()
+        self.warm_indexes_on_start = os.getenv('COUCHDB_WARM_INDEXES', 'true').lower() in ('1', 'true', 'yes')
         
     def connect(self):
-        """Connect to CouchDB server"""
+        """Connect to CouchDB server.
+        
+        Calling it again keeps the existing session, so the databases already
+        opened and the pool statistics share one connection pool.
+        """
+        if self.server is not None:
+            return True
+            
         try:
-            self.server = couchdb.Server(self.server_url)
+            self.session = PooledSession(
+                pool_size=self.pool_size,
+                timeout=self.request_timeout,
+                wait_timeout=self.pool_wait_timeout,
+                retry_delays=self.retry_delays
+            )
+            self.server = couchdb.Server(self.server_url, session=self.session)
             # Set authentication if provided
             if self.username and self.password:
                 self.server.resource.credentials = (self.username, self.password)
@@ -26,7 +226,7 @@ class CouchDBConfig:
     
     def get_database(self, db_name: str):
         """Get or create a database"""
-        if not self.server:
+        if self.server is None:
             if not self.connect():
                 return None
                 
@@ -50,39 +250,115 @@ class CouchDBConfig:
         self.databases[db_name] = db
         return db
     
-    def create_indexes(self, db_name: str):
-        """Create necessary indexes for the Melapro inventory system"""
+    def get_feed_database(self, db_name: str):
+        """Open a database on its own session for long-polling the changes feed.
+        
+        A long poll holds its connection for the whole feed timeout, so it
+        gets a dedicated connection without a socket timeout instead of a
+        slot in the shared pool.
+        """
+        try:
+            db = couchdb.Database(f"{self.server_url.rstrip('/')}/{db_name}",
+                                  session=couchdb.http.Session(timeout=None))
+            if self.username and self.password:
+                db.resource.credentials = (self.username, self.password)
+            return db
+        except Exception as e:
+            print(f"Failed to open changes feed for {db_name}: {e}")
+            return None
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool metrics for the health endpoint"""
+        if self.session is None:
+            return {}
+        return dict(self.session.pool_stats(), timeout=self.request_timeout)
+    
+    def create_indexes(self, db_name: str, force: bool = False):
+        """Create or update the Mango indexes and design documents for the Melapro inventory system.
+        
+        Safe to call repeatedly: existing definitions are left alone, changed
+        ones are dropped and rebuilt, and missing ones are created. Index
+        builds are then triggered in the background so the first real query
+        does not block on them.
+        """
+        if db_name in self.indexed_databases and not force:
+            return True
+            
         db = self.get_database(db_name)
-        if not db:
+        if db is None:
             return False
-            
-        # Create indexes for common queries
-        indexes = [
-            # Product indexes
-            {'index': {'fields': ['type', 'sku']}, 'name': 'product-sku-index'},
-            {'index': {'fields': ['type', 'barcode']}, 'name': 'product-barcode-index'},
-            {'index': {'fields': ['type', 'category_id']}, 'name': 'product-category-index'},
-            
-            # Sales order indexes
-            {'index': {'fields': ['type', 'order_date']}, 'name': 'sales-order-date-index'},
-            {'index': {'fields': ['type', 'customer_id']}, 'name': 'sales-customer-index'},
-            
-            # Inventory movement indexes
-            {'index': {'fields': ['type', 'product_id', 'warehouse_id']}, 'name': 'inventory-movement-index'},
-            
-            # User indexes
-            {'index': {'fields': ['type', 'email']}, 'name': 'user-email-index'},
-        ]
         
-        for index_def in indexes:
+        try:
+            existing = {index['name']: index for index in db.index()}
+        except Exception as e:
+            print(f"Failed to list indexes for {db_name}: {e}")
+            return False
+            
+        for index_def in MANGO_INDEXES:
+            name = index_def['name']
+            fields = index_def['index']['fields']
             try:
-                # CouchDB 2.x+ uses _index endpoint for creating indexes
-                # For now, we'll skip index creation as it requires more complex setup
-                pass
+                current = existing.get(name)
+                if current:
+                    current_fields = [list(field.keys())[0] for field in current['def']['fields']]
+                    if current_fields == fields:
+                        continue
+                    # Definition changed - drop the old index so it gets rebuilt
+                    print(f"Rebuilding index {name}: {current_fields} -> {fields}")
+                    del db.index()[current['ddoc'].split('/', 1)[1], name]
+                    
+                db.index()[name, name] = fields
             except Exception as e:
                 print(f"Failed to create index {index_def['name']}: {e}")
+        
+        self.ensure_design_documents(db)
+        self.indexed_databases.add(db_name)
+        
+        if self.warm_indexes_on_start:
+            threading.Thread(target=self.warm_indexes, args=(db_name,), daemon=True).start()
                 
         return True
+    
+    def ensure_design_documents(self, db):
+        """Save design documents whose definition is missing or out of date"""
+        for ddoc_id, definition in DESIGN_DOCUMENTS.items():
+            try:
+                current = db.get(ddoc_id)
+                if current and all(current.get(key) == value for key, value in definition.items()):
+                    continue
+                    
+                ddoc = dict(definition, _id=ddoc_id)
+                if current:
+                    print(f"Updating design document {ddoc_id}")
+                    ddoc['_rev'] = current['_rev']
+                db.save(ddoc)
+            except Exception as e:
+                print(f"Failed to save design document {ddoc_id}: {e}")
+    
+    def warm_indexes(self, db_name: str):
+        """Query every index and view once so CouchDB builds them ahead of use"""
+        db = self.get_database(db_name)
+        if db is None:
+            return
+            
+        for index_def in MANGO_INDEXES:
+            fields = index_def['index']['fields']
+            try:
+                db.resource.post_json('_find', body={
+                    'selector': {field: {'$gt': None} for field in fields},
+                    'use_index': [index_def['name'], index_def['name']],
+                    'fields': ['_id'],
+                    'limit': 1
+                })
+            except Exception as e:
+                print(f"Failed to warm index {index_def['name']}: {e}")
+        
+        for ddoc_id, definition in DESIGN_DOCUMENTS.items():
+            for view_name in definition.get('views', {}):
+                try:
+                    list(db.view(f"{ddoc_id.split('/', 1)[1]}/{view_name}", limit=1))
+                except Exception as e:
+                    print(f"Failed to warm view {ddoc_id}/{view_name}: {e}")
 
 # Global database configuration instance
 db_config = CouchDBConfig()
@@ -1,83 +1,361 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union, Callable, Tuple
+import base64
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
 import couchdb
 from src.database_config import db_config
+from src.services.product_search import ProductSearchIndex
+from src.services.customer_index import CustomerIndex
+from src.services.product_cache import ProductCache, can_serve_selector
+from src.services.document_cache import DocumentCache
+from src.services.stock_ledger import StockLedger
+from src.services.low_stock import LowStockIndex
+from src.services.idempotency import IdempotencyStore
+from src.services.sales_rollups import SalesRollups
+from src.services.sales_analytics import SalesAnalytics
+from src.services.co_purchase import CoPurchaseIndex
 from src.models.inventory import (
     BaseModel, Product, Category, Supplier, Customer, Warehouse,
     SalesOrder, PurchaseOrder, InventoryMovement, User, Role, AuditLog
 )
 
+# Document types offline clients keep a copy of
+SYNC_TYPES = ['product', 'category', 'supplier', 'customer', 'warehouse', 'sales_order']
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that was not issued by find_page"""
+
+class DocumentConflict(Exception):
+    """A document changed after the revision an update was based on"""
+
+class InsufficientStock(ValueError):
+    """A stock change that would take a warehouse below zero"""
+
+class UnknownWarehouse(ValueError):
+    """A warehouse id with no warehouse document and no stock"""
+
 class DatabaseService:
     """Service class for database operations"""
     
     def __init__(self, db_name: str = 'inventory_system'):
         self.db_name = db_name
         self.db = None
+        # Explain mode asks CouchDB for the plan of every Mango query and
+        # reports the ones that fall back to a full _all_docs scan
+        self.explain = os.getenv('COUCHDB_EXPLAIN', 'false').lower() in ('1', 'true', 'yes')
+        self.query_stats = {'queries': 0, 'full_scans': 0}
+        # Listeners called as callback(doc_id, doc) after a document of their
+        # type ('*' for every type) is written, and with doc=None after any
+        # document is deleted
+        self._listeners: Dict[str, List[Callable]] = {}
+        self.product_index = ProductSearchIndex()
+        self._product_index_lock = threading.Lock()
+        self.subscribe('product', self.product_index.on_change)
+        self.customer_index = CustomerIndex()
+        self._customer_index_lock = threading.Lock()
+        self._customer_refresh_thread = None
+        self.subscribe('customer', self.customer_index.on_change)
+        # Optional process-local product cache fed by the _changes feed
+        self.product_cache = ProductCache(feed_timeout=float(os.getenv('PRODUCT_CACHE_FEED_TIMEOUT', 30)))
+        self.subscribe('product', self.product_cache.on_local_change)
+        # Write-through LRU cache in front of get_document
+        self.document_cache = DocumentCache(
+            max_size=int(os.getenv('DOCUMENT_CACHE_SIZE', 1000)),
+            ttl=float(os.getenv('DOCUMENT_CACHE_TTL', 300)),
+            revalidate_after=float(os.getenv('DOCUMENT_CACHE_REVALIDATE_AFTER', 5))
+        )
+        self.subscribe('*', self.document_cache.on_change)
+        # Stock writes that hit a concurrent update are retried this many times
+        self.stock_update_retries = int(os.getenv('STOCK_UPDATE_RETRIES', 5))
+        self.stock_stats = {'updates': 0, 'conflicts': 0, 'retries': 0, 'failed': 0,
+                            'stray_movements': 0, 'give_back_failed': 0}
+        # Ledger mode: stock comes from the movements (ledger/stock view plus
+        # checkpoints) and sales only append movements
+        self.stock_ledger_mode = os.getenv('STOCK_LEDGER_MODE', 'false').lower() in ('1', 'true', 'yes')
+        self._checkpoint_thread = None
+        # Products at or below their reorder point, updated as products change
+        self.low_stock_index = LowStockIndex()
+        self.subscribe('product', self._update_low_stock_index)
+        self.subscribe('warehouse', self._update_low_stock_index)
+        self.sales_velocity_days = int(os.getenv('SALES_VELOCITY_DAYS', 28))
+        self.sales_velocity_ttl = float(os.getenv('SALES_VELOCITY_TTL', 3600))
+        self._velocity_cache: Dict[Optional[str], Any] = {}
+        self._feed_db = None
+        # Creates buffered per thread while a batch request runs (see start_create_buffer)
+        self._create_buffer = threading.local()
+        self.create_buffer_limit = int(os.getenv('CREATE_BUFFER_LIMIT', 500))
         self._connect()
+        self.stock_ledger = StockLedger(self.db, checkpoint_lag=float(os.getenv('STOCK_CHECKPOINT_LAG', 60)))
+        self.idempotency = IdempotencyStore(
+            self.db,
+            ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)),
+            max_entries=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+        )
+        self.sales_rollups = SalesRollups(self.db)
+        # Line items as NumPy columns for large sales analyses, loaded on first use
+        self.sales_analytics = SalesAnalytics(self.db, batch_size=int(os.getenv('SALES_ANALYTICS_BATCH_SIZE', 5000)))
+        # Products bought together, for /products/<id>/similar
+        self.co_purchase = CoPurchaseIndex(
+            self.db,
+            top_n=int(os.getenv('CO_PURCHASE_NEIGHBOURS', 20)),
+            min_support=int(os.getenv('CO_PURCHASE_MIN_SUPPORT', 1)),
+            refresh_interval=float(os.getenv('CO_PURCHASE_REFRESH_INTERVAL', 30))
+        )
+        self.subscribe('sales_order', self.co_purchase.on_change)
+        self.subscribe('product', self.co_purchase.on_change)
     
     def _connect(self):
         """Connect to the database"""
         self.db = db_config.get_database(self.db_name)
-        if self.db:
+        if self.db is not None:
             db_config.create_indexes(self.db_name)
     
+    def subscribe(self, doc_type: str, callback: Callable):
+        """Register a callback for writes to documents of the given type"""
+        self._listeners.setdefault(doc_type, []).append(callback)
+    
+    def _notify(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """Tell listeners about a written (or, with doc=None, deleted) document"""
+        if doc is None:
+            callbacks = [cb for callbacks in self._listeners.values() for cb in callbacks]
+        else:
+            callbacks = self._listeners.get(doc.get('type'), []) + self._listeners.get('*', [])
+            
+        for callback in callbacks:
+            try:
+                callback(doc_id, doc)
+            except Exception as e:
+                print(f"Error notifying listener about {doc_id}: {e}")
+    
+    def start_product_cache(self) -> bool:
+        """Fill the product cache and start following the changes feed.
+        
+        Changes arriving through the feed are passed to the write listeners
+        as well, so the search index also sees products written elsewhere.
+        """
+        if self.db is None:
+            return False
+            
+        feed_db = db_config.get_feed_database(self.db_name)
+        if feed_db is None:
+            return False
+            
+        try:
+            self.product_cache.start(
+                feed_db,
+                loader=lambda: self._iter_find(self._build_query('product')),
+                listener=lambda doc_id, doc: self._notify(doc_id, doc)
+            )
+            return True
+        except Exception as e:
+            print(f"Error starting product cache: {e}")
+            return False
+    
     def create_document(self, model: BaseModel) -> Optional[str]:
         """Create a new document in the database"""
-        if not self.db:
+        if self.db is None:
             return None
             
         try:
             doc_data = model.to_dict()
+            buffered = getattr(self._create_buffer, 'docs', None)
+            if buffered is not None:
+                buffered[doc_data['_id']] = (self._create_buffer.tag, doc_data)
+                if len(buffered) >= self.create_buffer_limit:
+                    self.flush_creates()
+                return doc_data['_id']
             doc_id, doc_rev = self.db.save(doc_data)
+            self._notify(doc_id, doc_data)
             return doc_id
         except Exception as e:
             print(f"Error creating document: {e}")
             return None
     
+    def start_create_buffer(self):
+        """Buffer create_document calls made on this thread, to be written with one _bulk_docs.
+        
+        create_document then returns the new id straight away, and
+        get_document returns buffered documents from the buffer. They are
+        written before anything else reads or writes them by id, before any
+        Mango query, on flush_creates, and when the buffer holds
+        `create_buffer_limit` documents.
+        """
+        self._create_buffer.docs = {}
+        self._create_buffer.tag = None
+        self._create_buffer.failures = []
+    
+    def tag_buffered_creates(self, tag: Any):
+        """Label the creates buffered from now on (the batch uses the sub-request index)"""
+        self._create_buffer.tag = tag
+    
+    def flush_creates(self):
+        """Write the buffered creates; failures are kept, with their tag, for stop_create_buffer"""
+        buffered = getattr(self._create_buffer, 'docs', None)
+        if not buffered:
+            return
+        
+        entries = list(buffered.values())
+        buffered.clear()
+        results = self._bulk_docs([doc for tag, doc in entries])
+        for (tag, doc), result in zip(entries, results):
+            if result['ok']:
+                self._notify(result['id'], doc)
+            else:
+                self._create_buffer.failures.append(dict(result, tag=tag))
+    
+    def create_failures(self) -> List[Dict[str, Any]]:
+        """Buffered creates under the current tag whose write has failed so far"""
+        tag = getattr(self._create_buffer, 'tag', None)
+        return [failure for failure in getattr(self._create_buffer, 'failures', None) or []
+                if failure['tag'] == tag]
+    
+    def stop_create_buffer(self) -> List[Dict[str, Any]]:
+        """Write what is still buffered, stop buffering and return the failed creates"""
+        try:
+            self.flush_creates()
+            return getattr(self._create_buffer, 'failures', [])
+        finally:
+            self._create_buffer.docs = None
+            self._create_buffer.failures = []
+    
+    def _flush_buffered(self, doc_ids: Optional[List[str]] = None):
+        """Write buffered creates first when an operation touches them (or any of them, for queries)"""
+        buffered = getattr(self._create_buffer, 'docs', None)
+        if buffered and (doc_ids is None or any(doc_id in buffered for doc_id in doc_ids)):
+            self.flush_creates()
+    
     def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
         """Get a document by ID"""
-        if not self.db:
+        if self.db is None:
             return None
             
+        buffered = getattr(self._create_buffer, 'docs', None)
+        if buffered and doc_id in buffered:
+            # A create not written yet (no _rev until it is)
+            return dict(buffered[doc_id][1])
+            
+        use_cache = self.product_cache.is_fresh()
+        if use_cache:
+            cached = self.product_cache.get(doc_id)
+            if cached is not None:
+                return cached
+            
+        cached = self.document_cache.get(doc_id, self._is_current_revision)
+        if cached is not None:
+            return cached
+            
         try:
-            return dict(self.db[doc_id])
+            doc = dict(self.db[doc_id])
+            if use_cache and doc.get('type') == 'product':
+                self.product_cache.record_miss()
+            self.document_cache.put(doc)
+            return doc
         except couchdb.ResourceNotFound:
             return None
         except Exception as e:
             print(f"Error getting document {doc_id}: {e}")
             return None
     
-    def update_document(self, model: BaseModel) -> bool:
-        """Update an existing document"""
-        if not self.db:
+    def get_type_version(self, doc_type: str) -> Optional[str]:
+        """A value that changes whenever documents of a type may have changed, for ETags.
+        
+        Products use the sequence of the last product change on the cache's
+        changes feed when it can vouch for it (not in ledger mode, where
+        stock moves without product writes). Everything else uses the
+        database update_seq, which changes on any write.
+        """
+        if self.db is None:
+            return None
+            
+        if doc_type == 'product' and not self.stock_ledger_mode:
+            version = self.product_cache.version()
+            if version is not None:
+                return f'product:{version}'
+        try:
+            return f"db:{self.db.info()['update_seq']}"
+        except Exception as e:
+            print(f"Error reading database update_seq: {e}")
+            return None
+    
+    def _current_revision(self, doc_id: str) -> Optional[str]:
+        """Read a document's current revision from its ETag with a body-less HEAD request"""
+        try:
+            status, headers, data = self.db.resource.head(doc_id)
+            return headers.get('etag', '').strip('"') or None
+        except Exception:
+            return None
+    
+    def _is_current_revision(self, doc_id: str, rev: str) -> bool:
+        """Whether `rev` is still the current revision of a document"""
+        return self._current_revision(doc_id) == rev
+    
+    def get_documents(self, doc_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Get many documents in one _all_docs request, in input order (None for missing ones)"""
+        if self.db is None or not doc_ids:
+            return [None for _ in doc_ids]
+            
+        self._flush_buffered(doc_ids)
+        try:
+            found = {}
+            rows = self.db.view('_all_docs', keys=list(dict.fromkeys(doc_ids)), include_docs=True)
+            for row in rows:
+                doc = row.get('doc')
+                if doc:
+                    found[row['id']] = dict(doc)
+                    self.document_cache.put(found[row['id']])
+            return [dict(found[doc_id]) if doc_id in found else None for doc_id in doc_ids]
+        except Exception as e:
+            print(f"Error getting documents {doc_ids}: {e}")
+            return [None for _ in doc_ids]
+    
+    def update_document(self, model: BaseModel, rev: Optional[str] = None) -> bool:
+        """Update an existing document.
+        
+        Pass the revision the changes were based on; the save then raises
+        DocumentConflict if the document changed meanwhile.
+        """
+        if self.db is None:
             return False
             
         try:
-            # Get current document to get the latest _rev
-            current_doc = self.get_document(model._id)
-            if not current_doc:
-                return False
+            self._flush_buffered([model._id])
+            if rev is None:
+                # Get the latest _rev without downloading the document
+                rev = self._current_revision(model._id)
+                if not rev:
+                    return False
                 
             # Update the model's _rev
-            model._rev = current_doc['_rev']
+            model._rev = rev
             model.update_timestamp()
             
             # Save the updated document
             doc_data = model.to_dict()
             doc_id, doc_rev = self.db.save(doc_data)
             model._rev = doc_rev
+            self._notify(doc_id, doc_data)
             return True
+        except couchdb.ResourceConflict:
+            raise DocumentConflict(model._id)
         except Exception as e:
             print(f"Error updating document: {e}")
             return False
     
     def delete_document(self, doc_id: str) -> bool:
         """Delete a document by ID"""
-        if not self.db:
+        if self.db is None:
             return False
             
         try:
+            self._flush_buffered([doc_id])
             doc = self.db[doc_id]
-            self.db.delete(doc)
+            # The tombstone keeps type and warehouse_id so filtered changes feeds still see it
+            self.db.save(self._tombstone(doc))
+            self._notify(doc_id, None)
             return True
         except couchdb.ResourceNotFound:
             return False
@@ -85,170 +363,942 @@ class DatabaseService:
             print(f"Error deleting document {doc_id}: {e}")
             return False
     
-    def find_documents(self, doc_type: str, limit: int = 100, skip: int = 0, 
-                      selector: Optional[Dict] = None) -> List[Dict[str, Any]]:
-        """Find documents by type with optional selector"""
-        if not self.db:
+    @staticmethod
+    def _tombstone(doc: Dict[str, Any], rev: Optional[str] = None) -> Dict[str, Any]:
+        """Deletion stub for a document, keeping the fields changes-feed filters select on"""
+        tombstone = {'_id': doc['_id'], '_rev': rev or doc['_rev'], '_deleted': True}
+        for field in ('type', 'warehouse_id'):
+            if field in doc:
+                tombstone[field] = doc[field]
+        return tombstone
+    
+    def _bulk_docs(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write documents in one _bulk_docs request and report the outcome of each.
+        
+        Every result is a dict with `id` and `ok`, plus `rev` on success or
+        `error` ('conflict', 'not_found', 'error') and `reason` on failure.
+        """
+        if not docs:
             return []
+        if self.db is None:
+            return [{'id': doc.get('_id'), 'ok': False, 'error': 'error',
+                     'reason': 'Database unavailable'} for doc in docs]
             
         try:
-            # Use a simple view-based approach for now
-            # In production, you'd want to use Mango queries or views
+            self._flush_buffered([doc.get('_id') for doc in docs])
             results = []
-            for doc_id in self.db:
-                try:
-                    doc = dict(self.db[doc_id])
-                    if doc.get('type') == doc_type:
-                        # Apply selector if provided
-                        if selector:
-                            match = True
-                            for key, value in selector.items():
-                                if doc.get(key) != value:
-                                    match = False
-                                    break
-                            if not match:
-                                continue
-                        results.append(doc)
-                        
-                        if len(results) >= limit + skip:
-                            break
-                except:
-                    continue
+            for success, doc_id, rev_or_exc in self.db.update(docs):
+                if success:
+                    results.append({'id': doc_id, 'ok': True, 'rev': rev_or_exc})
+                else:
+                    error = 'conflict' if isinstance(rev_or_exc, couchdb.ResourceConflict) else 'error'
+                    results.append({'id': doc_id, 'ok': False, 'error': error,
+                                    'reason': str(rev_or_exc)})
+            return results
+        except Exception as e:
+            print(f"Error writing documents in bulk: {e}")
+            return [{'id': doc.get('_id'), 'ok': False, 'error': 'error',
+                     'reason': str(e)} for doc in docs]
+    
+    def save_many(self, documents: List[Union[BaseModel, Dict[str, Any]]],
+                  buffer: bool = True) -> List[Dict[str, Any]]:
+        """Save models or raw documents in a single request.
+        
+        Documents without `_rev` are created, documents carrying one are
+        updated at that revision. Models get their new `_rev` on success.
+        While creates are buffered (start_create_buffer) new documents join
+        the buffer and their results carry `buffered` instead of `rev`;
+        pass buffer=False for writes that must succeed or fail together with
+        updates made alongside them.
+        """
+        docs = [doc.to_dict() if isinstance(doc, BaseModel) else doc for doc in documents]
+        buffered = getattr(self._create_buffer, 'docs', None) if buffer else None
+        if buffered is not None:
+            creates = [doc for doc in docs if '_rev' not in doc and '_id' in doc and not doc.get('_deleted')]
+            created_ids = {doc['_id'] for doc in creates}
+            written = iter(self._bulk_docs([doc for doc in docs if doc.get('_id') not in created_ids]))
+            for doc in creates:
+                buffered[doc['_id']] = (self._create_buffer.tag, doc)
+            results = [{'id': doc['_id'], 'ok': True, 'buffered': True} if doc.get('_id') in created_ids
+                       else next(written) for doc in docs]
+            if len(buffered) >= self.create_buffer_limit:
+                self.flush_creates()
+        else:
+            results = self._bulk_docs(docs)
+        
+        for document, doc, result in zip(documents, docs, results):
+            if not result['ok'] or result.get('buffered'):
+                continue
+            if isinstance(document, BaseModel):
+                document._rev = result['rev']
+            self._notify(result['id'], None if doc.get('_deleted') else doc)
+                
+        return results
+    
+    def update_many(self, documents: List[Union[BaseModel, Dict[str, Any]]],
+                    revs: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """Update existing documents in a single request.
+        
+        `revs` maps document ids to already known revisions. Revisions for
+        the remaining documents are read with one batched request first.
+        """
+        revs = dict(revs or {})
+        missing_ids = [doc._id if isinstance(doc, BaseModel) else doc['_id']
+                       for doc in documents]
+        missing_ids = [doc_id for doc_id in missing_ids if doc_id not in revs]
+        
+        for doc_id, current_doc in zip(missing_ids, self.get_documents(missing_ids)):
+            if current_doc:
+                revs[doc_id] = current_doc['_rev']
+        
+        to_save = []
+        results = {}
+        for document in documents:
+            doc_id = document._id if isinstance(document, BaseModel) else document['_id']
+            if doc_id not in revs:
+                results[id(document)] = {'id': doc_id, 'ok': False, 'error': 'not_found',
+                                         'reason': 'Document not found'}
+                continue
+                
+            if isinstance(document, BaseModel):
+                document._rev = revs[doc_id]
+                document.update_timestamp()
+            else:
+                document['_rev'] = revs[doc_id]
+            to_save.append(document)
+        
+        for document, result in zip(to_save, self.save_many(to_save)):
+            results[id(document)] = result
             
-            # Apply skip and limit
-            return results[skip:skip + limit]
+        return [results[id(document)] for document in documents]
+    
+    def delete_many(self, doc_ids: List[str],
+                    revs: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """Delete documents in a single request, reading unknown revisions in one batch"""
+        revs = dict(revs or {})
+        missing_ids = [doc_id for doc_id in doc_ids if doc_id not in revs]
+        
+        current = {}
+        for doc_id, current_doc in zip(missing_ids, self.get_documents(missing_ids)):
+            if current_doc:
+                revs[doc_id] = current_doc['_rev']
+                current[doc_id] = current_doc
+        
+        tombstones = [self._tombstone(current.get(doc_id, {'_id': doc_id}), revs[doc_id])
+                      for doc_id in doc_ids if doc_id in revs]
+        results = {result['id']: result for result in self._bulk_docs(tombstones)}
+        for result in results.values():
+            if result['ok']:
+                self._notify(result['id'], None)
+        
+        return [results.get(doc_id, {'id': doc_id, 'ok': False, 'error': 'not_found',
+                                     'reason': 'Document not found'})
+                for doc_id in doc_ids]
+    
+    def _find(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a Mango query and return the raw `_find` response (docs, bookmark, warning)"""
+        self._flush_buffered()
+        if self.explain:
+            self._check_full_scan(query)
+        status, headers, data = self.db.resource.post_json('_find', body=query)
+        self.query_stats['queries'] += 1
+        return data
+    
+    def _check_full_scan(self, query: Dict[str, Any]) -> bool:
+        """Report a Mango query that no index can serve"""
+        try:
+            plan = self.db.explain(query)
+        except Exception as e:
+            print(f"Error explaining query: {e}")
+            return False
+            
+        if plan.get('index', {}).get('type') != 'special':
+            return False
+            
+        self.query_stats['full_scans'] += 1
+        print(f"Full scan: no index serves selector {query.get('selector')} sort {query.get('sort')}")
+        return True
+    
+    def explain_query(self, doc_type: str, selector: Optional[Dict] = None,
+                      sort: Optional[List] = None) -> Dict[str, Any]:
+        """Return the CouchDB query plan for a find_documents call"""
+        if self.db is None:
+            return {}
+        return self.db.explain(self._build_query(doc_type, selector, sort=sort))
+    
+    def _iter_find_pages(self, query: Dict[str, Any], batch_size: int = 1000):
+        """Yield the pages of a Mango query, following bookmarks"""
+        query = dict(query, limit=batch_size)
+        query.pop('skip', None)
+        while True:
+            data = self._find(query)
+            docs = data.get('docs', [])
+            yield docs
+            if len(docs) < batch_size or not data.get('bookmark'):
+                break
+            query['bookmark'] = data['bookmark']
+    
+    def _iter_find(self, query: Dict[str, Any], batch_size: int = 1000):
+        """Yield every document matching a Mango query, following bookmarks page by page"""
+        for docs in self._iter_find_pages(query, batch_size):
+            yield from docs
+    
+    def iter_documents(self, doc_type: str, selector: Optional[Dict] = None,
+                       fields: Optional[List[str]] = None, sort: Optional[List] = None,
+                       batch_size: int = 500):
+        """Yield every matching document as pages arrive from CouchDB.
+        
+        Only one page of `batch_size` documents is held at a time, so
+        callers can stream arbitrarily large listings. In ledger mode
+        products carry their ledger stock.
+        """
+        if self.db is None:
+            return
+            
+        query = self._build_query(doc_type, selector, fields, sort)
+        for docs in self._iter_find_pages(query, batch_size):
+            if doc_type == 'product' and not fields:
+                docs = self.overlay_ledger_stock(docs)
+            yield from docs
+    
+    def _build_query(self, doc_type: str, selector: Optional[Dict] = None,
+                     fields: Optional[List[str]] = None,
+                     sort: Optional[List] = None) -> Dict[str, Any]:
+        """Build a Mango query for documents of a type.
+        
+        The selector may use any Mango operator ($gt, $in, $regex, ...). Sort
+        entries are field names or {field: 'asc'|'desc'} dicts; `type` is put
+        in front so the [type, field] indexes can serve the sort.
+        """
+        query_selector = {'type': doc_type}
+        if selector:
+            query_selector.update(selector)
+        query = {'selector': query_selector}
+        
+        if fields:
+            query['fields'] = list(fields)
+        
+        if sort:
+            sort = [s if isinstance(s, dict) else {s: 'asc'} for s in sort]
+            if 'type' not in sort[0]:
+                direction = list(sort[0].values())[0]
+                sort = [{'type': direction}] + sort
+            query['sort'] = sort
+        
+        return query
+    
+    def find_documents(self, doc_type: str, limit: int = 100, skip: int = 0, 
+                      selector: Optional[Dict] = None, fields: Optional[List[str]] = None,
+                      sort: Optional[List] = None) -> List[Dict[str, Any]]:
+        """Find documents by type with optional Mango selector, projection and sort"""
+        if self.db is None:
+            return []
+        
+        if (doc_type == 'product' and not fields and not sort
+                and can_serve_selector(selector) and self.product_cache.is_fresh()):
+            return self.product_cache.find(selector, limit, skip)
+            
+        try:
+            query = self._build_query(doc_type, selector, fields, sort)
+            query['limit'] = limit
+            query['skip'] = skip
+            return self._find(query).get('docs', [])
         except Exception as e:
             print(f"Error finding documents: {e}")
             return []
     
+    @staticmethod
+    def _encode_cursor(position: Dict[str, Any]) -> str:
+        """Opaque, URL-safe pagination token"""
+        return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Dict[str, Any]:
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except ValueError:
+            raise InvalidCursor(cursor)
+        if not isinstance(position, dict) or not ({'bookmark', 'after'} & set(position)):
+            raise InvalidCursor(cursor)
+        return position
+    
+    def find_page(self, doc_type: str, limit: int = 100, selector: Optional[Dict] = None,
+                  fields: Optional[List[str]] = None, sort: Optional[List] = None,
+                  cursor: Optional[str] = None, skip: int = 0) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of a find_documents query and the cursor of the next page (None at the end).
+        
+        The cursor records where the page stopped: a Mango bookmark, from
+        which CouchDB resumes at the last index key and _id, or the last _id
+        for pages served by the product cache. Later pages therefore cost the
+        same as the first. `skip` is still honoured on the first page.
+        Raises InvalidCursor for a token it did not issue.
+        """
+        position = self._decode_cursor(cursor) if cursor else {}
+        if self.db is None:
+            return [], None
+            
+        if (doc_type == 'product' and not fields and not sort and 'bookmark' not in position
+                and can_serve_selector(selector) and self.product_cache.is_fresh()):
+            docs = self.product_cache.find(selector, limit, 0 if position else skip, after=position.get('after'))
+            next_cursor = self._encode_cursor({'after': docs[-1]['_id']}) if len(docs) == limit else None
+            return docs, next_cursor
+            
+        try:
+            query = self._build_query(doc_type, selector, fields, sort)
+            query['limit'] = limit
+            if 'bookmark' in position:
+                query['bookmark'] = position['bookmark']
+            elif 'after' in position:
+                query['selector']['_id'] = {'$gt': position['after']}
+            elif skip:
+                query['skip'] = skip
+            data = self._find(query)
+            docs = data.get('docs', [])
+            next_cursor = None
+            if len(docs) == limit and data.get('bookmark'):
+                next_cursor = self._encode_cursor({'bookmark': data['bookmark']})
+            return docs, next_cursor
+        except Exception as e:
+            print(f"Error finding documents: {e}")
+            return [], None
+    
+    def build_product_index(self) -> bool:
+        """(Re)build the in-memory product search index from the database"""
+        if self.db is None:
+            return False
+            
+        try:
+            with self._product_index_lock:
+                self.product_index.build(self._iter_find(self._build_query('product')))
+            return True
+        except Exception as e:
+            print(f"Error building product search index: {e}")
+            return False
+    
     def search_products(self, query: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Search products by name, SKU, or description"""
-        if not self.db:
+        """Search products by name, SKU, barcode or description (ranked, typo tolerant)"""
+        if self.db is None:
             return []
             
         try:
-            results = []
-            query_lower = query.lower()
-            
-            for doc_id in self.db:
-                try:
-                    doc = dict(self.db[doc_id])
-                    if doc.get('type') == 'product':
-                        # Simple text search
-                        searchable_text = (
-                            doc.get('name', '').lower() + ' ' +
-                            doc.get('sku', '').lower() + ' ' +
-                            doc.get('description', '').lower()
-                        )
-                        
-                        if query_lower in searchable_text:
-                            results.append(doc)
-                            
-                        if len(results) >= limit:
-                            break
-                except:
-                    continue
-                    
-            return results
+            if not self.product_index.built and not self.build_product_index():
+                return []
+            return self.product_index.search(query, limit)
         except Exception as e:
             print(f"Error searching products: {e}")
             return []
     
-    def get_low_stock_products(self, warehouse_id: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get products that are below their reorder point"""
-        if not self.db:
+    def build_customer_index(self) -> bool:
+        """(Re)build the in-memory customer index from the database"""
+        if self.db is None:
+            return False
+            
+        try:
+            with self._customer_index_lock:
+                # Take the sequence first so customers written during the read are replayed
+                since = self.db.info()['update_seq']
+                self.customer_index.build(self._iter_find(self._build_query('customer')), since)
+            return True
+        except Exception as e:
+            print(f"Error building customer index: {e}")
+            return False
+    
+    def start_customer_index_refresh(self, interval: float = 30.0):
+        """Pick up customers written by other processes every `interval` seconds on a background thread"""
+        if self._customer_refresh_thread and self._customer_refresh_thread.is_alive():
+            return
+            
+        def run():
+            while True:
+                time.sleep(interval)
+                self.customer_index.refresh(self.db)
+        
+        self._customer_refresh_thread = threading.Thread(target=run, daemon=True)
+        self._customer_refresh_thread.start()
+    
+    def search_customers(self, query: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Search customers by name word prefixes, email or phone number (any Nigerian format)"""
+        if self.db is None:
             return []
             
         try:
-            results = []
+            if not self.customer_index.built and not self.build_customer_index():
+                return []
+            return self.customer_index.search(query, limit)
+        except Exception as e:
+            print(f"Error searching customers: {e}")
+            return []
+    
+    def find_customers_by_email(self, email: str) -> Optional[List[Dict[str, Any]]]:
+        """Customers with an email (ignoring case), from the customer index.
+        
+        Customers still in a batch's create buffer are written first, and the
+        index catches up with the changes feed, so it also sees customers
+        other processes created. Returns None when the index cannot be built
+        or brought up to date, so a uniqueness check never passes just
+        because the lookup failed.
+        """
+        if self.db is None:
+            return None
             
-            for doc_id in self.db:
-                try:
-                    doc = dict(self.db[doc_id])
-                    if doc.get('type') == 'product':
-                        reorder_point = doc.get('reorder_point', 0)
-                        current_stock = doc.get('current_stock', {})
-                        
-                        if warehouse_id:
-                            stock = current_stock.get(warehouse_id, 0)
-                            if stock <= reorder_point:
-                                results.append(doc)
-                        else:
-                            total_stock = sum(current_stock.values())
-                            if total_stock <= reorder_point:
-                                results.append(doc)
-                except:
-                    continue
+        self._flush_buffered()
+        if not self.customer_index.built and not self.build_customer_index():
+            return None
+        if not self.customer_index.refresh(self.db):
+            return None
+        return self.customer_index.find_by_email(email)
+    
+    def build_low_stock_index(self) -> bool:
+        """(Re)build the low-stock index from every product and warehouse"""
+        if self.db is None:
+            return False
+            
+        try:
+            if self.product_cache.is_fresh():
+                products = self.product_cache.all()
+            else:
+                products = self._iter_find(self._build_query('product'))
+            
+            if self.stock_ledger_mode:
+                products = self.overlay_ledger_stock(list(products), all_products=True)
+            
+            warehouse_ids = [doc['_id'] for doc in self._iter_find(self._build_query('warehouse', fields=['_id']))]
+            self.low_stock_index.build(products, warehouse_ids)
+            return True
+        except Exception as e:
+            print(f"Error building low stock index: {e}")
+            return False
+    
+    def _update_low_stock_index(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """Product and warehouse listener for the low-stock index.
+        
+        In ledger mode product documents do not carry the real stock, so an
+        edit (say of reorder_point) keeps the levels the index already has.
+        """
+        if not self.low_stock_index.built:
+            return
+        if doc is None or doc.get('_deleted') or not self.stock_ledger_mode or doc.get('type') != 'product':
+            self.low_stock_index.on_change(doc_id, doc)
+        else:
+            self.low_stock_index.update(doc, stock=self.low_stock_index.stock_of(doc_id))
+    
+    def _refresh_low_stock(self, product_ids: List[str]):
+        """Re-read the ledger stock of products whose movements were just written"""
+        if not self.low_stock_index.built or not product_ids:
+            return
+        products = self.overlay_ledger_stock(self.get_documents(product_ids))
+        for product in products:
+            if product:
+                self.low_stock_index.update(product)
+    
+    def get_sales_velocity(self, warehouse_id: Optional[str] = None) -> Dict[str, float]:
+        """Average units sold per day per product over the last `sales_velocity_days` days.
+        
+        Read from the daily sales rollups once they are built, otherwise
+        from the items_by_warehouse_date view, and cached for
+        `sales_velocity_ttl` seconds per warehouse.
+        """
+        cached = self._velocity_cache.get(warehouse_id)
+        if cached and time.time() - cached[0] < self.sales_velocity_ttl:
+            return cached[1]
+            
+        end_day = datetime.utcnow().date()
+        start_day = end_day - timedelta(days=self.sales_velocity_days - 1)
+        sold = {}
+        if self.sales_rollups.is_built():
+            for rollup in self.sales_rollups.load(start_day.isoformat(), end_day.isoformat(), warehouse_id or None):
+                for product_id, (quantity, revenue) in rollup.get('products', {}).items():
+                    sold[product_id] = sold.get(product_id, 0) + quantity
+        else:
+            for row in self.db.view('sales_reports/items_by_warehouse_date',
+                                    startkey=[warehouse_id or None, start_day.isoformat()],
+                                    endkey=[warehouse_id or None, end_day.isoformat(), {}],
+                                    group_level=3):
+                product_id = row.key[2]
+                sold[product_id] = sold.get(product_id, 0) + row.value[0]
+        
+        velocity = {product_id: quantity / self.sales_velocity_days for product_id, quantity in sold.items()}
+        self._velocity_cache[warehouse_id] = (time.time(), velocity)
+        return velocity
+    
+    def get_low_stock_products(self, warehouse_id: Optional[str] = None,
+                               order_by: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get products that are below their reorder point.
+        
+        Served from the low-stock index; raises UnknownWarehouse for a
+        warehouse id the index does not know. With order_by='days_of_cover' each
+        product gets a `days_of_cover` field (stock divided by its recent
+        daily sales, None when it has not sold) and the list is ordered by it,
+        products running out soonest first.
+        """
+        if self.db is None:
+            return []
+            
+        try:
+            if not self.low_stock_index.built and not self.build_low_stock_index():
+                return []
+            if warehouse_id and not self.low_stock_index.has_warehouse(warehouse_id):
+                raise UnknownWarehouse(warehouse_id)
+            results = self.low_stock_index.get(warehouse_id)
+            
+            if order_by == 'days_of_cover':
+                velocity = self.get_sales_velocity(warehouse_id)
+                for doc in results:
+                    current_stock = doc.get('current_stock', {})
+                    stock = current_stock.get(warehouse_id, 0) if warehouse_id else sum(current_stock.values())
+                    daily = velocity.get(doc['_id'], 0)
+                    doc['days_of_cover'] = round(stock / daily, 1) if daily else None
+                results.sort(key=lambda doc: (doc['days_of_cover'] is None, doc['days_of_cover'] or 0))
                     
             return results
+        except UnknownWarehouse:
+            raise
         except Exception as e:
             print(f"Error getting low stock products: {e}")
             return []
     
-    def get_sales_by_date_range(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
-        """Get sales orders within a date range"""
-        if not self.db:
+    def get_similar_products(self, product_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Products often bought with a product, then best sellers from its category.
+        
+        Served from the co-purchase index, built at startup and refreshed from
+        the changes feed every CO_PURCHASE_REFRESH_INTERVAL seconds in the
+        background. Each product carries a `similarity` field with the reason
+        and score; nothing is returned until the index is built.
+        """
+        if self.db is None:
             return []
             
         try:
-            results = []
-            
-            for doc_id in self.db:
-                try:
-                    doc = dict(self.db[doc_id])
-                    if doc.get('type') == 'sales_order':
-                        order_date = doc.get('order_date', '')
-                        if start_date <= order_date <= end_date:
-                            results.append(doc)
-                except:
-                    continue
-                    
-            # Sort by date
-            results.sort(key=lambda x: x.get('order_date', ''), reverse=True)
-            return results
+            if not self.co_purchase.built:
+                return []
+            matches = self.co_purchase.similar(product_id, limit)
+            products = self.overlay_ledger_stock(
+                [doc for doc in self.get_documents([match['product_id'] for match in matches]) if doc]
+            )
+            by_id = {doc['_id']: doc for doc in products}
+            return [dict(by_id[match['product_id']], similarity={'reason': match['reason'], 'score': match['score']})
+                    for match in matches if match['product_id'] in by_id]
         except Exception as e:
-            print(f"Error getting sales by date range: {e}")
+            print(f"Error getting similar products for {product_id}: {e}")
             return []
     
+    def apply_stock_delta(self, product_id: str, warehouse_id: str, quantity_change: int) -> Dict[str, Any]:
+        """Change one warehouse quantity atomically with the stock/apply_delta update handler.
+        
+        The read-modify-write happens inside CouchDB in a single request; a
+        change that would take the quantity below zero is refused, and a
+        write that races another one is retried up to `stock_update_retries`
+        times. Returns {'ok': True, 'quantity', 'previous', 'rev'} or
+        {'ok': False, 'error'} ('not_found', 'insufficient_stock', 'conflict'
+        or 'error').
+        """
+        if self.db is None:
+            return {'ok': False, 'error': 'error'}
+            
+        self._flush_buffered([product_id])
+        body = json.dumps({
+            'warehouse_id': warehouse_id,
+            'quantity_change': quantity_change,
+            'updated_at': datetime.utcnow().isoformat()
+        })
+        
+        for attempt in range(self.stock_update_retries + 1):
+            try:
+                headers, response = self.db.update_doc(
+                    'stock/apply_delta', product_id, body=body,
+                    headers={'Content-Type': 'application/json'}
+                )
+                data = json.loads(response.read())
+                doc = data['doc']
+                doc['_rev'] = headers.get('X-Couch-Update-NewRev')
+                self.stock_stats['updates'] += 1
+                self._notify(product_id, doc)
+                return {'ok': True, 'quantity': data['quantity'], 'previous': data['previous'],
+                        'rev': doc['_rev']}
+            except couchdb.ResourceNotFound:
+                return {'ok': False, 'error': 'not_found'}
+            except couchdb.ResourceConflict as e:
+                if 'insufficient_stock' in str(e):
+                    return {'ok': False, 'error': 'insufficient_stock'}
+                self.stock_stats['conflicts'] += 1
+                if attempt < self.stock_update_retries:
+                    self.stock_stats['retries'] += 1
+                    time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+            except Exception as e:
+                print(f"Error applying stock change to {product_id}: {e}")
+                return {'ok': False, 'error': 'error'}
+        
+        self.stock_stats['failed'] += 1
+        return {'ok': False, 'error': 'conflict'}
+    
     def update_product_stock(self, product_id: str, warehouse_id: str, 
                            quantity_change: int, movement_type: str, 
                            reference_id: str = '', reference_type: str = '') -> bool:
-        """Update product stock and create inventory movement record"""
-        if not self.db:
+        """Update product stock and create inventory movement record.
+        
+        The stock change is applied server side in one request (see
+        `apply_stock_delta`), so concurrent tills never overwrite each other.
+        Raises InsufficientStock, in either stock mode, for a change that
+        would take the warehouse below zero.
+        """
+        if self.stock_ledger_mode:
+            if quantity_change < 0:
+                product = self.get_document(product_id)
+                if not product:
+                    return False
+                stock = self.overlay_ledger_stock([product])[0].get('current_stock', {})
+                if stock.get(warehouse_id, 0) + quantity_change < 0:
+                    raise InsufficientStock(product_id)
+            results = self.update_product_stock_many([{
+                'product_id': product_id,
+                'warehouse_id': warehouse_id,
+                'quantity_change': quantity_change
+            }], movement_type, reference_id, reference_type)
+            return bool(results) and all(result['ok'] for result in results)
+            
+        result = self.apply_stock_delta(product_id, warehouse_id, quantity_change)
+        if result.get('error') == 'insufficient_stock':
+            raise InsufficientStock(product_id)
+        if not result['ok']:
             return False
             
+        movement = InventoryMovement(
+            product_id=product_id,
+            warehouse_id=warehouse_id,
+            quantity_change=quantity_change,
+            movement_type=movement_type,
+            reference_id=reference_id,
+            reference_type=reference_type
+        )
+        return self.create_document(movement) is not None
+    
+    def update_product_stock_many(self, changes: List[Dict[str, Any]], movement_type: str,
+                                  reference_id: str = '', reference_type: str = '',
+                                  extra_documents: Optional[List[Union[BaseModel, Dict[str, Any]]]] = None
+                                  ) -> List[Dict[str, Any]]:
+        """Apply several stock changes and write them with their movements in one request.
+        
+        Each change has `product_id`, `warehouse_id`, `quantity_change` and
+        optionally the current `product_doc` and its own `reference_id`;
+        products not supplied are read in one batch. `extra_documents` (e.g. the sales order) are written in
+        the same _bulk_docs call, ahead of the products and movements.
+        
+        A product whose changes would take a warehouse below zero is refused
+        ('insufficient_stock'), also when a retry after a conflict finds less
+        stock than was read; its movements are then not kept, so a movement
+        is only ever written for stock that changed.
+        
+        Returns one result per written document (see `_bulk_docs`). Products
+        that do not exist are reported as 'not_found' and get no movement.
+        Movement results also carry the `product_id` and `reference_id` of
+        their change. Nothing is left in a batch's create buffer, so every result is final.
+        """
+        if self.db is None:
+            return []
+            
         try:
-            # Get the product
-            product_doc = self.get_document(product_id)
-            if not product_doc:
-                return False
-            
-            # Update stock
-            current_stock = product_doc.get('current_stock', {})
-            current_qty = current_stock.get(warehouse_id, 0)
-            new_qty = max(0, current_qty + quantity_change)
-            current_stock[warehouse_id] = new_qty
-            product_doc['current_stock'] = current_stock
-            
-            # Save updated product
-            self.db.save(product_doc)
-            
-            # Create inventory movement record
-            movement = InventoryMovement(
-                product_id=product_id,
-                warehouse_id=warehouse_id,
-                quantity_change=quantity_change,
-                movement_type=movement_type,
-                reference_id=reference_id,
-                reference_type=reference_type
-            )
+            products = {}
+            for change in changes:
+                if change.get('product_doc'):
+                    products.setdefault(change['product_id'], change['product_doc'])
             
-            self.create_document(movement)
-            return True
+            missing_ids = [change['product_id'] for change in changes
+                           if change['product_id'] not in products]
+            for product_id, product_doc in zip(missing_ids, self.get_documents(missing_ids)):
+                products[product_id] = product_doc
+            
+            documents = list(extra_documents or [])
+            movements = []
+            not_found = []
+            touched = {}
+            product_changes = {}
+            
+            for change in changes:
+                product_id = change['product_id']
+                product_doc = products.get(product_id)
+                if not product_doc:
+                    not_found.append({'id': product_id, 'ok': False, 'error': 'not_found',
+                                      'reason': 'Product not found'})
+                    continue
+                
+                touched[product_id] = product_doc
+                product_changes.setdefault(product_id, []).append(change)
+                
+                # Create inventory movement record
+                movements.append(InventoryMovement(
+                    product_id=product_id,
+                    warehouse_id=change['warehouse_id'],
+                    quantity_change=change['quantity_change'],
+                    movement_type=movement_type,
+                    reference_id=change.get('reference_id', reference_id),
+                    reference_type=reference_type
+                ))
+            
+            if self.stock_ledger_mode:
+                # The movements are the stock; products are not rewritten
+                results = self.save_many(documents + movements, buffer=False)
+                self._label_movement_results(results[len(documents):], movements)
+                self._refresh_low_stock(list(touched))
+                return results + not_found
+            
+            refused = []
+            for product_id, product_doc in list(touched.items()):
+                if not self._apply_stock_changes(product_doc, product_changes[product_id]):
+                    refused.append(self._insufficient_stock(product_id))
+                    del touched[product_id]
+            movements = [movement for movement in movements if movement.product_id in touched]
+            
+            documents.extend(touched.values())
+            documents.extend(movements)
+            # Not buffered: a failed order or movement must be seen here, while
+            # the stock written with it can still be rolled back
+            results = self.save_many(documents, buffer=False)
+            self._label_movement_results(results[len(documents) - len(movements):], movements)
+            self.stock_stats['updates'] += len(touched)
+            
+            # Compare-and-swap: products changed by someone else since they
+            # were read are re-read and the same deltas applied again
+            for attempt in range(self.stock_update_retries + 1):
+                conflicted = [result['id'] for result in results
+                              if result['id'] in touched and result.get('error') == 'conflict']
+                if not conflicted:
+                    break
+                self.stock_stats['conflicts'] += len(conflicted)
+                if attempt == self.stock_update_retries:
+                    self.stock_stats['failed'] += len(conflicted)
+                    break
+                    
+                self.stock_stats['retries'] += len(conflicted)
+                time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+                retried = {}
+                fresh = []
+                for product_doc in self.get_documents(conflicted):
+                    if not product_doc:
+                        continue
+                    if self._apply_stock_changes(product_doc, product_changes[product_doc['_id']]):
+                        fresh.append(product_doc)
+                    else:
+                        retried[product_doc['_id']] = self._insufficient_stock(product_doc['_id'])
+                retried.update((result['id'], result) for result in self.save_many(fresh, buffer=False))
+                results = [retried.get(result['id'], result) for result in results]
+            
+            self._discard_stray_movements(results, movements)
+            return results + refused + not_found
             
         except Exception as e:
             print(f"Error updating product stock: {e}")
+            return []
+    
+    @staticmethod
+    def _insufficient_stock(product_id: str) -> Dict[str, Any]:
+        return {'id': product_id, 'ok': False, 'error': 'insufficient_stock', 'reason': 'Insufficient stock'}
+    
+    def _discard_stray_movements(self, results: List[Dict[str, Any]], movements: List[InventoryMovement]):
+        """Delete the written movements of products whose stock change was not written after all.
+        
+        Their results are turned into the product's failure, so callers see
+        the change as not taken.
+        """
+        product_results = {result['id']: result for result in results if 'reference_id' not in result}
+        by_id = {movement._id: movement for movement in movements}
+        stray = [(index, result) for index, result in enumerate(results)
+                 if result.get('ok') and 'reference_id' in result
+                 and not product_results.get(result['product_id'], {}).get('ok')]
+        if not stray:
+            return
+        
+        tombstones = [self._tombstone(by_id[result['id']].to_dict(), result['rev']) for index, result in stray]
+        for (index, result), deleted in zip(stray, self._bulk_docs(tombstones)):
+            failure = product_results.get(result['product_id'], {})
+            results[index] = dict(result, ok=False, error=failure.get('error', 'error'),
+                                  reason=failure.get('reason', ''))
+            if deleted['ok']:
+                self._notify(result['id'], None)
+            else:
+                self.stock_stats['stray_movements'] += 1
+                print(f"Failed to delete movement {result['id']} of unchanged product "
+                      f"{result['product_id']}: {deleted.get('reason')}")
+    
+    @staticmethod
+    def _label_movement_results(results: List[Dict[str, Any]], movements: List[InventoryMovement]):
+        """Mark movement write results with the product and reference they belong to"""
+        for result, movement in zip(results, movements):
+            result['product_id'] = movement.product_id
+            result['reference_id'] = movement.reference_id
+    
+    @staticmethod
+    def _apply_stock_changes(product_doc: Dict[str, Any], changes: List[Dict[str, Any]]) -> bool:
+        """Apply stock deltas to a product document in place.
+        
+        Returns False, leaving the document unchanged, if a warehouse that is
+        drawn from would go below zero.
+        """
+        current_stock = dict(product_doc.get('current_stock', {}))
+        drawn = set()
+        for change in changes:
+            current_stock[change['warehouse_id']] = (current_stock.get(change['warehouse_id'], 0)
+                                                     + change['quantity_change'])
+            if change['quantity_change'] < 0:
+                drawn.add(change['warehouse_id'])
+        if any(current_stock[warehouse_id] < 0 for warehouse_id in drawn):
             return False
+        product_doc['current_stock'] = current_stock
+        return True
+    
+    def overlay_ledger_stock(self, products: List[Dict[str, Any]],
+                             all_products: bool = False) -> List[Dict[str, Any]]:
+        """In ledger mode, return copies of product documents carrying the ledger stock levels.
+        
+        Anything built from the documents afterwards (Product.get_total_stock,
+        availability checks, low-stock filters) then sees ledger stock. Pass
+        `all_products` when the list covers every product, to read the whole
+        ledger at once. Outside ledger mode the products are returned as is.
+        """
+        if not self.stock_ledger_mode or not products:
+            return products
+            
+        try:
+            product_ids = None if all_products else [product['_id'] for product in products if product]
+            stock = self.stock_ledger.get_stock(product_ids)
+            return [dict(product, current_stock=stock.get(product['_id'], {}))
+                    if product and product.get('type') == 'product' else product
+                    for product in products]
+        except Exception as e:
+            print(f"Error reading ledger stock: {e}")
+            return products
+    
+    def get_changes(self, since: Optional[str] = None, types: Optional[List[str]] = None,
+                    warehouse_id: Optional[str] = None, limit: int = 500,
+                    longpoll: bool = False, timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+        """Documents changed after a changes-feed sequence, for incremental client sync.
+        
+        Reads `_changes` with a selector on type (and on warehouse_id for
+        documents that have one), so a client only receives what it keeps.
+        Returns {'upserts', 'deletes', 'last_seq', 'pending'}: the current
+        version of each changed document, {'id', 'type'} for each deleted one
+        (type is None for tombstones written before deletions kept it) and
+        the sequence to pass as `since` next time. With `longpoll` the call
+        waits up to `timeout` seconds for a change when there is none yet.
+        
+        In ledger mode stock moves without product writes, so the products
+        named by new inventory movements are sent as well, with ledger stock.
+        """
+        if self.db is None:
+            return None
+            
+        types = list(types or SYNC_TYPES)
+        refresh_stock = self.stock_ledger_mode and 'product' in types
+        feed_types = types + ['inventory_movement'] if refresh_stock and 'inventory_movement' not in types else types
+        
+        selector = {'$or': [{'type': {'$in': feed_types}},
+                            {'_deleted': True, 'type': {'$exists': False}}]}
+        if warehouse_id:
+            selector = {'$and': [selector, {'$or': [{'warehouse_id': {'$exists': False}},
+                                                    {'warehouse_id': warehouse_id}]}]}
+        options = {
+            'since': since or 0,
+            'limit': limit,
+            'include_docs': 'true',
+            'filter': '_selector',
+            '_selector': {'selector': selector}
+        }
+        
+        db = self.db
+        if longpoll:
+            # A long poll holds its connection, so it goes through the feed session
+            if self._feed_db is None:
+                self._feed_db = db_config.get_feed_database(self.db_name)
+            db = self._feed_db if self._feed_db is not None else self.db
+            options.update(feed='longpoll', timeout=int(timeout * 1000))
+            
+        try:
+            data = db.changes(**options)
+        except Exception as e:
+            print(f"Error reading changes since {since}: {e}")
+            return None
+        
+        upserts, deletes, moved = [], [], set()
+        for change in data.get('results', []):
+            doc = change.get('doc') or {}
+            doc_type = doc.get('type')
+            if change.get('deleted'):
+                if doc_type is None or doc_type in types:
+                    deletes.append({'id': change['id'], 'type': doc_type})
+            else:
+                if doc_type in types:
+                    upserts.append(doc)
+                if refresh_stock and doc_type == 'inventory_movement':
+                    moved.add(doc.get('product_id'))
+        
+        if refresh_stock:
+            sent = {doc['_id'] for doc in upserts if doc.get('type') == 'product'}
+            upserts.extend(doc for doc in self.get_documents(sorted(moved - sent - {None}))
+                           if doc and doc.get('type') == 'product')
+            upserts = self.overlay_ledger_stock(upserts)
+        
+        return {
+            'upserts': upserts,
+            'deletes': deletes,
+            'last_seq': data.get('last_seq', since),
+            'pending': data.get('pending', 0)
+        }
+    
+    def seed_stock_checkpoints(self, products: Optional[List[Dict[str, Any]]] = None,
+                               as_of: Optional[str] = None) -> int:
+        """Create ledger checkpoints from product current_stock where none exist yet"""
+        if self.db is None:
+            return 0
+            
+        try:
+            if products is None:
+                products = self._iter_find(self._build_query('product'))
+            return self.stock_ledger.seed(products, as_of)
+        except Exception as e:
+            print(f"Error seeding stock checkpoints: {e}")
+            return 0
+    
+    def checkpoint_stock_levels(self, seed_from_products: bool = False) -> int:
+        """Move the ledger checkpoints forward; optionally seed missing ones from products first"""
+        if self.db is None:
+            return 0
+            
+        written = self.seed_stock_checkpoints() if seed_from_products else 0
+        try:
+            return written + self.stock_ledger.checkpoint()
+        except Exception as e:
+            print(f"Error writing stock checkpoints: {e}")
+            return written
+    
+    def start_stock_checkpoints(self, interval: float = 300.0):
+        """Checkpoint the ledger every `interval` seconds on a background thread"""
+        if self._checkpoint_thread and self._checkpoint_thread.is_alive():
+            return
+            
+        def run():
+            while True:
+                time.sleep(interval)
+                self.checkpoint_stock_levels()
+                # Picks up movements written by other processes
+                if self.low_stock_index.built:
+                    self.build_low_stock_index()
+        
+        self._checkpoint_thread = threading.Thread(target=run, daemon=True)
+        self._checkpoint_thread.start()
+    
+    def rebuild_sales_rollups(self, start_day: Optional[str] = None, end_day: Optional[str] = None) -> int:
+        """Recompute the daily sales rollups from the orders, for every day or a day range"""
+        if self.db is None:
+            return 0
+            
+        start_day, end_day = start_day or '0000-00-00', end_day or '9999-99-99'
+        try:
+            orders = self.iter_documents('sales_order', {
+                'order_date': {'$gte': start_day, '$lte': end_day + '\ufff0'}
+            })
+            return self.sales_rollups.rebuild(orders, start_day, end_day)
+        except Exception as e:
+            print(f"Error rebuilding sales rollups: {e}")
+            return 0
     
     def create_audit_log(self, user_id: str, username: str, action_type: str,
                         entity_id: str, entity_type: str, changes: Dict = None,
@@ -0,0 +1,89 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
+
+class DocumentCache:
+    """Bounded LRU cache of documents with TTL and cheap revision checks.
+
+    Entries younger than `revalidate_after` seconds are served as is. Older
+    ones are checked with `revalidate(doc_id, rev)`, which should answer
+    whether the stored revision is still current (a HEAD request comparing
+    the ETag); a current entry is refreshed without downloading the body
+    again. Entries older than `ttl` are dropped outright.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0, revalidate_after: float = 5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.revalidate_after = revalidate_after
+        self.entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'stale': 0,
+                      'evictions': 0, 'expired': 0}
+        self._lock = threading.Lock()
+
+    def get(self, doc_id: str, revalidate: Callable[[str, str], Optional[bool]]) -> Optional[Dict[str, Any]]:
+        """Return a copy of a cached document, or None if it has to be fetched"""
+        with self._lock:
+            entry = self.entries.get(doc_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            age = time.time() - entry['stored_at']
+            if age > self.ttl:
+                del self.entries[doc_id]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(doc_id)
+            checked_at = entry['checked_at']
+            doc = entry['doc']
+
+        if time.time() - checked_at > self.revalidate_after:
+            self.stats['revalidations'] += 1
+            if not revalidate(doc_id, doc['_rev']):
+                self.stats['stale'] += 1
+                self.invalidate(doc_id)
+                return None
+            with self._lock:
+                if doc_id in self.entries:
+                    self.entries[doc_id]['checked_at'] = time.time()
+
+        self.stats['hits'] += 1
+        return copy.deepcopy(doc)
+
+    def put(self, doc: Dict[str, Any]):
+        """Store (write through) the current revision of a document"""
+        if not doc.get('_id') or not doc.get('_rev') or self.max_size <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self.entries[doc['_id']] = {'doc': copy.deepcopy(doc), 'stored_at': now, 'checked_at': now}
+            self.entries.move_to_end(doc['_id'])
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, doc_id: str):
+        """Forget a document"""
+        with self._lock:
+            self.entries.pop(doc_id, None)
+
+    def on_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """DatabaseService listener: write through saves, drop deletions"""
+        if doc is None or doc.get('_deleted'):
+            self.invalidate(doc_id)
+        else:
+            self.put(doc)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters plus current size and limits, for tuning per deployment"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats,
+                        size=len(self.entries),
+                        max_size=self.max_size,
+                        ttl=self.ttl,
+                        revalidate_after=self.revalidate_after,
+                        hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else 0.0)
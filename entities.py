@@ -1,20 +1,30 @@
 from flask import Blueprint, jsonify, request
-from src.services.database_service import db_service
+from src.services.database_service import db_service, InvalidCursor, DocumentConflict
+from src.routes.responses import conditional
 from src.models.inventory import Category, Supplier, Customer, Warehouse
 
 # Categories Blueprint
 category_bp = Blueprint('category', __name__)
 
 @category_bp.route('/categories', methods=['GET'])
+@conditional('category')
 def get_categories():
     """Get all categories"""
     try:
-        categories = db_service.find_documents('category', limit=200)
+        limit = int(request.args.get('limit', 200))
+        cursor = request.args.get('cursor')
+        categories, next_cursor = db_service.find_page('category', limit, cursor=cursor)
         return jsonify({
             'success': True,
             'data': categories,
-            'count': len(categories)
+            'count': len(categories),
+            'next': next_cursor
         })
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -83,7 +93,7 @@ def update_category(category_id):
         if 'is_active' in data:
             category.is_active = data['is_active']
         
-        if db_service.update_document(category):
+        if db_service.update_document(category, rev=existing_category.get('_rev')):
             updated_category = db_service.get_document(category_id)
             return jsonify({
                 'success': True,
@@ -95,6 +105,11 @@ def update_category(category_id):
                 'error': 'Failed to update category'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Category was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -105,15 +120,24 @@ def update_category(category_id):
 supplier_bp = Blueprint('supplier', __name__)
 
 @supplier_bp.route('/suppliers', methods=['GET'])
+@conditional('supplier')
 def get_suppliers():
     """Get all suppliers"""
     try:
-        suppliers = db_service.find_documents('supplier', limit=200)
+        limit = int(request.args.get('limit', 200))
+        cursor = request.args.get('cursor')
+        suppliers, next_cursor = db_service.find_page('supplier', limit, cursor=cursor)
         return jsonify({
             'success': True,
             'data': suppliers,
-            'count': len(suppliers)
+            'count': len(suppliers),
+            'next': next_cursor
         })
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -191,7 +215,7 @@ def update_supplier(supplier_id):
         if 'is_active' in data:
             supplier.is_active = data['is_active']
         
-        if db_service.update_document(supplier):
+        if db_service.update_document(supplier, rev=existing_supplier.get('_rev')):
             updated_supplier = db_service.get_document(supplier_id)
             return jsonify({
                 'success': True,
@@ -203,6 +227,11 @@ def update_supplier(supplier_id):
                 'error': 'Failed to update supplier'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Supplier was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -213,36 +242,32 @@ def update_supplier(supplier_id):
 customer_bp = Blueprint('customer', __name__)
 
 @customer_bp.route('/customers', methods=['GET'])
+@conditional('customer')
 def get_customers():
     """Get all customers"""
     try:
         search = request.args.get('search', '')
         limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
+        next_cursor = None
         
         if search:
-            # Simple search by name, email, or phone
-            all_customers = db_service.find_documents('customer', limit=500)
-            customers = []
-            search_lower = search.lower()
-            
-            for customer in all_customers:
-                searchable_text = (
-                    customer.get('name', '').lower() + ' ' +
-                    customer.get('email', '').lower() + ' ' +
-                    customer.get('phone', '').lower()
-                )
-                if search_lower in searchable_text:
-                    customers.append(customer)
-                    if len(customers) >= limit:
-                        break
+            # Name word prefixes, email or phone number, from the customer index
+            customers = db_service.search_customers(search, limit)
         else:
-            customers = db_service.find_documents('customer', limit=limit)
+            customers, next_cursor = db_service.find_page('customer', limit, cursor=cursor)
         
         return jsonify({
             'success': True,
             'data': customers,
-            'count': len(customers)
+            'count': len(customers),
+            'next': next_cursor
         })
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -263,7 +288,12 @@ def create_customer():
         
         # Check if email already exists (if provided)
         if data.get('email'):
-            existing_customers = db_service.find_documents('customer', selector={'email': data['email']})
+            existing_customers = db_service.find_customers_by_email(data['email'])
+            if existing_customers is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Could not check for an existing customer with this email'
+                }), 500
             if existing_customers:
                 return jsonify({
                     'success': False,
@@ -313,8 +343,15 @@ def update_customer(customer_id):
             }), 404
         
         # Check email uniqueness if being changed
-        if 'email' in data and data['email'] != existing_customer.get('email'):
-            conflicting_customers = db_service.find_documents('customer', selector={'email': data['email']})
+        if data.get('email') and data['email'] != existing_customer.get('email'):
+            existing_customers = db_service.find_customers_by_email(data['email'])
+            if existing_customers is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Could not check for an existing customer with this email'
+                }), 500
+            conflicting_customers = [customer for customer in existing_customers
+                                     if customer['_id'] != customer_id]
             if conflicting_customers:
                 return jsonify({
                     'success': False,
@@ -338,7 +375,7 @@ def update_customer(customer_id):
         if 'is_active' in data:
             customer.is_active = data['is_active']
         
-        if db_service.update_document(customer):
+        if db_service.update_document(customer, rev=existing_customer.get('_rev')):
             updated_customer = db_service.get_document(customer_id)
             return jsonify({
                 'success': True,
@@ -350,6 +387,11 @@ def update_customer(customer_id):
                 'error': 'Failed to update customer'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Customer was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -360,15 +402,24 @@ def update_customer(customer_id):
 warehouse_bp = Blueprint('warehouse', __name__)
 
 @warehouse_bp.route('/warehouses', methods=['GET'])
+@conditional('warehouse')
 def get_warehouses():
     """Get all warehouses"""
     try:
-        warehouses = db_service.find_documents('warehouse', limit=100)
+        limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
+        warehouses, next_cursor = db_service.find_page('warehouse', limit, cursor=cursor)
         return jsonify({
             'success': True,
             'data': warehouses,
-            'count': len(warehouses)
+            'count': len(warehouses),
+            'next': next_cursor
         })
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -437,7 +488,7 @@ def update_warehouse(warehouse_id):
         if 'is_active' in data:
             warehouse.is_active = data['is_active']
         
-        if db_service.update_document(warehouse):
+        if db_service.update_document(warehouse, rev=existing_warehouse.get('_rev')):
             updated_warehouse = db_service.get_document(warehouse_id)
             return jsonify({
                 'success': True,
@@ -449,6 +500,11 @@ def update_warehouse(warehouse_id):
                 'error': 'Failed to update warehouse'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Warehouse was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -0,0 +1,49 @@
+"""Export sales line items and inventory movements to columnar files.
+
+Writes date-partitioned Parquet (or Arrow IPC) files when pyarrow is
+installed and compressed NumPy .npz files otherwise, reading straight
+from the local CouchDB:
+
+    python export_sales_data.py --out /srv/exports
+    python export_sales_data.py --out /srv/exports --format npz --batch-size 2000
+
+Each run continues from where the previous one stopped (see
+ColumnarExporter), so it can be run from cron to keep an export current.
+"""
+import argparse
+import sys
+import time
+
+from src.services.database_service import DatabaseService
+from src.services.columnar_export import ColumnarExporter
+
+def main():
+    parser = argparse.ArgumentParser(description='Export sales line items and inventory movements')
+    parser.add_argument('--out', required=True, help='export directory')
+    parser.add_argument('--format', default='auto', choices=['auto', 'parquet', 'arrow', 'npz'])
+    parser.add_argument('--batch-size', type=int, default=5000, help='changes read per file batch')
+    parser.add_argument('--max-batches', type=int, help='stop after this many batches')
+    parser.add_argument('--database', default='inventory_system')
+    args = parser.parse_args()
+
+    service = DatabaseService(args.database)
+    if service.db is None:
+        print('Could not connect to CouchDB')
+        return 1
+
+    try:
+        exporter = ColumnarExporter(service.db, args.out, args.format, args.batch_size)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    started = time.time()
+    result = exporter.run(args.max_batches)
+    print(f"Exported {result['rows']} rows in {result['batches']} {result['format']} batches "
+          f"in {time.time() - started:.1f}s (up to sequence {result['last_seq']})")
+    if not result['complete']:
+        print('More changes are pending; run again to continue')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
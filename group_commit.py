@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+from typing import List, Any, Dict, Callable
+
+class GroupCommitter:
+    """Collects submissions from request threads and processes them together on one worker thread.
+
+    The first submission opens a window of `window` seconds; whatever
+    arrives before it closes, up to `max_batch` submissions, is handed to
+    `process` as one list, which returns one result per submission. Every
+    waiting caller then gets its own result back, or the exception
+    `process` raised. A longer window or larger batch means fewer, bigger
+    writes at the cost of latency for the first submission of each group.
+    """
+
+    def __init__(self, process: Callable[[List[Any]], List[Any]], window: float = 0.01, max_batch: int = 50):
+        self.process = process
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {'batches': 0, 'submissions': 0, 'largest_batch': 0, 'errors': 0,
+                      'last_batch_ms': 0.0, 'batch_sizes': {'1': 0, '2-4': 0, '5-9': 0, '10-19': 0, '20+': 0}}
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any) -> Any:
+        """Queue an item for the next group and wait for its result.
+
+        There is no timeout: once queued the item may be committed at any
+        point, so the caller waits for the worker to say what happened.
+        """
+        self._ensure_worker()
+        slot = {'item': item, 'done': threading.Event()}
+        self._queue.put(slot)
+        slot['done'].wait()
+        if 'error' in slot:
+            raise slot['error']
+        return slot['result']
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        """Block for a first submission, then gather more until the window closes or the batch is full"""
+        slots = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(slots) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                slots.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return slots
+
+    def _record(self, size: int, elapsed: float):
+        self.stats['batches'] += 1
+        self.stats['submissions'] += size
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], size)
+        self.stats['last_batch_ms'] = round(elapsed * 1000, 2)
+        bucket = '1' if size == 1 else '2-4' if size < 5 else '5-9' if size < 10 else '10-19' if size < 20 else '20+'
+        self.stats['batch_sizes'][bucket] += 1
+
+    def _run(self):
+        while True:
+            slots = self._collect()
+            started = time.monotonic()
+            try:
+                results = self.process([slot['item'] for slot in slots])
+                for slot, result in zip(slots, results):
+                    slot['result'] = result
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error committing group of {len(slots)}: {e}")
+                for slot in slots:
+                    slot['error'] = e
+            finally:
+                # Submitters wait without a timeout, so they are always woken
+                self._record(len(slots), time.monotonic() - started)
+                for slot in slots:
+                    slot['done'].set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Batch counts and sizes, with the configured window and batch limit"""
+        stats = dict(self.stats, batch_sizes=dict(self.stats['batch_sizes']),
+                     window_ms=self.window * 1000, max_batch=self.max_batch)
+        stats['average_batch'] = round(stats['submissions'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
@@ -0,0 +1,162 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+
+import couchdb
+
+class IdempotencyStore:
+    """Responses to mutating requests, kept by Idempotency-Key so a retried request is not run twice.
+
+    Each key (scoped to the method and path) has an `idempotency_key`
+    document. It is created as 'pending' before the request runs, which
+    also stops two copies of the request racing each other, and then holds
+    the response. Finished responses are kept in memory as well (at most
+    `max_entries`, least recently used dropped first), so a repeated request
+    is answered without touching the database. Keys expire after `ttl`
+    seconds; a pending key whose request never finished can be taken over
+    after `pending_timeout` seconds.
+    """
+
+    PREFIX = 'idempotency:'
+
+    def __init__(self, db, ttl: float = 86400.0, max_entries: int = 10000, pending_timeout: float = 300.0):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.pending_timeout = pending_timeout
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.stats = {'memory_hits': 0, 'database_hits': 0, 'stored': 0, 'in_progress': 0, 'mismatches': 0}
+
+    def _doc_id(self, scope: str, key: str) -> str:
+        return self.PREFIX + hashlib.sha256(f'{scope}\n{key}'.encode('utf-8')).hexdigest()
+
+    def _remember(self, doc: Dict[str, Any]):
+        with self._lock:
+            self._entries[doc['_id']] = doc
+            self._entries.move_to_end(doc['_id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _recall(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            doc = self._entries.get(doc_id)
+            if doc is None:
+                return None
+            if doc['expires_at'] < time.time():
+                del self._entries[doc_id]
+                return None
+            self._entries.move_to_end(doc_id)
+            return doc
+
+    def _outcome(self, doc: Dict[str, Any], fingerprint: str) -> str:
+        """'done' for the same request, 'mismatch' when the key was used for a different body"""
+        if doc['fingerprint'] != fingerprint:
+            self.stats['mismatches'] += 1
+            return 'mismatch'
+        return 'done'
+
+    def begin(self, scope: str, key: str, fingerprint: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Claim a key before running a request.
+
+        Returns ('new', doc) when the request should run (pass doc to
+        complete or release afterwards), ('done', doc) with the stored
+        response, ('mismatch', doc) when the key was used with another
+        body, ('in_progress', None) while another copy is running and
+        ('unavailable', None) when the store cannot be reached.
+        """
+        if self.db is None:
+            return 'unavailable', None
+
+        doc_id = self._doc_id(scope, key)
+        remembered = self._recall(doc_id)
+        if remembered is not None:
+            self.stats['memory_hits'] += 1
+            return self._outcome(remembered, fingerprint), remembered
+
+        now = time.time()
+        doc = {
+            '_id': doc_id,
+            'type': 'idempotency_key',
+            'state': 'pending',
+            'scope': scope,
+            'fingerprint': fingerprint,
+            'claimed_at': now,
+            'created_at': datetime.utcnow().isoformat(),
+            'expires_at': now + self.ttl
+        }
+        try:
+            try:
+                self.db.save(doc)
+                return 'new', doc
+            except couchdb.ResourceConflict:
+                pass
+
+            existing = self.db.get(doc_id)
+            if existing is not None:
+                expired = existing['expires_at'] < now
+                abandoned = (existing['state'] == 'pending'
+                             and existing.get('claimed_at', 0) + self.pending_timeout < now)
+                if existing['state'] == 'done' and not expired:
+                    self.stats['database_hits'] += 1
+                    self._remember(existing)
+                    return self._outcome(existing, fingerprint), existing
+                if not expired and not abandoned:
+                    self.stats['in_progress'] += 1
+                    return 'in_progress', None
+                doc['_rev'] = existing['_rev']
+
+            # Expired, abandoned or deleted meanwhile: take the key over
+            self.db.save(doc)
+            return 'new', doc
+        except couchdb.ResourceConflict:
+            self.stats['in_progress'] += 1
+            return 'in_progress', None
+        except Exception as e:
+            print(f"Error claiming idempotency key: {e}")
+            return 'unavailable', None
+
+    def complete(self, doc: Dict[str, Any], status: int, body: Any):
+        """Store the response of a claimed request"""
+        doc.update(state='done', status=status, body=body)
+        try:
+            self.db.save(doc)
+            self.stats['stored'] += 1
+        except Exception as e:
+            print(f"Error storing idempotent response: {e}")
+        self._remember(doc)
+
+    def release(self, doc: Dict[str, Any]):
+        """Give a key back after its request failed, so a retry runs again"""
+        try:
+            # The tombstone keeps its type, so sync clients filtering on type never see it
+            self.db.save({'_id': doc['_id'], '_rev': doc['_rev'], '_deleted': True, 'type': doc['type']})
+        except Exception as e:
+            print(f"Error releasing idempotency key: {e}")
+
+    def purge_expired(self) -> int:
+        """Delete expired key documents; returns how many were removed"""
+        if self.db is None:
+            return 0
+
+        try:
+            status, headers, data = self.db.resource.post_json('_find', body={
+                'selector': {'type': 'idempotency_key', 'expires_at': {'$lt': time.time()}},
+                'fields': ['_id', '_rev'],
+                'limit': 10000
+            })
+            tombstones = [dict(doc, _deleted=True, type='idempotency_key') for doc in data.get('docs', [])]
+            if not tombstones:
+                return 0
+            return sum(1 for success, doc_id, rev in self.db.update(tombstones) if success)
+        except Exception as e:
+            print(f"Error purging idempotency keys: {e}")
+            return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit counters and the number of responses held in memory"""
+        with self._lock:
+            return dict(self.stats, cached=len(self._entries), ttl=self.ttl, max_entries=self.max_entries)
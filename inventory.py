@@ -196,6 +196,20 @@ class InventoryMovement(BaseModel):
         self.notes = kwargs.get('notes', '')
         self.timestamp = kwargs.get('timestamp', datetime.utcnow().isoformat())
 
+class StockCheckpoint(BaseModel):
+    """Stock of a product in one warehouse from all movements created before `as_of`"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.type = 'stock_checkpoint'
+        self.product_id = kwargs.get('product_id', '')
+        self.warehouse_id = kwargs.get('warehouse_id', '')
+        self.quantity = kwargs.get('quantity', 0)
+        self.as_of = kwargs.get('as_of', datetime.utcnow().isoformat())
+        # One checkpoint per product and warehouse
+        if '_id' not in kwargs:
+            self._id = f'stock_checkpoint:{self.product_id}:{self.warehouse_id}'
+
 class User(BaseModel):
     """User model for system authentication"""
     
@@ -0,0 +1,127 @@
+import threading
+from typing import List, Optional, Dict, Any, Iterable, Set
+
+class LowStockIndex:
+    """Products at or below their reorder point, kept per warehouse and in total.
+
+    Membership is recomputed only for the product that changed, so reading
+    the low-stock list costs the size of the list, not of the catalogue. As
+    in the original scan, a product with no stock entry for a warehouse
+    counts as low there; the per-warehouse sets therefore cover every
+    warehouse that exists or is stocked, and a warehouse seen for the first
+    time is filled once from the whole catalogue. Other warehouse ids have
+    no low-stock list; callers check `has_warehouse` first.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built = False
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.warehouses: Set[str] = set()
+        self.low_by_warehouse: Dict[str, Set[str]] = {}
+        self.low_total: Set[str] = set()
+
+    def build(self, products: Iterable[Dict[str, Any]], warehouse_ids: Iterable[str] = ()):
+        """Replace the index contents with the given products and warehouses"""
+        with self._lock:
+            self.products.clear()
+            self.warehouses.clear()
+            self.low_by_warehouse.clear()
+            self.low_total.clear()
+            for product in products:
+                self.update(product)
+            for warehouse_id in warehouse_ids:
+                self.add_warehouse(warehouse_id)
+            self.built = True
+
+    @staticmethod
+    def _is_low(quantity: int, product: Dict[str, Any]) -> bool:
+        return quantity <= product.get('reorder_point', 0)
+
+    def _add_warehouse(self, warehouse_id: str):
+        """Start tracking a warehouse; every product not stocked there is low in it"""
+        self.warehouses.add(warehouse_id)
+        self.low_by_warehouse[warehouse_id] = {
+            product_id for product_id, product in self.products.items()
+            if self._is_low(product.get('current_stock', {}).get(warehouse_id, 0), product)
+        }
+
+    def add_warehouse(self, warehouse_id: str):
+        """Track a warehouse that exists, before any product is stocked there"""
+        with self._lock:
+            if warehouse_id not in self.warehouses:
+                self._add_warehouse(warehouse_id)
+
+    def update(self, product: Dict[str, Any], stock: Optional[Dict[str, int]] = None):
+        """Index a product, replacing any earlier version of it.
+
+        `stock` overrides the document's current_stock (ledger mode, where
+        the document does not carry the real levels).
+        """
+        product_id = product['_id']
+        if stock is not None:
+            product = dict(product, current_stock=stock)
+        current_stock = product.get('current_stock', {})
+
+        with self._lock:
+            self.products[product_id] = product
+            for warehouse_id in current_stock:
+                if warehouse_id not in self.warehouses:
+                    self._add_warehouse(warehouse_id)
+            for warehouse_id in self.warehouses:
+                if self._is_low(current_stock.get(warehouse_id, 0), product):
+                    self.low_by_warehouse[warehouse_id].add(product_id)
+                else:
+                    self.low_by_warehouse[warehouse_id].discard(product_id)
+            if self._is_low(sum(current_stock.values()), product):
+                self.low_total.add(product_id)
+            else:
+                self.low_total.discard(product_id)
+
+    def remove(self, product_id: str):
+        """Drop a product from the index"""
+        with self._lock:
+            self.products.pop(product_id, None)
+            self.low_total.discard(product_id)
+            for members in self.low_by_warehouse.values():
+                members.discard(product_id)
+
+    def on_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """DatabaseService listener: keep the index in step with product and warehouse writes"""
+        if doc is None or doc.get('_deleted'):
+            self.remove(doc_id)
+        elif doc.get('type') == 'product':
+            self.update(doc)
+        elif doc.get('type') == 'warehouse':
+            self.add_warehouse(doc_id)
+
+    def has_warehouse(self, warehouse_id: str) -> bool:
+        """Whether the index tracks a warehouse (it exists or has stock)"""
+        with self._lock:
+            return warehouse_id in self.warehouses
+
+    def stock_of(self, product_id: str) -> Optional[Dict[str, int]]:
+        """Stock levels the index holds for a product, or None if it is not indexed"""
+        with self._lock:
+            product = self.products.get(product_id)
+            return dict(product.get('current_stock', {})) if product else None
+
+    def get(self, warehouse_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Low-stock products for a warehouse, or by total stock when no warehouse is given"""
+        with self._lock:
+            if warehouse_id:
+                members = self.low_by_warehouse.get(warehouse_id, ())
+            else:
+                members = self.low_total
+            return [dict(self.products[product_id]) for product_id in sorted(members)]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Sizes of the index"""
+        with self._lock:
+            return {
+                'built': self.built,
+                'products': len(self.products),
+                'low_total': len(self.low_total),
+                'low_by_warehouse': {warehouse_id: len(members)
+                                     for warehouse_id, members in self.low_by_warehouse.items()}
+            }
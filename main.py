@@ -1,14 +1,22 @@
+import gzip
 import os
 import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, jsonify
+from flask import Flask, send_from_directory, jsonify, request
 from flask_cors import CORS
 from src.database_config import db_config
 from src.routes.products import product_bp
-from src.routes.sales import sales_bp
+from src.routes.sales import sales_bp, sales_committer
 from src.routes.entities import category_bp, supplier_bp, customer_bp, warehouse_bp
+from src.routes.sync import sync_bp
+from src.routes.batch import batch_bp
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -23,6 +31,40 @@ app.register_blueprint(category_bp, url_prefix='/api')
 app.register_blueprint(supplier_bp, url_prefix='/api')
 app.register_blueprint(customer_bp, url_prefix='/api')
 app.register_blueprint(warehouse_bp, url_prefix='/api')
+app.register_blueprint(sync_bp, url_prefix='/api')
+app.register_blueprint(batch_bp, url_prefix='/api')
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_MIMETYPES = ('application/json', 'application/javascript', 'text/html', 'text/css', 'text/plain')
+
+@app.after_request
+def compress_response(response):
+    """Compress large bodies with brotli (when installed) or gzip, as the client accepts"""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    if brotli is not None and request.accept_encodings['br']:
+        encoding, data = 'br', brotli.compress(data, quality=5)
+    elif request.accept_encodings['gzip']:
+        encoding, data = 'gzip', gzip.compress(data, compresslevel=6)
+    else:
+        return response
+    
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # A compressed body is a different representation, so it needs its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
 
 # Initialize database connection on startup
 def initialize_database():
@@ -30,6 +72,27 @@ def initialize_database():
     if db_config.connect():
         print("Connected to CouchDB successfully")
         create_sample_data()
+        
+        from src.services.database_service import db_service
+        if os.getenv('PRODUCT_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes'):
+            if db_service.start_product_cache():
+                print(f"Product cache loaded {len(db_service.product_cache.products)} products")
+        if db_service.stock_ledger_mode:
+            written = db_service.checkpoint_stock_levels(seed_from_products=True)
+            print(f"Stock ledger mode: wrote {written} stock checkpoints")
+            db_service.start_stock_checkpoints(float(os.getenv('STOCK_CHECKPOINT_INTERVAL', 300)))
+        purged = db_service.idempotency.purge_expired()
+        if purged:
+            print(f"Purged {purged} expired idempotency keys")
+        if db_service.build_product_index():
+            print(f"Indexed {len(db_service.product_index.documents)} products for search")
+        if db_service.build_low_stock_index():
+            print(f"{len(db_service.low_stock_index.low_total)} products are low on stock")
+        if db_service.build_customer_index():
+            print(f"Indexed {len(db_service.customer_index.documents)} customers")
+            db_service.start_customer_index_refresh(float(os.getenv('CUSTOMER_INDEX_REFRESH_INTERVAL', 30)))
+        if db_service.co_purchase.start():
+            print(f"Co-purchase index holds {db_service.co_purchase.get_stats()['orders']} orders")
     else:
         print("Failed to connect to CouchDB")
 
@@ -168,12 +231,25 @@ def health_check():
     """Health check endpoint"""
     try:
         # Test database connection
+        from src.services.database_service import db_service
         db_status = "connected" if db_config.server else "disconnected"
         
         return jsonify({
             'status': 'healthy',
             'database': db_status,
-            'message': 'Melapro API is running'
+            'message': 'Melapro API is running',
+            'product_cache': db_service.product_cache.get_stats(),
+            'document_cache': db_service.document_cache.get_stats(),
+            'connection_pool': db_config.pool_stats(),
+            'stock_updates': db_service.stock_stats,
+            'low_stock_index': db_service.low_stock_index.get_stats(),
+            'stock_ledger': db_service.stock_ledger.get_stats() if db_service.stock_ledger_mode else None,
+            'idempotency': db_service.idempotency.get_stats(),
+            'sales_group_commit': sales_committer.get_stats() if sales_committer else None,
+            'sales_rollups': db_service.sales_rollups.get_stats(),
+            'sales_analytics': db_service.sales_analytics.get_stats(),
+            'co_purchase': db_service.co_purchase.get_stats(),
+            'customer_index': db_service.customer_index.get_stats()
         })
     except Exception as e:
         return jsonify({
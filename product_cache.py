@@ -0,0 +1,192 @@
+import copy
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Callable, Iterable
+
+class ProductCache:
+    """Process-local copy of every product document, kept current by the _changes feed.
+
+    The cache is filled once, then a background thread long-polls the
+    database changes feed from the sequence taken before the fill, so no
+    update is missed. Reads are only served while the feed is healthy: if a
+    poll has not come back within `feed_timeout` plus a grace period the
+    cache reports itself stale and callers go to CouchDB instead.
+    """
+
+    def __init__(self, feed_timeout: float = 30.0, grace: float = 5.0):
+        self.feed_timeout = feed_timeout
+        self.grace = grace
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.last_seq = None
+        # Sequence of the last product change seen on the feed, and the time
+        # of a write made in this process that the feed has not confirmed yet
+        self.last_change_seq = None
+        self.local_write_at = None
+        self.ready = False
+        self.last_poll_at = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'changes': 0, 'errors': 0,
+                      'pending': 0, 'last_change_lag': 0.0}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, db, loader: Callable[[], Iterable[Dict[str, Any]]],
+              listener: Optional[Callable] = None):
+        """Fill the cache from `loader` and start following the changes feed.
+
+        `listener(doc_id, doc)` is called for every change arriving through
+        the feed, so other in-memory indexes see writes made by other
+        processes too.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+
+        # Take the sequence first so changes made during the fill are replayed
+        since = db.info()['update_seq']
+        with self._lock:
+            self.products = {doc['_id']: doc for doc in loader()}
+            self.last_seq = since
+            self.last_change_seq = since
+            self.last_poll_at = time.time()
+            self.ready = True
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._follow, args=(db, listener), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop following the feed; the cache stops serving reads"""
+        self._stop.set()
+        self.ready = False
+
+    def is_fresh(self) -> bool:
+        """Whether the feed has confirmed the cache is current recently enough to serve reads"""
+        return self.ready and time.time() - self.last_poll_at < self.feed_timeout + self.grace
+
+    def _follow(self, db, listener: Optional[Callable]):
+        """Long-poll the changes feed until stopped"""
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                poll_started = time.time()
+                data = db.changes(
+                    feed='longpoll',
+                    since=self.last_seq,
+                    include_docs='true',
+                    timeout=int(self.feed_timeout * 1000),
+                    filter='_selector',
+                    _selector={'selector': {'$or': [{'type': 'product'}, {'_deleted': True}]}}
+                )
+                for change in data.get('results', []):
+                    doc = None if change.get('deleted') else change.get('doc')
+                    self.on_change(change['id'], doc)
+                    self.stats['changes'] += 1
+                    if listener:
+                        listener(change['id'], doc)
+                    if doc and doc.get('updated_at'):
+                        self._record_lag(doc['updated_at'])
+
+                with self._lock:
+                    if data.get('results'):
+                        self.last_change_seq = data['results'][-1]['seq']
+                    # A poll that started after a local write has returned it
+                    if self.local_write_at and poll_started > self.local_write_at:
+                        self.local_write_at = None
+                    self.last_seq = data.get('last_seq', self.last_seq)
+                    self.stats['pending'] = data.get('pending', 0)
+                    self.last_poll_at = time.time()
+                backoff = 1.0
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Product cache changes feed error: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    def _record_lag(self, updated_at: str):
+        """Seconds between a product being saved and the cache applying it"""
+        try:
+            saved = datetime.fromisoformat(updated_at)
+            self.stats['last_change_lag'] = max(0.0, (datetime.utcnow() - saved).total_seconds())
+        except ValueError:
+            pass
+
+    def on_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """Apply a product write or a deletion; older revisions never replace newer ones"""
+        with self._lock:
+            if doc is None or doc.get('_deleted'):
+                self.products.pop(doc_id, None)
+                return
+            if doc.get('type') != 'product':
+                return
+            current = self.products.get(doc_id)
+            if current and _rev_number(current) > _rev_number(doc):
+                return
+            self.products[doc_id] = copy.deepcopy(doc)
+
+    def on_local_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """DatabaseService listener for writes made by this process"""
+        self.local_write_at = time.time()
+        self.on_change(doc_id, doc)
+    
+    def version(self) -> Optional[str]:
+        """Feed sequence of the last product change, or None when it cannot be vouched for.
+        
+        None while the cache is stale or a write made here has not come back
+        through the feed yet (its sequence is not known).
+        """
+        with self._lock:
+            if not self.is_fresh() or self.local_write_at or self.last_change_seq is None:
+                return None
+            return str(self.last_change_seq)
+    
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a cached product, or None if it is not cached"""
+        with self._lock:
+            doc = self.products.get(doc_id)
+            if doc is None:
+                return None
+            self.stats['hits'] += 1
+            return copy.deepcopy(doc)
+
+    def record_miss(self):
+        """Count a product read that had to go to CouchDB"""
+        self.stats['misses'] += 1
+
+    def find(self, selector: Optional[Dict] = None, limit: int = 100, skip: int = 0,
+             after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Products whose fields equal every value in `selector`, ordered by _id (after `after`, if given)"""
+        selector = selector or {}
+        with self._lock:
+            matches = [doc for doc_id, doc in sorted(self.products.items())
+                       if (after is None or doc_id > after)
+                       and all(doc.get(key) == value for key, value in selector.items())]
+            self.stats['hits'] += 1
+            return copy.deepcopy(matches[skip:skip + limit])
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Copies of every cached product"""
+        with self._lock:
+            self.stats['hits'] += 1
+            return copy.deepcopy(list(self.products.values()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters plus feed position and lag"""
+        with self._lock:
+            return dict(self.stats,
+                        size=len(self.products),
+                        last_seq=self.last_seq,
+                        fresh=self.is_fresh(),
+                        seconds_since_poll=round(time.time() - self.last_poll_at, 3))
+
+def _rev_number(doc: Dict[str, Any]) -> int:
+    """Generation number of a document revision"""
+    try:
+        return int(str(doc.get('_rev', '0')).split('-', 1)[0])
+    except ValueError:
+        return 0
+
+def can_serve_selector(selector: Optional[Dict]) -> bool:
+    """Whether a find selector is plain field equality the cache can evaluate"""
+    return all(not isinstance(value, dict) and not key.startswith('$')
+               for key, value in (selector or {}).items())
@@ -0,0 +1,162 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import List, Optional, Dict, Any, Iterable, Set
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+class ProductSearchIndex:
+    """In-memory inverted index over product name, SKU, barcode and description.
+
+    Each token maps to the products containing it, weighted by the field it
+    came from. Query terms match tokens exactly, by prefix (for search-as-you
+    -type) and, for terms of four or more characters, fuzzily through shared
+    trigrams so misspelled drug names still find the product.
+    """
+
+    # Relative weight of a token by the field it appears in
+    FIELD_WEIGHTS = {'sku': 4.0, 'barcode': 4.0, 'name': 3.0, 'description': 1.0}
+
+    # Score multipliers for each kind of term match
+    EXACT_MATCH = 1.0
+    PREFIX_MATCH = 0.7
+    FUZZY_MATCH = 0.5
+
+    # Minimum trigram similarity for a fuzzy match
+    FUZZY_THRESHOLD = 0.45
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.built = False
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)  # token -> {product_id: weight}
+        self.trigrams: Dict[str, Set[str]] = defaultdict(set)  # trigram -> tokens
+        self.vocabulary: List[str] = []  # sorted tokens, for prefix lookups
+        self.doc_tokens: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """Split text into lowercase alphanumeric tokens"""
+        return TOKEN_PATTERN.findall((text or '').lower())
+
+    @staticmethod
+    def token_trigrams(token: str) -> Set[str]:
+        """Trigrams of a token padded at both ends"""
+        padded = f'  {token} '
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def build(self, products: Iterable[Dict[str, Any]]):
+        """Replace the index contents with the given products"""
+        with self._lock:
+            self.documents.clear()
+            self.postings.clear()
+            self.trigrams.clear()
+            self.vocabulary = []
+            self.doc_tokens.clear()
+            for product in products:
+                self.add(product)
+            self.built = True
+
+    def add(self, product: Dict[str, Any]):
+        """Index a product, replacing any earlier version of it"""
+        product_id = product['_id']
+        weights = {}
+        for field, weight in self.FIELD_WEIGHTS.items():
+            value = str(product.get(field) or '')
+            for token in self.tokenize(value):
+                weights[token] = max(weights.get(token, 0), weight)
+            # Keep whole codes like "DIAPER-M" searchable as typed
+            if field in ('sku', 'barcode') and value:
+                compact = value.lower().replace('-', '').replace(' ', '')
+                weights[compact] = max(weights.get(compact, 0), weight)
+
+        with self._lock:
+            self.remove(product_id)
+            self.documents[product_id] = product
+            self.doc_tokens[product_id] = set(weights)
+            for token, weight in weights.items():
+                if token not in self.postings:
+                    insort(self.vocabulary, token)
+                    for trigram in self.token_trigrams(token):
+                        self.trigrams[trigram].add(token)
+                self.postings[token][product_id] = weight
+
+    def remove(self, product_id: str):
+        """Drop a product from the index"""
+        with self._lock:
+            self.documents.pop(product_id, None)
+            for token in self.doc_tokens.pop(product_id, set()):
+                postings = self.postings.get(token)
+                if postings is None:
+                    continue
+                postings.pop(product_id, None)
+                if not postings:
+                    del self.postings[token]
+                    index = bisect_left(self.vocabulary, token)
+                    if index < len(self.vocabulary) and self.vocabulary[index] == token:
+                        self.vocabulary.pop(index)
+                    for trigram in self.token_trigrams(token):
+                        self.trigrams[trigram].discard(token)
+                        if not self.trigrams[trigram]:
+                            del self.trigrams[trigram]
+
+    def on_change(self, doc_id: str, doc: Optional[Dict[str, Any]]):
+        """DatabaseService listener: keep the index in step with product writes"""
+        if doc is None or doc.get('_deleted'):
+            self.remove(doc_id)
+        else:
+            self.add(doc)
+
+    def _match_term(self, term: str, fuzzy: bool) -> Dict[str, float]:
+        """Score every product matching one query term"""
+        candidates = {}
+        if term in self.postings:
+            candidates[term] = self.EXACT_MATCH
+
+        index = bisect_left(self.vocabulary, term)
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(term):
+            candidates.setdefault(self.vocabulary[index], self.PREFIX_MATCH)
+            index += 1
+
+        if fuzzy and len(term) >= 4:
+            term_trigrams = self.token_trigrams(term)
+            shared = defaultdict(int)
+            for trigram in term_trigrams:
+                for token in self.trigrams.get(trigram, ()):
+                    shared[token] += 1
+            for token, count in shared.items():
+                similarity = count / len(term_trigrams | self.token_trigrams(token))
+                if similarity >= self.FUZZY_THRESHOLD:
+                    score = self.FUZZY_MATCH * similarity
+                    if score > candidates.get(token, 0):
+                        candidates[token] = score
+
+        scores = {}
+        for token, match_score in candidates.items():
+            for product_id, weight in self.postings[token].items():
+                score = weight * match_score
+                if score > scores.get(product_id, 0):
+                    scores[product_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = 50, fuzzy: bool = True) -> List[Dict[str, Any]]:
+        """Rank products against a multi-term query.
+
+        Products matching more of the terms rank first, then by the summed
+        score of their best match for each term.
+        """
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            matched = defaultdict(int)
+            totals = defaultdict(float)
+            for term in terms:
+                for product_id, score in self._match_term(term, fuzzy).items():
+                    matched[product_id] += 1
+                    totals[product_id] += score
+
+            ranked = sorted(totals, key=lambda pid: (matched[pid], totals[pid]), reverse=True)
+            return [self.documents[product_id] for product_id in ranked[:limit]]
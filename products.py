@@ -1,10 +1,12 @@
 from flask import Blueprint, jsonify, request
-from src.services.database_service import db_service
+from src.services.database_service import db_service, InvalidCursor, DocumentConflict, InsufficientStock, UnknownWarehouse
+from src.routes.responses import wants_stream, stream_documents, conditional, idempotent
 from src.models.inventory import Product
 
 product_bp = Blueprint('product', __name__)
 
 @product_bp.route('/products', methods=['GET'])
+@conditional('product')
 def get_products():
     """Get all products with optional search and filtering"""
     try:
@@ -14,6 +16,17 @@ def get_products():
         warehouse_id = request.args.get('warehouse_id', '')
         limit = int(request.args.get('limit', 100))
         skip = int(request.args.get('skip', 0))
+        cursor = request.args.get('cursor')
+        next_cursor = None
+        
+        if wants_stream() and not search:
+            # Stream the whole (optionally filtered) catalogue page by page
+            selector = {'category_id': category_id} if category_id else None
+            products = db_service.iter_documents('product', selector)
+            if warehouse_id:
+                products = (product for product in products
+                            if product.get('current_stock', {}).get(warehouse_id, 0) > 0)
+            return stream_documents(products)
         
         if search:
             # Search products by name, SKU, or description
@@ -24,7 +37,9 @@ def get_products():
             if category_id:
                 selector['category_id'] = category_id
                 
-            products = db_service.find_documents('product', limit, skip, selector)
+            products, next_cursor = db_service.find_page('product', limit, selector, cursor=cursor, skip=skip)
+        
+        products = db_service.overlay_ledger_stock(products)
         
         # Filter by warehouse if specified (products with stock in that warehouse)
         if warehouse_id:
@@ -38,9 +53,15 @@ def get_products():
         return jsonify({
             'success': True,
             'data': products,
-            'count': len(products)
+            'count': len(products),
+            'next': next_cursor
         })
         
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -48,6 +69,7 @@ def get_products():
         }), 500
 
 @product_bp.route('/products', methods=['POST'])
+@idempotent
 def create_product():
     """Create a new product"""
     try:
@@ -88,6 +110,9 @@ def create_product():
         
         product_id = db_service.create_document(product)
         if product_id:
+            if db_service.stock_ledger_mode:
+                # Opening stock becomes the first checkpoint of the ledger
+                db_service.seed_stock_checkpoints([product.to_dict()], as_of=product.created_at)
             # Get the created product to return
             created_product = db_service.get_document(product_id)
             return jsonify({
@@ -107,6 +132,7 @@ def create_product():
         }), 500
 
 @product_bp.route('/products/<product_id>', methods=['GET'])
+@conditional('product')
 def get_product(product_id):
     """Get a specific product by ID"""
     try:
@@ -117,6 +143,7 @@ def get_product(product_id):
                 'error': 'Product not found'
             }), 404
         
+        product = db_service.overlay_ledger_stock([product])[0]
         return jsonify({
             'success': True,
             'data': product
@@ -129,6 +156,7 @@ def get_product(product_id):
         }), 500
 
 @product_bp.route('/products/<product_id>', methods=['PUT'])
+@idempotent
 def update_product(product_id):
     """Update a product"""
     try:
@@ -178,8 +206,8 @@ def update_product(product_id):
         if 'is_active' in data:
             product.is_active = data['is_active']
         
-        # Update the product
-        if db_service.update_document(product):
+        # Save at the revision we read, so stock changed meanwhile is not overwritten
+        if db_service.update_document(product, rev=existing_product.get('_rev')):
             updated_product = db_service.get_document(product_id)
             return jsonify({
                 'success': True,
@@ -191,6 +219,11 @@ def update_product(product_id):
                 'error': 'Failed to update product'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Product was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -198,6 +231,7 @@ def update_product(product_id):
         }), 500
 
 @product_bp.route('/products/<product_id>', methods=['DELETE'])
+@idempotent
 def delete_product(product_id):
     """Delete a product (soft delete by setting is_active to False)"""
     try:
@@ -213,7 +247,7 @@ def delete_product(product_id):
         product = Product.from_dict(existing_product)
         product.is_active = False
         
-        if db_service.update_document(product):
+        if db_service.update_document(product, rev=existing_product.get('_rev')):
             return jsonify({
                 'success': True,
                 'message': 'Product deleted successfully'
@@ -224,6 +258,11 @@ def delete_product(product_id):
                 'error': 'Failed to delete product'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Product was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -235,7 +274,8 @@ def get_low_stock_products():
     """Get products that are below their reorder point"""
     try:
         warehouse_id = request.args.get('warehouse_id')
-        products = db_service.get_low_stock_products(warehouse_id)
+        order_by = request.args.get('order_by')
+        products = db_service.get_low_stock_products(warehouse_id, order_by)
         
         return jsonify({
             'success': True,
@@ -243,6 +283,11 @@ def get_low_stock_products():
             'count': len(products)
         })
         
+    except UnknownWarehouse:
+        return jsonify({
+            'success': False,
+            'error': 'Warehouse not found'
+        }), 404
     except Exception as e:
         return jsonify({
             'success': False,
@@ -250,6 +295,7 @@ def get_low_stock_products():
         }), 500
 
 @product_bp.route('/products/<product_id>/stock', methods=['PUT'])
+@idempotent
 def update_product_stock(product_id):
     """Update product stock for a specific warehouse"""
     try:
@@ -276,7 +322,7 @@ def update_product_stock(product_id):
         
         if success:
             # Get updated product
-            updated_product = db_service.get_document(product_id)
+            updated_product = db_service.overlay_ledger_stock([db_service.get_document(product_id)])[0]
             return jsonify({
                 'success': True,
                 'data': updated_product
@@ -287,6 +333,11 @@ def update_product_stock(product_id):
                 'error': 'Failed to update product stock'
             }), 500
             
+    except InsufficientStock:
+        return jsonify({
+            'success': False,
+            'error': 'Insufficient stock for this change'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -295,8 +346,10 @@ def update_product_stock(product_id):
 
 @product_bp.route('/products/<product_id>/similar', methods=['GET'])
 def get_similar_products(product_id):
-    """Get similar products based on category (simple rule-based approach)"""
+    """Get products often bought together with this one, topped up from its category"""
     try:
+        limit = min(int(request.args.get('limit', 10)), 50)
+        
         # Get the current product
         product = db_service.get_document(product_id)
         if not product or product.get('type') != 'product':
@@ -305,18 +358,8 @@ def get_similar_products(product_id):
                 'error': 'Product not found'
             }), 404
         
-        # Find products in the same category
-        similar_products = []
-        if product.get('category_id'):
-            all_products = db_service.find_documents('product', limit=50)
-            for p in all_products:
-                if (p.get('category_id') == product.get('category_id') and 
-                    p.get('_id') != product_id and 
-                    p.get('is_active', True)):
-                    similar_products.append(p)
-        
-        # Limit to 10 similar products
-        similar_products = similar_products[:10]
+        # One lookup in the co-purchase index, which falls back to the category
+        similar_products = db_service.get_similar_products(product_id, limit)
         
         return jsonify({
             'success': True,
@@ -324,6 +367,11 @@ def get_similar_products(product_id):
             'count': len(similar_products)
         })
         
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'limit must be an integer'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
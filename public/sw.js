@@ -95,6 +95,13 @@ self.addEventListener('fetch', (event) => {
   }
 })
 
+// Copy of a request's headers with one header set
+function withHeader(headers, name, value) {
+  const copy = new Headers(headers)
+  copy.set(name, value)
+  return copy
+}
+
 // Handle API requests with offline-first strategy
 async function handleApiRequest(request) {
   const url = new URL(request.url)
@@ -106,8 +113,16 @@ async function handleApiRequest(request) {
       const cachedResponse = await caches.match(cacheKey, { cacheName: API_CACHE_NAME })
       
       try {
-        // Try to fetch from network
-        const networkResponse = await fetch(request)
+        // Try to fetch from network, revalidating the cached copy by its ETag
+        const etag = cachedResponse && cachedResponse.headers.get('ETag')
+        const networkResponse = etag
+          ? await fetch(request, { headers: withHeader(request.headers, 'If-None-Match', etag) })
+          : await fetch(request)
+        
+        if (networkResponse.status === 304 && cachedResponse) {
+          // Unchanged on the server: the cached copy is current
+          return cachedResponse
+        }
         
         if (networkResponse.ok) {
           // Update cache with fresh data
@@ -306,44 +321,73 @@ self.addEventListener('sync', (event) => {
 // Sync pending requests when back online
 async function syncPendingRequests() {
   try {
-    const db = await openDB()
-    const transaction = db.transaction(['pending_requests'], 'readwrite')
-    const store = transaction.objectStore('pending_requests')
-    const requests = await store.getAll()
+    const requests = await getPendingRequests()
     
     console.log(`Syncing ${requests.length} pending requests`)
     
-    for (const requestData of requests) {
+    // Replay in order, up to 100 per /api/batch call
+    const synced = []
+    for (let start = 0; start < requests.length; start += 100) {
+      const chunk = requests.slice(start, start + 100)
       try {
-        const response = await fetch(requestData.url, {
-          method: requestData.method,
-          headers: requestData.headers,
-          body: requestData.body
+        const response = await fetch('/api/batch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ requests: chunk.map(toBatchRequest) })
         })
         
-        if (response.ok) {
-          // Request succeeded, remove from pending
-          await store.delete(requestData.id)
-          console.log('Synced request:', requestData.url)
-          
-          // Notify clients about successful sync
-          notifyClients('request-synced', { url: requestData.url })
-        } else {
-          console.log('Sync failed for request:', requestData.url, response.status)
+        if (!response.ok) {
+          console.log('Batch sync failed:', response.status)
+          break
         }
+        
+        const { results } = await response.json()
+        results.forEach((result, index) => {
+          const requestData = chunk[index]
+          if (result.status >= 200 && result.status < 300) {
+            synced.push(requestData.id)
+            console.log('Synced request:', requestData.url)
+            
+            // Notify clients about successful sync
+            notifyClients('request-synced', { url: requestData.url })
+          } else {
+            console.log('Sync failed for request:', requestData.url, result.status)
+          }
+        })
       } catch (error) {
-        console.log('Sync error for request:', requestData.url, error)
+        console.log('Batch sync error:', error)
+        break
       }
     }
     
+    // Remove the synced requests from pending
+    if (synced.length > 0) {
+      const db = await openDB()
+      const transaction = db.transaction(['pending_requests'], 'readwrite')
+      const store = transaction.objectStore('pending_requests')
+      synced.forEach(id => store.delete(id))
+    }
+    
     // Notify clients that sync is complete
-    notifyClients('sync-complete', { syncedCount: requests.length })
+    notifyClients('sync-complete', { syncedCount: synced.length })
     
   } catch (error) {
     console.error('Error syncing pending requests:', error)
   }
 }
 
+// Sub-request for /api/batch from a stored request
+function toBatchRequest(requestData) {
+  const url = new URL(requestData.url, self.location.origin)
+  let body = requestData.body
+  try {
+    body = body ? JSON.parse(body) : null
+  } catch (error) {
+    // Not JSON, sent as is
+  }
+  return { method: requestData.method, path: url.pathname + url.search, headers: requestData.headers, body }
+}
+
 // Message event for communication with main thread
 self.addEventListener('message', (event) => {
   const { type, data } = event.data
@@ -376,7 +420,11 @@ async function getPendingRequests() {
     const db = await openDB()
     const transaction = db.transaction(['pending_requests'], 'readonly')
     const store = transaction.objectStore('pending_requests')
-    return await store.getAll()
+    return await new Promise((resolve, reject) => {
+      const request = store.getAll()
+      request.onsuccess = () => resolve(request.result)
+      request.onerror = () => reject(request.error)
+    })
   } catch (error) {
     console.error('Error getting pending requests:', error)
     return []
@@ -0,0 +1,35 @@
+"""Rebuild the daily sales rollup documents from the sales orders.
+
+Run once to backfill history before reports switch to the rollups, and
+again for a day range after fixing orders by hand:
+
+    python rebuild_sales_rollups.py
+    python rebuild_sales_rollups.py --start 2024-01-01 --end 2024-01-31
+
+Best run when few sales are coming in (see SalesRollups.rebuild).
+"""
+import argparse
+import sys
+import time
+
+from src.services.database_service import DatabaseService
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild daily sales rollups from sales orders')
+    parser.add_argument('--start', help='first day (YYYY-MM-DD), default: the first order')
+    parser.add_argument('--end', help='last day (YYYY-MM-DD), default: the last order')
+    parser.add_argument('--database', default='inventory_system')
+    args = parser.parse_args()
+
+    service = DatabaseService(args.database)
+    if service.db is None:
+        print('Could not connect to CouchDB')
+        return 1
+
+    started = time.time()
+    written = service.rebuild_sales_rollups(args.start, args.end)
+    print(f"Wrote {written} rollup documents in {time.time() - started:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
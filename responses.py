@@ -0,0 +1,162 @@
+import hashlib
+import time
+from functools import wraps
+from typing import Iterable, Dict, Any, Callable
+from flask import Response, current_app, request, stream_with_context, jsonify
+from src.services.database_service import db_service
+
+NDJSON = 'application/x-ndjson'
+
+# When each data version was first seen, for Last-Modified
+_version_seen: Dict[str, float] = {}
+
+def accepts_ndjson() -> bool:
+    """Whether the Accept header names NDJSON explicitly (wildcards do not count)"""
+    return any(mimetype == NDJSON and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+def wants_stream() -> bool:
+    """Whether the client asked for a streamed listing (?stream=1 or Accept: application/x-ndjson)"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes') or accepts_ndjson()
+
+def stream_documents(documents: Iterable[Dict[str, Any]]) -> Response:
+    """Stream documents to the client as they are produced.
+
+    With `Accept: application/x-ndjson` every document is one line of JSON.
+    Otherwise the usual envelope is sent in chunks, with `count` and
+    `success` after the data. A failure part-way through can no longer
+    change the status code: NDJSON ends with an {"error": ...} line and the
+    envelope ends with "success": false and the error.
+    """
+    dumps = current_app.json.dumps
+    ndjson = accepts_ndjson()
+
+    def generate():
+        count = 0
+        error = None
+        if not ndjson:
+            yield '{"data": ['
+        try:
+            for document in documents:
+                if ndjson:
+                    yield dumps(document) + '\n'
+                else:
+                    yield (',' if count else '') + dumps(document)
+                count += 1
+        except Exception as e:
+            error = str(e)
+            print(f"Error streaming documents: {e}")
+
+        if ndjson:
+            if error:
+                yield dumps({'error': error}) + '\n'
+        elif error:
+            yield f'], "count": {count}, "success": false, "error": {dumps(error)}}}'
+        else:
+            yield f'], "count": {count}, "success": true}}'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON if ndjson else 'application/json')
+
+def _etag_base(etag: str) -> str:
+    """ETag without the suffix added when the body was compressed"""
+    for suffix in ('-gzip', '-br'):
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)]
+    return etag
+
+def conditional(doc_type: str) -> Callable:
+    """Answer GET requests for a listing of `doc_type` with ETag and Last-Modified.
+
+    The ETag hashes the type's data version (see
+    DatabaseService.get_type_version) with the full URL, so a client
+    sending If-None-Match gets a 304 before the listing is queried at all.
+    Streamed listings and failures are passed through untouched.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if wants_stream():
+                return view(*args, **kwargs)
+            version = db_service.get_type_version(doc_type)
+            if version is None:
+                return view(*args, **kwargs)
+
+            etag = hashlib.sha1(f'{version}|{request.full_path}'.encode('utf-8')).hexdigest()
+            if len(_version_seen) > 1000:
+                _version_seen.clear()
+            last_modified = _version_seen.setdefault(version, time.time())
+
+            if any(_etag_base(tag) == etag for tag in request.if_none_match):
+                response = Response(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def idempotent(view):
+    """Run a mutating request at most once per Idempotency-Key header.
+
+    A repeat of a finished request gets the stored response back (with
+    `Idempotent-Replayed: true`) without running the view. The same key
+    with a different body is a 422 and a copy still running elsewhere a
+    409. Responses with a 5xx status are not kept, so the client can retry.
+    Requests without the header run as before.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({
+                'success': False,
+                'error': 'Idempotency-Key must be at most 255 characters'
+            }), 400
+
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        state, record = db_service.idempotency.begin(f'{request.method} {request.path}', key, fingerprint)
+        if state == 'done':
+            response = jsonify(record['body'])
+            response.status_code = record['status']
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if state == 'mismatch':
+            return jsonify({
+                'success': False,
+                'error': 'Idempotency-Key was already used with a different request body'
+            }), 422
+        if state == 'in_progress':
+            return jsonify({
+                'success': False,
+                'error': 'A request with this Idempotency-Key is still being processed'
+            }), 409
+        if state == 'unavailable':
+            return view(*args, **kwargs)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            db_service.idempotency.release(record)
+            raise
+        if response.status_code >= 500:
+            db_service.idempotency.release(record)
+            return response
+
+        # Inside a batch the writes may still be buffered; they must be
+        # stored before the response is recorded as final
+        db_service.flush_creates()
+        failures = db_service.create_failures()
+        if failures:
+            db_service.idempotency.release(record)
+            return jsonify({
+                'success': False,
+                'error': f"Failed to save {failures[0]['id']}: {failures[0].get('reason', '')}"
+            }), 500
+        db_service.idempotency.complete(record, response.status_code, response.get_json(silent=True))
+        return response
+    return wrapper
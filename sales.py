@@ -1,11 +1,18 @@
+import asyncio
+import os
+from typing import List, Optional, Dict, Any, Tuple
 from flask import Blueprint, jsonify, request
 from datetime import datetime
-from src.services.database_service import db_service
+from src.services.database_service import db_service, InvalidCursor, DocumentConflict, UnknownWarehouse
+from src.services.async_database_service import async_db_service, run_async
+from src.services.group_commit import GroupCommitter
+from src.routes.responses import wants_stream, stream_documents, conditional, idempotent
 from src.models.inventory import SalesOrder, SalesOrderItem
 
 sales_bp = Blueprint('sales', __name__)
 
 @sales_bp.route('/sales', methods=['GET'])
+@conditional('sales_order')
 def get_sales_orders():
     """Get all sales orders with optional filtering"""
     try:
@@ -17,38 +24,242 @@ def get_sales_orders():
         status = request.args.get('status', '')
         limit = int(request.args.get('limit', 100))
         skip = int(request.args.get('skip', 0))
+        cursor = request.args.get('cursor')
         
+        # Newest first; the cursor resumes after the last (order_date, _id)
+        selector = {'order_date': {'$gt': None}}
         if start_date and end_date:
-            # Get sales by date range
-            sales_orders = db_service.get_sales_by_date_range(start_date, end_date)
-        else:
-            # Get all sales orders
-            selector = {}
-            if customer_id:
-                selector['customer_id'] = customer_id
-            if warehouse_id:
-                selector['warehouse_id'] = warehouse_id
-            if status:
-                selector['status'] = status
-                
-            sales_orders = db_service.find_documents('sales_order', limit, skip, selector)
-        
-        # Sort by order date (most recent first)
-        sales_orders.sort(key=lambda x: x.get('order_date', ''), reverse=True)
+            selector['order_date'] = {'$gte': start_date, '$lte': end_date}
+        if customer_id:
+            selector['customer_id'] = customer_id
+        if warehouse_id:
+            selector['warehouse_id'] = warehouse_id
+        if status:
+            selector['status'] = status
+            
+        if wants_stream():
+            # Every matching order, newest first, sent as CouchDB returns it
+            return stream_documents(db_service.iter_documents(
+                'sales_order', selector, sort=[{'order_date': 'desc'}]))
+            
+        sales_orders, next_cursor = db_service.find_page(
+            'sales_order', limit, selector,
+            sort=[{'order_date': 'desc'}],
+            cursor=cursor, skip=skip
+        )
         
         return jsonify({
             'success': True,
             'data': sales_orders,
-            'count': len(sales_orders)
+            'count': len(sales_orders),
+            'next': next_cursor
         })
         
+    except InvalidCursor:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid cursor'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def _build_sales_order(data: Dict[str, Any], products: Dict[str, Optional[Dict[str, Any]]],
+                       reserved: Dict[Tuple[str, str], int]) -> Tuple[Optional[SalesOrder], Optional[str]]:
+    """Build a sales order from validated request data, checking stock against `products`.
+    
+    `reserved` holds quantities already taken by earlier orders of the same
+    group, so the check sees the stock those orders leave.
+    """
+    processed_items = []
+    total_amount = 0.0
+    warehouse_id = data['warehouse_id']
+    
+    for item_data in data['items']:
+        product = products.get(item_data['product_id'])
+        if not product or product.get('type') != 'product':
+            return None, f'Product not found: {item_data["product_id"]}'
+        
+        # Check stock availability
+        current_stock = product.get('current_stock', {})
+        available_stock = current_stock.get(warehouse_id, 0) - reserved.get((product['_id'], warehouse_id), 0)
+        
+        if available_stock < item_data['quantity']:
+            return None, (f'Insufficient stock for product {product.get("name", "")}. '
+                          f'Available: {available_stock}, Requested: {item_data["quantity"]}')
+        
+        # Create order item
+        item = SalesOrderItem(
+            product_id=item_data['product_id'],
+            product_name=product.get('name', ''),
+            sku=product.get('sku', ''),
+            quantity=int(item_data['quantity']),
+            unit_price=float(item_data['unit_price']),
+            discount=float(item_data.get('discount', 0)),
+            batch_no=item_data.get('batch_no', ''),
+            expiry_date=item_data.get('expiry_date', '')
+        )
+        
+        processed_items.append(item.to_dict())
+        
+        # Calculate item total
+        item_total = item.quantity * item.unit_price - item.discount
+        total_amount += item_total
+    
+    sales_order = SalesOrder(
+        order_date=data.get('order_date', datetime.utcnow().isoformat()),
+        customer_id=data.get('customer_id', ''),
+        customer_name=data.get('customer_name', ''),
+        items=processed_items,
+        total_amount=total_amount,
+        payment_status=data.get('payment_status', 'pending'),
+        payment_method=data.get('payment_method', 'cash'),
+        notes=data.get('notes', ''),
+        warehouse_id=warehouse_id,
+        status=data.get('status', 'completed')
+    )
+    return sales_order, None
+
+def _process_sales_orders(submissions: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], int]]:
+    """Check and commit a group of sales orders; returns (response body, status) for each.
+    
+    Products are read once for the whole group, orders are checked in
+    submission order against that snapshot, and the accepted orders, their
+    stock changes and movements go out in one _bulk_docs call. An order
+    that does not get all of its stock (say another till sold it first) is
+    rolled back as a whole.
+    """
+    product_ids = list(dict.fromkeys(item_data['product_id']
+                                     for data in submissions for item_data in data['items']))
+    products = dict(zip(product_ids, db_service.overlay_ledger_stock(db_service.get_documents(product_ids))))
+    
+    responses: List[Optional[Tuple[Dict[str, Any], int]]] = [None] * len(submissions)
+    reserved: Dict[Tuple[str, str], int] = {}
+    accepted = []
+    for index, data in enumerate(submissions):
+        try:
+            sales_order, error = _build_sales_order(data, products, reserved)
+        except (ValueError, TypeError) as e:
+            # A malformed submission must not fail the rest of its group
+            responses[index] = ({'success': False, 'error': str(e)}, 500)
+            continue
+        if error:
+            responses[index] = ({'success': False, 'error': error}, 400)
+            continue
+        for item in sales_order.items:
+            key = (item['product_id'], sales_order.warehouse_id)
+            reserved[key] = reserved.get(key, 0) + item['quantity']
+        accepted.append((index, sales_order))
+    
+    if not accepted:
+        return responses
+    
+    stock_changes = [{
+        'product_id': item['product_id'],
+        'warehouse_id': sales_order.warehouse_id,
+        'quantity_change': -item['quantity'],  # Negative for sale
+        'product_doc': products[item['product_id']],
+        'reference_id': sales_order._id
+    } for index, sales_order in accepted for item in sales_order.items]
+    
+    # Save the sales orders, the stock changes and the inventory movements
+    # together in a single bulk request
+    results = db_service.update_product_stock_many(
+        stock_changes,
+        movement_type='SALE',
+        reference_type='sales_order',
+        extra_documents=[sales_order for index, sales_order in accepted]
+    )
+    order_results = {result['id']: result for result in results[:len(accepted)]}
+    stock_results = results[len(accepted):]
+    # Changes whose stock was actually taken, counted per (product, order):
+    # in ledger mode the movements written, otherwise the changes of the
+    # products written
+    if db_service.stock_ledger_mode:
+        keys = [(result['product_id'], result['reference_id']) for result in stock_results
+                if result['ok'] and 'reference_id' in result]
+    else:
+        written = {result['id'] for result in stock_results if result['ok'] and 'reference_id' not in result}
+        keys = [(change['product_id'], change['reference_id']) for change in stock_changes
+                if change['product_id'] in written]
+    taken: Dict[Tuple[str, str], int] = {}
+    for key in keys:
+        taken[key] = taken.get(key, 0) + 1
+    short = {result['id'] for result in stock_results
+             if result.get('error') == 'insufficient_stock' and 'reference_id' not in result}
+    
+    changes_by_order: Dict[str, List[Dict[str, Any]]] = {}
+    for change in stock_changes:
+        changes_by_order.setdefault(change['reference_id'], []).append(change)
+    
+    rollback = []
+    discarded = []
+    stored = []
+    for index, sales_order in accepted:
+        changes = changes_by_order.get(sales_order._id, [])
+        given = []
+        for change in changes:
+            key = (change['product_id'], change['reference_id'])
+            if taken.get(key):
+                taken[key] -= 1
+                given.append(change)
+        stored_order = order_results.get(sales_order._id, {}).get('ok')
+        if stored_order and len(given) == len(changes):
+            responses[index] = ({'success': True, 'data': sales_order.to_dict()}, 201)
+            stored.append((None, sales_order.to_dict()))
+            continue
+        
+        # All or nothing: give back the stock this order did take and drop
+        # the order if it was stored without all of its stock
+        rollback.extend(dict(change, quantity_change=-change['quantity_change'], product_doc=None)
+                        for change in given)
+        if stored_order:
+            discarded.append(sales_order._id)
+        missing = next((change['product_id'] for change in changes if change['product_id'] in short), None)
+        if missing:
+            name = (products.get(missing) or {}).get('name', missing)
+            responses[index] = ({'success': False, 'error': f'Insufficient stock for product {name}'}, 400)
+        else:
+            responses[index] = ({'success': False, 'error': 'Failed to create sales order'}, 500)
+    
+    db_service.sales_rollups.apply(stored)
+    for order_id in discarded:
+        if not db_service.delete_document(order_id):
+            print(f"Failed to remove sales order {order_id} that did not get its stock")
+    if rollback:
+        given_back = db_service.update_product_stock_many(
+            rollback,
+            movement_type='ADJUSTMENT',
+            reference_type='sales_order_rollback'
+        )
+        failures = ([result for result in given_back if not result['ok']] if given_back
+                    else [{'id': change['product_id'], 'error': 'error'} for change in rollback])
+        for result in failures:
+            db_service.stock_stats['give_back_failed'] += 1
+            print(f"Failed to give back stock of {result['id']} from failed sales orders: {result['error']}")
+    
+    for result in results[len(accepted):]:
+        if not result['ok']:
+            # If stock update fails, we should ideally rollback the order
+            # For now, we'll log the error
+            print(f"Failed to write {result['id']} for sales orders: {result['error']}")
+    
+    return responses
+
+# Optional group commit: sales arriving within a short window are checked
+# and written together (SALES_GROUP_COMMIT=true)
+sales_committer = None
+if os.getenv('SALES_GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes'):
+    sales_committer = GroupCommitter(
+        _process_sales_orders,
+        window=float(os.getenv('SALES_GROUP_COMMIT_WINDOW_MS', 10)) / 1000,
+        max_batch=int(os.getenv('SALES_GROUP_COMMIT_MAX', 50))
+    )
+
 @sales_bp.route('/sales', methods=['POST'])
+@idempotent
 def create_sales_order():
     """Create a new sales order"""
     try:
@@ -69,99 +280,23 @@ def create_sales_order():
                 'error': 'Sales order must have at least one item'
             }), 400
         
-        # Validate and process items
-        processed_items = []
-        total_amount = 0.0
-        
+        # Validate item fields
         for item_data in data['items']:
-            # Validate item fields
             if not all(k in item_data for k in ['product_id', 'quantity', 'unit_price']):
                 return jsonify({
                     'success': False,
                     'error': 'Each item must have product_id, quantity, and unit_price'
                 }), 400
-            
-            # Get product details
-            product = db_service.get_document(item_data['product_id'])
-            if not product or product.get('type') != 'product':
-                return jsonify({
-                    'success': False,
-                    'error': f'Product not found: {item_data["product_id"]}'
-                }), 400
-            
-            # Check stock availability
-            warehouse_id = data['warehouse_id']
-            current_stock = product.get('current_stock', {})
-            available_stock = current_stock.get(warehouse_id, 0)
-            
-            if available_stock < item_data['quantity']:
-                return jsonify({
-                    'success': False,
-                    'error': f'Insufficient stock for product {product.get("name", "")}. Available: {available_stock}, Requested: {item_data["quantity"]}'
-                }), 400
-            
-            # Create order item
-            item = SalesOrderItem(
-                product_id=item_data['product_id'],
-                product_name=product.get('name', ''),
-                sku=product.get('sku', ''),
-                quantity=int(item_data['quantity']),
-                unit_price=float(item_data['unit_price']),
-                discount=float(item_data.get('discount', 0)),
-                batch_no=item_data.get('batch_no', ''),
-                expiry_date=item_data.get('expiry_date', '')
-            )
-            
-            processed_items.append(item.to_dict())
-            
-            # Calculate item total
-            item_total = item.quantity * item.unit_price - item.discount
-            total_amount += item_total
-        
-        # Create sales order
-        sales_order = SalesOrder(
-            order_date=data.get('order_date', datetime.utcnow().isoformat()),
-            customer_id=data.get('customer_id', ''),
-            customer_name=data.get('customer_name', ''),
-            items=processed_items,
-            total_amount=total_amount,
-            payment_status=data.get('payment_status', 'pending'),
-            payment_method=data.get('payment_method', 'cash'),
-            notes=data.get('notes', ''),
-            warehouse_id=data['warehouse_id'],
-            status=data.get('status', 'completed')
-        )
-        
-        # Save the sales order
-        order_id = db_service.create_document(sales_order)
-        if not order_id:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to create sales order'
-            }), 500
-        
-        # Update stock for each item
-        for item in processed_items:
-            success = db_service.update_product_stock(
-                product_id=item['product_id'],
-                warehouse_id=data['warehouse_id'],
-                quantity_change=-item['quantity'],  # Negative for sale
-                movement_type='SALE',
-                reference_id=order_id,
-                reference_type='sales_order'
-            )
-            
-            if not success:
-                # If stock update fails, we should ideally rollback the order
-                # For now, we'll log the error
-                print(f"Failed to update stock for product {item['product_id']}")
         
-        # Get the created order to return
-        created_order = db_service.get_document(order_id)
-        return jsonify({
-            'success': True,
-            'data': created_order
-        }), 201
+        if sales_committer is not None:
+            # Committed together with the other sales of the same window, on
+            # the worker thread, which does not see this request's buffered
+            # creates (such as a product added earlier in the same batch)
+            db_service.flush_creates()
+            payload, status = sales_committer.submit(data)
+        else:
+            payload, status = _process_sales_orders([data])[0]
+        return jsonify(payload), status
         
     except Exception as e:
         return jsonify({
@@ -170,6 +305,7 @@ def create_sales_order():
         }), 500
 
 @sales_bp.route('/sales/<order_id>', methods=['GET'])
+@conditional('sales_order')
 def get_sales_order(order_id):
     """Get a specific sales order by ID"""
     try:
@@ -192,6 +328,7 @@ def get_sales_order(order_id):
         }), 500
 
 @sales_bp.route('/sales/<order_id>', methods=['PUT'])
+@idempotent
 def update_sales_order(order_id):
     """Update a sales order (limited fields)"""
     try:
@@ -220,8 +357,9 @@ def update_sales_order(order_id):
         if 'customer_name' in data:
             order.customer_name = data['customer_name']
         
-        # Update the order
-        if db_service.update_document(order):
+        # Save at the revision we read, so the rollup moves from exactly that version
+        if db_service.update_document(order, rev=existing_order['_rev']):
+            db_service.sales_rollups.apply([(existing_order, order.to_dict())])
             updated_order = db_service.get_document(order_id)
             return jsonify({
                 'success': True,
@@ -233,6 +371,11 @@ def update_sales_order(order_id):
                 'error': 'Failed to update sales order'
             }), 500
             
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Sales order was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -240,6 +383,7 @@ def update_sales_order(order_id):
         }), 500
 
 @sales_bp.route('/sales/<order_id>/cancel', methods=['POST'])
+@idempotent
 def cancel_sales_order(order_id):
     """Cancel a sales order and restore stock"""
     try:
@@ -261,25 +405,29 @@ def cancel_sales_order(order_id):
         order = SalesOrder.from_dict(existing_order)
         order.status = 'cancelled'
         
-        if not db_service.update_document(order):
+        # Save at the revision we read so a concurrent cancel cannot restore stock twice
+        if not db_service.update_document(order, rev=existing_order['_rev']):
             return jsonify({
                 'success': False,
                 'error': 'Failed to cancel sales order'
             }), 500
+        db_service.sales_rollups.apply([(existing_order, order.to_dict())])
+        
+        # Restore stock for every item in one bulk request
+        results = db_service.update_product_stock_many(
+            [{
+                'product_id': item['product_id'],
+                'warehouse_id': existing_order['warehouse_id'],
+                'quantity_change': item['quantity']  # Positive to restore stock
+            } for item in existing_order.get('items', [])],
+            movement_type='ADJUSTMENT',
+            reference_id=order_id,
+            reference_type='sales_order_cancellation'
+        )
         
-        # Restore stock for each item
-        for item in existing_order.get('items', []):
-            success = db_service.update_product_stock(
-                product_id=item['product_id'],
-                warehouse_id=existing_order['warehouse_id'],
-                quantity_change=item['quantity'],  # Positive to restore stock
-                movement_type='ADJUSTMENT',
-                reference_id=order_id,
-                reference_type='sales_order_cancellation'
-            )
-            
-            if not success:
-                print(f"Failed to restore stock for product {item['product_id']}")
+        for result in results:
+            if not result['ok']:
+                print(f"Failed to restore stock for {result['id']}: {result['error']}")
         
         # Get the updated order
         updated_order = db_service.get_document(order_id)
@@ -288,6 +436,11 @@ def cancel_sales_order(order_id):
             'data': updated_order
         })
         
+    except DocumentConflict:
+        return jsonify({
+            'success': False,
+            'error': 'Sales order was changed by another request; reload it and try again'
+        }), 409
     except Exception as e:
         return jsonify({
             'success': False,
@@ -295,6 +448,7 @@ def cancel_sales_order(order_id):
         }), 500
 
 @sales_bp.route('/sales/reports/summary', methods=['GET'])
+@conditional('sales_order')
 def get_sales_summary():
     """Get sales summary for a date range"""
     try:
@@ -308,59 +462,8 @@ def get_sales_summary():
                 'error': 'start_date and end_date are required'
             }), 400
         
-        # Get sales orders for the date range
-        sales_orders = db_service.get_sales_by_date_range(start_date, end_date)
-        
-        # Filter by warehouse if specified
-        if warehouse_id:
-            sales_orders = [order for order in sales_orders if order.get('warehouse_id') == warehouse_id]
-        
-        # Calculate summary
-        total_orders = len(sales_orders)
-        total_revenue = sum(order.get('total_amount', 0) for order in sales_orders if order.get('status') != 'cancelled')
-        completed_orders = len([order for order in sales_orders if order.get('status') == 'completed'])
-        cancelled_orders = len([order for order in sales_orders if order.get('status') == 'cancelled'])
-        
-        # Payment status breakdown
-        paid_orders = len([order for order in sales_orders if order.get('payment_status') == 'paid'])
-        pending_orders = len([order for order in sales_orders if order.get('payment_status') == 'pending'])
-        
-        # Top selling products
-        product_sales = {}
-        for order in sales_orders:
-            if order.get('status') != 'cancelled':
-                for item in order.get('items', []):
-                    product_id = item.get('product_id')
-                    if product_id not in product_sales:
-                        product_sales[product_id] = {
-                            'product_name': item.get('product_name', ''),
-                            'sku': item.get('sku', ''),
-                            'total_quantity': 0,
-                            'total_revenue': 0
-                        }
-                    product_sales[product_id]['total_quantity'] += item.get('quantity', 0)
-                    product_sales[product_id]['total_revenue'] += (item.get('quantity', 0) * item.get('unit_price', 0) - item.get('discount', 0))
-        
-        # Sort by quantity sold
-        top_products = sorted(product_sales.values(), key=lambda x: x['total_quantity'], reverse=True)[:10]
-        
-        summary = {
-            'date_range': {
-                'start_date': start_date,
-                'end_date': end_date
-            },
-            'totals': {
-                'total_orders': total_orders,
-                'completed_orders': completed_orders,
-                'cancelled_orders': cancelled_orders,
-                'total_revenue': total_revenue
-            },
-            'payment_status': {
-                'paid_orders': paid_orders,
-                'pending_orders': pending_orders
-            },
-            'top_products': top_products
-        }
+        # Totals and top products come from the reduce views, queried concurrently
+        summary = run_async(async_db_service.get_sales_summary(start_date, end_date, warehouse_id))
         
         return jsonify({
             'success': True,
@@ -373,3 +476,105 @@ def get_sales_summary():
             'error': str(e)
         }), 500
 
+@sales_bp.route('/sales/reports/analytics', methods=['GET'])
+@conditional('sales_order')
+def get_sales_analytics():
+    """Get line-item totals, top products and hour/weekday/warehouse breakdowns.
+
+    Query parameters: `start_date`, `end_date` (both optional, inclusive),
+    `warehouse_id`, `top`, `rank_by` (quantity or revenue) and `utc_offset`
+    in minutes for the hour and weekday buckets.
+    """
+    try:
+        top = int(request.args.get('top', 10))
+        rank_by = request.args.get('rank_by', 'quantity')
+        utc_offset = int(request.args.get('utc_offset', 0))
+
+        if rank_by not in ('quantity', 'revenue'):
+            return jsonify({
+                'success': False,
+                'error': 'rank_by must be quantity or revenue'
+            }), 400
+
+        # Reads only the orders changed since the last report into the arrays
+        if not db_service.sales_analytics.refresh():
+            return jsonify({
+                'success': False,
+                'error': 'Failed to load sales orders'
+            }), 500
+
+        analysis = db_service.sales_analytics.analyze(
+            request.args.get('start_date') or None,
+            request.args.get('end_date') or None,
+            request.args.get('warehouse_id') or None,
+            top=top, rank_by=rank_by, utc_offset_minutes=utc_offset
+        )
+
+        products = db_service.get_documents([item['product_id'] for item in analysis['top_products']])
+        for item, product in zip(analysis['top_products'], products):
+            item['product_name'] = (product or {}).get('name', '')
+            item['sku'] = (product or {}).get('sku', '')
+
+        return jsonify({
+            'success': True,
+            'data': analysis
+        })
+
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'top and utc_offset must be integers and dates YYYY-MM-DD'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@sales_bp.route('/sales/reports/dashboard', methods=['GET'])
+def get_dashboard():
+    """Get today's sales, recent orders, low stock and record counts in one call"""
+    try:
+        warehouse_id = request.args.get('warehouse_id', '')
+        today = datetime.utcnow().date().isoformat()
+        
+        async def load():
+            return await asyncio.gather(
+                async_db_service.get_sales_summary(today, today, warehouse_id, top=5),
+                async_db_service.find_documents(
+                    'sales_order', limit=10,
+                    selector={'order_date': {'$gt': None}},
+                    sort=[{'order_date': 'desc'}]
+                ),
+                async_db_service.get_low_stock_products(warehouse_id or None),
+                async_db_service.count_documents()
+            )
+        
+        # The four lookups are independent, so they run concurrently
+        summary, recent_orders, low_stock, counts = run_async(load())
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'today': summary,
+                'recent_orders': recent_orders,
+                'low_stock_count': len(low_stock),
+                'low_stock': low_stock[:10],
+                'counts': {
+                    'products': counts.get('product', 0),
+                    'customers': counts.get('customer', 0),
+                    'sales_orders': counts.get('sales_order', 0)
+                }
+            }
+        })
+        
+    except UnknownWarehouse:
+        return jsonify({
+            'success': False,
+            'error': 'Warehouse not found'
+        }), 404
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -0,0 +1,263 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Iterable
+
+import numpy as np
+
+# Column name -> dtype of the per line item arrays
+COLUMNS = {
+    'product': np.int32,     # index into SalesAnalytics.product_ids
+    'warehouse': np.int32,   # index into SalesAnalytics.warehouse_ids
+    'order': np.int32,       # index into SalesAnalytics.order_ids
+    'quantity': np.float64,
+    'unit_price': np.float64,
+    'discount': np.float64,
+    'timestamp': np.int64    # order_date in seconds since the epoch (UTC)
+}
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+def parse_timestamps(values: List[str]) -> np.ndarray:
+    """ISO order dates as epoch seconds; -1 for a date that does not parse"""
+    try:
+        return np.array(values, dtype='datetime64[us]').astype('datetime64[s]').astype(np.int64)
+    except ValueError:
+        parsed = np.empty(len(values), dtype=np.int64)
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = np.datetime64(value, 's').astype(np.int64)
+            except ValueError:
+                parsed[i] = -1
+        return parsed
+
+class _Interner:
+    """Maps string ids to dense integer indexes, in order of first appearance"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def get(self, value: str) -> int:
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.ids)
+            self.ids.append(value)
+        return index
+
+    def find(self, value: str) -> Optional[int]:
+        return self._index.get(value)
+
+    def __len__(self):
+        return len(self.ids)
+
+class SalesAnalytics:
+    """Sales order line items held as NumPy columns for reports over many orders.
+
+    Every line item is one row of the COLUMNS arrays, with product,
+    warehouse and order ids replaced by integer indexes, so a report is a
+    handful of masked `bincount` calls instead of a Python loop per item.
+    The arrays are filled from the `_changes` feed (filtered to sales
+    orders) and `refresh` reads only what changed after the last sequence
+    seen, so new orders are appended and cancelled or deleted ones are
+    switched off; items of an order never change once it is recorded.
+    Capacity grows by doubling, so appending stays amortised O(1).
+    """
+
+    def __init__(self, db, batch_size: int = 5000, initial_capacity: int = 1024):
+        self.db = db
+        self.batch_size = batch_size
+        self.products = _Interner()
+        self.warehouses = _Interner()
+        self.orders = _Interner()
+        self.size = 0
+        self._columns = {name: np.zeros(initial_capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._active = np.zeros(initial_capacity, dtype=bool)
+        self.last_seq = None
+        self._lock = threading.Lock()
+        self.stats = {'refreshes': 0, 'changes': 0, 'skipped': 0, 'last_refresh_ms': 0.0}
+
+    @property
+    def product_ids(self) -> List[str]:
+        return self.products.ids
+
+    @property
+    def warehouse_ids(self) -> List[str]:
+        return self.warehouses.ids
+
+    @property
+    def order_ids(self) -> List[str]:
+        return self.orders.ids
+
+    def _reserve(self, items: int, orders: int):
+        """Grow the arrays so `items` more rows and `orders` more orders fit"""
+        needed = self.size + items
+        capacity = len(self._columns['product'])
+        if needed > capacity:
+            while capacity < needed:
+                capacity *= 2
+            for name, column in self._columns.items():
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self._columns[name] = grown
+
+        needed = len(self.orders) + orders
+        if needed > len(self._active):
+            capacity = len(self._active)
+            while capacity < needed:
+                capacity *= 2
+            grown = np.zeros(capacity, dtype=bool)
+            grown[:len(self.orders)] = self._active[:len(self.orders)]
+            self._active = grown
+
+    def add_orders(self, orders: Iterable[Dict[str, Any]]) -> int:
+        """Record sales order documents (or their tombstones); returns the number of new line items.
+
+        An order seen before only has its cancelled/deleted state updated.
+        """
+        new_orders = []
+        for order in orders:
+            index = self.orders.find(order['_id'])
+            if index is not None:
+                self._active[index] = not order.get('_deleted') and order.get('status') != 'cancelled'
+            elif not order.get('_deleted') and order.get('order_date'):
+                new_orders.append(order)
+            else:
+                self.stats['skipped'] += 1
+        if not new_orders:
+            return 0
+
+        timestamps = parse_timestamps([order['order_date'] for order in new_orders])
+        rows = {name: [] for name in COLUMNS}
+        self._reserve(sum(len(order.get('items') or []) for order in new_orders), len(new_orders))
+        for order, timestamp in zip(new_orders, timestamps):
+            if timestamp < 0:
+                self.stats['skipped'] += 1
+                continue
+            order_index = self.orders.get(order['_id'])
+            self._active[order_index] = order.get('status') != 'cancelled'
+            warehouse_index = self.warehouses.get(order.get('warehouse_id') or '')
+            for item in order.get('items') or []:
+                rows['product'].append(self.products.get(item.get('product_id') or ''))
+                rows['warehouse'].append(warehouse_index)
+                rows['order'].append(order_index)
+                rows['quantity'].append(item.get('quantity') or 0)
+                rows['unit_price'].append(item.get('unit_price') or 0)
+                rows['discount'].append(item.get('discount') or 0)
+                rows['timestamp'].append(timestamp)
+
+        added = len(rows['product'])
+        for name, values in rows.items():
+            self._columns[name][self.size:self.size + added] = values
+        self.size += added
+        return added
+
+    def refresh(self) -> bool:
+        """Apply sales order changes made since the last refresh (all of them the first time)"""
+        if self.db is None:
+            return False
+
+        with self._lock:
+            started = time.monotonic()
+            try:
+                while True:
+                    data = self.db.changes(since=self.last_seq or 0, limit=self.batch_size,
+                                           include_docs='true', filter='_selector',
+                                           _selector={'selector': {'type': 'sales_order'}})
+                    results = data.get('results', [])
+                    self.add_orders(dict(change.get('doc') or {}, _id=change['id'],
+                                         _deleted=change.get('deleted', False)) for change in results)
+                    self.stats['changes'] += len(results)
+                    self.last_seq = data.get('last_seq', self.last_seq)
+                    if not results or not data.get('pending'):
+                        break
+            except Exception as e:
+                print(f"Error refreshing sales analytics: {e}")
+                return False
+            self.stats['refreshes'] += 1
+            self.stats['last_refresh_ms'] = round((time.monotonic() - started) * 1000, 2)
+            return True
+
+    def _snapshot(self) -> Dict[str, np.ndarray]:
+        """Views of the filled part of every column, plus each row's order state"""
+        with self._lock:
+            columns = {name: column[:self.size] for name, column in self._columns.items()}
+            columns['active'] = self._active[columns['order']]
+        return columns
+
+    def analyze(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                warehouse_id: Optional[str] = None, top: int = 10, rank_by: str = 'quantity',
+                utc_offset_minutes: int = 0) -> Dict[str, Any]:
+        """Totals, top products and hour/weekday/warehouse breakdowns of the orders in a day range.
+
+        Days are inclusive and compared in UTC like the other sales reports;
+        `utc_offset_minutes` shifts the hour and weekday buckets into the
+        shop's local time. Cancelled orders are left out.
+        """
+        columns = self._snapshot()
+        mask = columns['active']
+        if start_date:
+            start = datetime.fromisoformat(start_date[:10])
+            mask = mask & (columns['timestamp'] >= int((start - datetime(1970, 1, 1)).total_seconds()))
+        if end_date:
+            end = datetime.fromisoformat(end_date[:10]) + timedelta(days=1)
+            mask = mask & (columns['timestamp'] < int((end - datetime(1970, 1, 1)).total_seconds()))
+        if warehouse_id:
+            warehouse_index = self.warehouses.find(warehouse_id)
+            mask = mask & (columns['warehouse'] == (-1 if warehouse_index is None else warehouse_index))
+
+        quantity = columns['quantity'][mask]
+        gross = quantity * columns['unit_price'][mask]
+        discount = columns['discount'][mask]
+        revenue = gross - discount
+        product = columns['product'][mask]
+        local_time = columns['timestamp'][mask] + utc_offset_minutes * 60
+        hours = (local_time // 3600) % 24
+        # 1970-01-01 was a Thursday, so day 0 is weekday 3 counting from Monday
+        weekdays = (local_time // 86400 + 3) % 7
+
+        product_quantity = np.bincount(product, weights=quantity, minlength=len(self.products))
+        product_revenue = np.bincount(product, weights=revenue, minlength=len(self.products))
+        ranking = product_revenue if rank_by == 'revenue' else product_quantity
+        top = max(0, min(top, int(np.count_nonzero(ranking))))
+        if top:
+            best = np.argpartition(-ranking, top - 1)[:top]
+            best = best[np.argsort(-ranking[best], kind='stable')]
+        else:
+            best = np.array([], dtype=np.int64)
+
+        warehouse_revenue = np.bincount(columns['warehouse'][mask], weights=revenue, minlength=len(self.warehouses))
+        hour_quantity = np.bincount(hours, weights=quantity, minlength=24)
+        hour_revenue = np.bincount(hours, weights=revenue, minlength=24)
+        weekday_quantity = np.bincount(weekdays, weights=quantity, minlength=7)
+        weekday_revenue = np.bincount(weekdays, weights=revenue, minlength=7)
+
+        return {
+            'totals': {
+                'orders': int(np.unique(columns['order'][mask]).size),
+                'line_items': int(mask.sum()),
+                'quantity': float(quantity.sum()),
+                'gross_revenue': float(gross.sum()),
+                'discount_total': float(discount.sum()),
+                'net_revenue': float(revenue.sum())
+            },
+            'top_products': [{
+                'product_id': self.products.ids[index],
+                'total_quantity': float(product_quantity[index]),
+                'total_revenue': float(product_revenue[index])
+            } for index in best],
+            'by_hour': [{'hour': hour, 'quantity': float(hour_quantity[hour]), 'revenue': float(hour_revenue[hour])}
+                        for hour in range(24)],
+            'by_weekday': [{'weekday': name, 'quantity': float(weekday_quantity[day]),
+                            'revenue': float(weekday_revenue[day])}
+                           for day, name in enumerate(WEEKDAYS)],
+            'by_warehouse': {self.warehouses.ids[index]: float(value)
+                             for index, value in enumerate(warehouse_revenue) if value}
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Row counts, memory held by the arrays and refresh counters"""
+        with self._lock:
+            memory = sum(column.nbytes for column in self._columns.values()) + self._active.nbytes
+            return dict(self.stats, line_items=self.size, orders=len(self.orders),
+                        products=len(self.products), memory_bytes=memory, last_seq=self.last_seq)
@@ -0,0 +1,203 @@
+import json
+import random
+import time
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Iterable, Tuple
+
+import couchdb
+
+ROLLUP_PREFIX = 'sales_rollup:'
+STATE_ID = 'sales_rollup_state'
+
+def rollup_id(day: str, warehouse_id: str) -> str:
+    return f'{ROLLUP_PREFIX}{day}:{warehouse_id}'
+
+def _empty(day: str, warehouse_id: str) -> Dict[str, Any]:
+    return {'date': day, 'warehouse_id': warehouse_id, 'orders': 0, 'revenue': 0.0,
+            'by_status': {}, 'by_payment_status': {}, 'products': {}}
+
+def _add(total: Dict[str, Any], part: Dict[str, Any], sign: int = 1):
+    """Add (or with sign=-1 subtract) one rollup amount into another"""
+    total['orders'] += sign * part['orders']
+    total['revenue'] += sign * part['revenue']
+    for field in ('by_status', 'by_payment_status'):
+        for key, count in part[field].items():
+            total[field][key] = total[field].get(key, 0) + sign * count
+    for product_id, (quantity, revenue) in part['products'].items():
+        current = total['products'].get(product_id, [0, 0])
+        total['products'][product_id] = [current[0] + sign * quantity, current[1] + sign * revenue]
+
+def _prune(rollup: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop zero entries, as the update handler does"""
+    for field in ('by_status', 'by_payment_status'):
+        rollup[field] = {key: count for key, count in rollup[field].items() if count}
+    rollup['products'] = {product_id: amounts for product_id, amounts in rollup['products'].items()
+                          if amounts[0] or amounts[1]}
+    return rollup
+
+def contribution(order: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """The rollup id an order counts towards and what it adds there.
+
+    Matches the sales_reports views: every order counts in `orders` and by
+    status and payment status; revenue and products only when it is not
+    cancelled.
+    """
+    day = order['order_date'][:10]
+    warehouse_id = order.get('warehouse_id') or ''
+    amounts = _empty(day, warehouse_id)
+    amounts['orders'] = 1
+    amounts['by_status'] = {order.get('status', ''): 1}
+    amounts['by_payment_status'] = {order.get('payment_status', ''): 1}
+    if order.get('status') != 'cancelled':
+        amounts['revenue'] = order.get('total_amount') or 0
+        for item in order.get('items', []):
+            quantity = item.get('quantity') or 0
+            revenue = quantity * (item.get('unit_price') or 0) - (item.get('discount') or 0)
+            current = amounts['products'].get(item['product_id'], [0, 0])
+            amounts['products'][item['product_id']] = [current[0] + quantity, current[1] + revenue]
+    return rollup_id(day, warehouse_id), amounts
+
+def summarize(rollups: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, List[float]]]:
+    """Add rollup documents up into one total and per-product [quantity, revenue]"""
+    total = _empty('', '')
+    for rollup in rollups:
+        _add(total, rollup)
+    return total, total['products']
+
+class SalesRollups:
+    """Per-day, per-warehouse sales totals kept in `sales_rollup` documents.
+
+    Each order changes one rollup (`sales_rollup:<day>:<warehouse_id>`)
+    through the rollups/apply update handler, so concurrent orders add up
+    inside CouchDB. A report then reads at most one document per day and
+    warehouse in the range, whatever the number of orders. `rebuild`
+    recomputes rollups from the orders themselves and records that they
+    are complete; until then reports keep using the views. A change that
+    cannot be recorded withdraws that record again, so reports go back to
+    the views rather than serve totals missing it.
+    """
+
+    HANDLER = 'rollups/apply'
+
+    def __init__(self, db, retries: int = 5, state_ttl: float = 60.0):
+        self.db = db
+        self.retries = retries
+        self.state_ttl = state_ttl
+        self._state = (0.0, False)
+        self.stats = {'updates': 0, 'conflicts': 0, 'failed': 0, 'reads': 0}
+
+    def is_built(self) -> bool:
+        """Whether a rebuild has completed; checked at most every `state_ttl` seconds"""
+        checked_at, built = self._state
+        if time.time() - checked_at < self.state_ttl:
+            return built
+        try:
+            built = self.db is not None and self.db.get(STATE_ID) is not None
+        except Exception as e:
+            print(f"Error reading sales rollup state: {e}")
+            built = False
+        self._state = (time.time(), built)
+        return built
+
+    def apply(self, changes: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> bool:
+        """Record order changes given as (before, after) pairs; None for a side that does not exist.
+
+        Changes are netted per rollup first, so a group of orders costs one
+        request per day and warehouse touched.
+        """
+        deltas: Dict[str, Dict[str, Any]] = {}
+        for before, after in changes:
+            for order, sign in ((before, -1), (after, 1)):
+                if not order or not order.get('order_date'):
+                    continue
+                doc_id, amounts = contribution(order)
+                if doc_id not in deltas:
+                    deltas[doc_id] = _empty(amounts['date'], amounts['warehouse_id'])
+                _add(deltas[doc_id], amounts, sign)
+
+        ok = True
+        for doc_id, delta in deltas.items():
+            _prune(delta)
+            if delta['orders'] or delta['revenue'] or delta['by_status'] or delta['by_payment_status'] or delta['products']:
+                ok = self._apply_delta(doc_id, delta) and ok
+        return ok
+
+    def _apply_delta(self, doc_id: str, delta: Dict[str, Any]) -> bool:
+        body = json.dumps(dict(delta, updated_at=datetime.utcnow().isoformat()))
+        for attempt in range(self.retries + 1):
+            try:
+                self.db.update_doc(self.HANDLER, doc_id, body=body, headers={'Content-Type': 'application/json'})
+                self.stats['updates'] += 1
+                return True
+            except couchdb.ResourceConflict:
+                self.stats['conflicts'] += 1
+                time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+            except Exception as e:
+                print(f"Error updating sales rollup {doc_id}: {e}")
+                break
+        self.stats['failed'] += 1
+        self._invalidate()
+        return False
+
+    def _invalidate(self):
+        """Mark the rollups as incomplete, in every process, until the next rebuild"""
+        self._state = (time.time(), False)
+        try:
+            state = self.db.get(STATE_ID)
+            if state is not None:
+                self.db.delete(state)
+            print("Sales rollups are incomplete; reports use the views until rebuild_sales_rollups.py is run")
+        except Exception as e:
+            print(f"Error marking sales rollups as incomplete: {e}")
+
+    def load(self, start_day: str, end_day: str, warehouse_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Rollup documents for the days between start_day and end_day (inclusive)"""
+        rows = self.db.view('_all_docs', startkey=f'{ROLLUP_PREFIX}{start_day}:',
+                            endkey=f'{ROLLUP_PREFIX}{end_day}:\ufff0', include_docs=True)
+        self.stats['reads'] += 1
+        return [row.doc for row in rows
+                if row.doc and (warehouse_id is None or row.doc.get('warehouse_id') == warehouse_id)]
+
+    def rebuild(self, orders: Iterable[Dict[str, Any]], start_day: str = '0000-00-00',
+                end_day: str = '9999-99-99', batch_size: int = 500) -> int:
+        """Recompute the rollups of a day range from its orders; returns the number of documents written.
+
+        Rollups in the range that no longer have orders are deleted. Run it
+        when few sales are coming in: an order recorded while the range is
+        being recomputed may be counted twice or not at all.
+        """
+        totals: Dict[str, Dict[str, Any]] = {}
+        for order in orders:
+            if not order.get('order_date') or not start_day <= order['order_date'][:10] <= end_day:
+                continue
+            doc_id, amounts = contribution(order)
+            if doc_id not in totals:
+                totals[doc_id] = _empty(amounts['date'], amounts['warehouse_id'])
+            _add(totals[doc_id], amounts)
+
+        existing = {row.id: row.value['rev'] for row in self.db.view(
+            '_all_docs', startkey=f'{ROLLUP_PREFIX}{start_day}:', endkey=f'{ROLLUP_PREFIX}{end_day}:\ufff0')}
+        now = datetime.utcnow().isoformat()
+        documents = []
+        for doc_id, rollup in totals.items():
+            doc = dict(_prune(rollup), _id=doc_id, type='sales_rollup', updated_at=now)
+            if doc_id in existing:
+                doc['_rev'] = existing[doc_id]
+            documents.append(doc)
+        documents.extend({'_id': doc_id, '_rev': rev, '_deleted': True, 'type': 'sales_rollup'}
+                         for doc_id, rev in existing.items() if doc_id not in totals)
+
+        written = 0
+        for start in range(0, len(documents), batch_size):
+            written += sum(1 for success, doc_id, rev in self.db.update(documents[start:start + batch_size])
+                           if success)
+
+        state = self.db.get(STATE_ID) or {'_id': STATE_ID, 'type': 'sales_rollup_state'}
+        state['rebuilt_at'] = now
+        self.db.save(state)
+        self._state = (time.time(), True)
+        return written
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Update and read counters"""
+        return dict(self.stats, built=self._state[1])
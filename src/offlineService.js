@@ -1,4 +1,28 @@
-import { getDb, replicateDb } from './shared/services/pouchdb.js'
+import { getDb } from './shared/services/pouchdb.js'
+
+const SYNC_CHECKPOINT_KEY = 'sync_last_seq'
+
+// Local store for each document type the sync endpoint sends
+const STORE_BY_TYPE = {
+  product: 'products',
+  category: 'categories',
+  supplier: 'suppliers',
+  customer: 'customers',
+  warehouse: 'warehouses',
+  sales_order: 'sales',
+}
+
+// Sub-request for /api/batch from a queued request
+function toBatchRequest(req) {
+  const url = new URL(req.url, window.location.origin)
+  let body = req.body
+  try {
+    body = body ? JSON.parse(body) : null
+  } catch {
+    // not JSON, sent as is
+  }
+  return { method: req.method, path: url.pathname + url.search, headers: req.headers, body }
+}
 
 class OfflineService {
   constructor() {
@@ -6,6 +30,7 @@ class OfflineService {
     this.listeners = new Map()
     this.dbs = {}
     this.pendingRequests = []
+    this.syncing = false
     this.init()
   }
 
@@ -34,11 +59,55 @@ class OfflineService {
     })
   }
 
-  startReplication() {
-    const remoteBase = 'http://localhost:5984'
-    ;['products', 'categories', 'suppliers', 'customers', 'warehouses', 'sales'].forEach((name) => {
-      replicateDb(name, `${remoteBase}/${name}`)
-    })
+  // Pull what changed since the last checkpoint, then long-poll for more while online
+  async startReplication() {
+    if (this.syncing) return
+    this.syncing = true
+    try {
+      let longpoll = false
+      while (this.isOnline) {
+        const hasMore = await this.pullChanges(longpoll)
+        longpoll = !hasMore
+      }
+    } catch (err) {
+      // eslint-disable-next-line no-console
+      console.error('Delta sync failed:', err)
+    } finally {
+      this.syncing = false
+    }
+  }
+
+  async pullChanges(longpoll = false) {
+    const params = new URLSearchParams({ limit: '500' })
+    const since = localStorage.getItem(SYNC_CHECKPOINT_KEY)
+    if (since) params.set('since', since)
+    if (longpoll) {
+      params.set('feed', 'longpoll')
+      params.set('timeout', '30')
+    }
+
+    const response = await fetch(`/api/sync/changes?${params}`)
+    if (!response.ok) throw new Error(`HTTP ${response.status}`)
+    const result = await response.json()
+
+    for (const doc of result.data) {
+      const store = STORE_BY_TYPE[doc.type]
+      // Local revisions are independent of the server's
+      // eslint-disable-next-line no-underscore-dangle, no-unused-vars
+      const { _rev, ...local } = doc
+      if (store) await this.storeData(store, local)
+    }
+    for (const { id, type } of result.deleted) {
+      // Deletions written before types were kept could belong to any store
+      const stores = STORE_BY_TYPE[type] ? [STORE_BY_TYPE[type]] : Object.values(STORE_BY_TYPE)
+      await Promise.all(stores.map((store) => this.deleteData(store, id)))
+    }
+
+    localStorage.setItem(SYNC_CHECKPOINT_KEY, result.last_seq)
+    if (result.count || result.deleted.length) {
+      this.emit('data-updated', { count: result.count, deleted: result.deleted.length })
+    }
+    return result.has_more
   }
 
   on(event, cb) {
@@ -141,33 +210,37 @@ class OfflineService {
   async syncPendingRequests() {
     if (!this.isOnline || this.pendingRequests.length === 0) return
     const synced = []
-    for (const req of this.pendingRequests) {
+    // Replayed in order, up to 100 per /api/batch call
+    for (let start = 0; start < this.pendingRequests.length; start += 100) {
+      const chunk = this.pendingRequests.slice(start, start + 100)
       try {
-        const res = await fetch(req.url, {
-          method: req.method,
-          headers: req.headers,
-          body: req.body,
+        const res = await fetch('/api/batch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ requests: chunk.map(toBatchRequest) }),
+        })
+        if (!res.ok) break
+        const { results } = await res.json()
+        results.forEach((result, index) => {
+          if (result.status >= 200 && result.status < 300) {
+            synced.push(chunk[index])
+            this.emit('request-synced', chunk[index])
+          }
         })
-        if (res.ok) {
-          synced.push(req)
-          this.emit('request-synced', req)
-        }
       } catch {
         // ignore network errors when syncing
+        break
       }
     }
-    const remaining = []
-    for (const req of this.pendingRequests) {
-      if (synced.includes(req)) {
-        const all = await this.dbs.pending_sync.allDocs({ include_docs: true })
-        const doc = all.rows.find((r) => r.doc.timestamp === req.timestamp)
+    if (synced.length > 0) {
+      const all = await this.dbs.pending_sync.allDocs({ include_docs: true })
+      const stamps = new Set(synced.map((req) => req.timestamp))
+      await Promise.all(all.rows
+        .filter((r) => stamps.has(r.doc.timestamp))
         // eslint-disable-next-line no-underscore-dangle
-        if (doc) await this.dbs.pending_sync.remove(doc.id, doc.doc._rev)
-      } else {
-        remaining.push(req)
-      }
+        .map((r) => this.dbs.pending_sync.remove(r.id, r.doc._rev)))
     }
-    this.pendingRequests = remaining
+    this.pendingRequests = this.pendingRequests.filter((req) => !synced.includes(req))
     this.emit('sync-complete', { syncedCount: synced.length })
   }
 
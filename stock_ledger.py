@@ -0,0 +1,164 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, Iterable, Tuple
+
+from src.models.inventory import StockCheckpoint
+
+LEDGER_VIEW = ('_design', 'ledger', '_view', 'stock')
+
+class StockLedger:
+    """Stock levels derived from inventory movements instead of product documents.
+
+    The ledger/stock view sums `quantity_change` per [product_id,
+    warehouse_id, created_at]. A `stock_checkpoint` document per product and
+    warehouse holds the quantity of every movement created before its
+    `as_of`, so a read only has to reduce the movements since then. Moving
+    the checkpoints forward from time to time keeps those ranges short.
+    """
+
+    CHECKPOINT_PREFIX = 'stock_checkpoint:'
+
+    def __init__(self, db, checkpoint_lag: float = 60.0):
+        self.db = db
+        # Checkpoints stop this many seconds short of now, so movements still
+        # being written with a slightly older created_at are not skipped
+        self.checkpoint_lag = checkpoint_lag
+        self.stats = {'reads': 0, 'checkpoints_written': 0, 'last_checkpoint_at': None}
+
+    def _load_checkpoints(self, product_ids: Optional[List[str]] = None) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Checkpoint documents keyed by (product_id, warehouse_id), for some or all products"""
+        if product_ids is None:
+            ranges = [self.CHECKPOINT_PREFIX]
+        else:
+            ranges = [f'{self.CHECKPOINT_PREFIX}{product_id}:' for product_id in dict.fromkeys(product_ids)]
+        if not ranges:
+            return {}
+
+        status, headers, data = self.db.resource('_all_docs', 'queries').post_json(body={
+            'queries': [{'startkey': prefix, 'endkey': prefix + '\ufff0', 'include_docs': True}
+                        for prefix in ranges]
+        })
+        checkpoints = {}
+        for result in data['results']:
+            for row in result['rows']:
+                doc = row.get('doc')
+                if doc and doc.get('type') == 'stock_checkpoint':
+                    checkpoints[(doc['product_id'], doc['warehouse_id'])] = doc
+        return checkpoints
+
+    def _query(self, queries: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Run several ledger view queries in one request; returns the rows of each"""
+        if not queries:
+            return []
+        status, headers, data = self.db.resource(*LEDGER_VIEW, 'queries').post_json(body={'queries': queries})
+        return [result['rows'] for result in data['results']]
+
+    def get_stock(self, product_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+        """Current stock as {product_id: {warehouse_id: quantity}} for some or all products.
+
+        Costs two requests whatever the number of products: one for the
+        checkpoints and one multi-query against the view.
+        """
+        checkpoints = self._load_checkpoints(product_ids)
+
+        queries = [{'startkey': [product_id, warehouse_id, checkpoint['as_of']],
+                    'endkey': [product_id, warehouse_id, {}],
+                    'reduce': True}
+                   for (product_id, warehouse_id), checkpoint in checkpoints.items()]
+        # Warehouses that have movements but no checkpoint yet are summed in full
+        if product_ids is None:
+            queries.append({'group_level': 2})
+        else:
+            queries.extend({'startkey': [product_id], 'endkey': [product_id, {}], 'group_level': 2}
+                           for product_id in dict.fromkeys(product_ids))
+
+        results = self._query(queries)
+        self.stats['reads'] += 1
+
+        stock = defaultdict(dict)
+        for ((product_id, warehouse_id), checkpoint), rows in zip(checkpoints.items(), results):
+            stock[product_id][warehouse_id] = checkpoint['quantity'] + (rows[0]['value'] if rows else 0)
+        for rows in results[len(checkpoints):]:
+            for row in rows:
+                product_id, warehouse_id = row['key']
+                if (product_id, warehouse_id) not in checkpoints:
+                    stock[product_id][warehouse_id] = row['value']
+        return dict(stock)
+
+    def seed(self, products: Iterable[Dict[str, Any]], as_of: Optional[str] = None) -> int:
+        """Create checkpoints from product `current_stock` where none exist yet.
+
+        Used when ledger mode is switched on (as_of now: earlier movements are
+        already in current_stock) and for products created in ledger mode (as
+        of their creation). Returns the number of checkpoints written.
+        """
+        products = [product for product in products if product.get('current_stock')]
+        existing = self._load_checkpoints([product['_id'] for product in products])
+        as_of = as_of or datetime.utcnow().isoformat()
+
+        documents = []
+        for product in products:
+            for warehouse_id, quantity in product['current_stock'].items():
+                if (product['_id'], warehouse_id) in existing:
+                    continue
+                documents.append(StockCheckpoint(
+                    product_id=product['_id'],
+                    warehouse_id=warehouse_id,
+                    quantity=quantity,
+                    as_of=as_of
+                ).to_dict())
+        return self._save(documents)
+
+    def checkpoint(self) -> int:
+        """Move every checkpoint up to (now - checkpoint_lag) and add missing ones.
+
+        Returns the number of checkpoints written. Checkpoints another
+        process moved meanwhile are left to that process (conflicts are
+        ignored).
+        """
+        cutoff = (datetime.utcnow() - timedelta(seconds=self.checkpoint_lag)).isoformat()
+        checkpoints = self._load_checkpoints()
+        pairs = [tuple(row['key']) for row in self._query([{'group_level': 2}])[0]]
+
+        targets, queries = [], []
+        for (product_id, warehouse_id), checkpoint in checkpoints.items():
+            if checkpoint['as_of'] < cutoff:
+                targets.append((product_id, warehouse_id, checkpoint))
+                queries.append({'startkey': [product_id, warehouse_id, checkpoint['as_of']],
+                                'endkey': [product_id, warehouse_id, cutoff],
+                                'inclusive_end': False, 'reduce': True})
+        for product_id, warehouse_id in pairs:
+            if (product_id, warehouse_id) not in checkpoints:
+                targets.append((product_id, warehouse_id, None))
+                queries.append({'startkey': [product_id, warehouse_id],
+                                'endkey': [product_id, warehouse_id, cutoff],
+                                'inclusive_end': False, 'reduce': True})
+
+        documents = []
+        for (product_id, warehouse_id, checkpoint), rows in zip(targets, self._query(queries)):
+            if checkpoint is not None and not rows:
+                continue  # nothing moved since the last checkpoint
+            moved = rows[0]['value'] if rows else 0
+            if checkpoint is None:
+                doc = StockCheckpoint(product_id=product_id, warehouse_id=warehouse_id,
+                                      quantity=moved, as_of=cutoff).to_dict()
+            else:
+                doc = dict(checkpoint, quantity=checkpoint['quantity'] + moved, as_of=cutoff,
+                           updated_at=datetime.utcnow().isoformat())
+            documents.append(doc)
+
+        written = self._save(documents)
+        self.stats['last_checkpoint_at'] = datetime.utcnow().isoformat()
+        return written
+
+    def _save(self, documents: List[Dict[str, Any]]) -> int:
+        """Write checkpoint documents in one request, counting the ones that were stored"""
+        if not documents:
+            return 0
+        written = sum(1 for success, doc_id, rev in self.db.update(documents) if success)
+        self.stats['checkpoints_written'] += written
+        return written
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Read and checkpoint counters"""
+        return dict(self.stats, checkpoint_lag=self.checkpoint_lag)
@@ -0,0 +1,65 @@
+from flask import Blueprint, jsonify, request
+from src.services.database_service import db_service, SYNC_TYPES
+
+sync_bp = Blueprint('sync', __name__)
+
+# Upper bounds on what one sync request may ask for
+MAX_CHANGES = 1000
+MAX_LONGPOLL_SECONDS = 60
+
+@sync_bp.route('/sync/changes', methods=['GET'])
+def get_changes():
+    """Get documents changed since a sync checkpoint.
+
+    Query parameters: `since` (the `last_seq` of the previous call; omit for
+    a first full sync), `types` (comma separated, defaults to everything an
+    offline client keeps), `warehouse_id`, `limit` and `feed=longpoll` with
+    an optional `timeout` in seconds to wait for the next change.
+    """
+    try:
+        since = request.args.get('since') or None
+        types = [doc_type for doc_type in request.args.get('types', '').split(',') if doc_type]
+        warehouse_id = request.args.get('warehouse_id', '')
+        limit = min(int(request.args.get('limit', 500)), MAX_CHANGES)
+        longpoll = request.args.get('feed', '') == 'longpoll'
+        timeout = min(float(request.args.get('timeout', 30)), MAX_LONGPOLL_SECONDS)
+
+        unknown = [doc_type for doc_type in types if doc_type not in SYNC_TYPES]
+        if unknown:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown types: {', '.join(unknown)}"
+            }), 400
+        if limit < 1:
+            return jsonify({
+                'success': False,
+                'error': 'limit must be positive'
+            }), 400
+
+        changes = db_service.get_changes(since, types, warehouse_id or None, limit, longpoll, timeout)
+        if changes is None:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to read changes'
+            }), 500
+
+        return jsonify({
+            'success': True,
+            'data': changes['upserts'],
+            'deleted': changes['deletes'],
+            'count': len(changes['upserts']),
+            'last_seq': changes['last_seq'],
+            'pending': changes['pending'],
+            'has_more': changes['pending'] > 0
+        })
+
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'limit and timeout must be numbers'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -0,0 +1,89 @@
+"""Connection pool slot accounting against servers that misbehave."""
+import socket
+import threading
+import time
+
+import pytest
+
+from src.couchdb_pool import PooledSession
+
+def _serve(handler):
+    """Accept connections on a free local port, handling each on its own thread"""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    clients = []
+
+    def accept():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            clients.append(conn)
+            threading.Thread(target=handler, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener, clients, f'http://127.0.0.1:{listener.getsockname()[1]}/'
+
+@pytest.fixture
+def hanging_server():
+    """Accepts requests and never answers"""
+    listener, clients, url = _serve(lambda conn: None)
+    yield url
+    listener.close()
+    for conn in clients:
+        conn.close()
+
+@pytest.fixture
+def chunked_server():
+    """Answers every request with a chunked JSON body"""
+    def handler(conn):
+        while conn.recv(65536):
+            body = b'{"results": []}'
+            conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                         b'Transfer-Encoding: chunked\r\n\r\n'
+                         + b'%x\r\n' % len(body) + body + b'\r\n0\r\n\r\n')
+
+    listener, clients, url = _serve(handler)
+    yield url
+    listener.close()
+    for conn in clients:
+        conn.close()
+
+def test_timeouts_free_their_slots(hanging_server):
+    session = PooledSession(pool_size=2, timeout=0.3, wait_timeout=5.0)
+
+    for _ in range(5):
+        started = time.time()
+        with pytest.raises(socket.timeout):
+            session.request('GET', hanging_server)
+        # Each request only waits for its own socket timeout, never for a pool slot
+        assert time.time() - started < 2.0
+        assert session.connection_pool.in_use == 0
+
+    stats = session.pool_stats()
+    assert stats['waits'] == 0
+    assert stats['overflows'] == 0
+    assert stats['discarded'] == 5
+
+def test_dropped_chunked_body_frees_its_slot(chunked_server):
+    session = PooledSession(pool_size=1, timeout=2.0, wait_timeout=5.0)
+
+    for _ in range(3):
+        status, headers, body = session.request('GET', chunked_server)
+        assert status == 200
+        # Dropping an unread chunked body closes its connection without releasing it
+        del body
+        assert session.connection_pool.in_use == 0
+
+    assert session.pool_stats()['overflows'] == 0
+
+def test_reconnecting_keeps_the_pool_the_databases_use():
+    from src.database_config import CouchDBConfig
+
+    config = CouchDBConfig()
+    assert config.connect()
+    session, server = config.session, config.server
+    assert config.connect()
+    assert config.session is session and config.server is server
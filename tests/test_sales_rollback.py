@@ -0,0 +1,95 @@
+"""Stock taken by sales orders that fail to save is given back."""
+from unittest import mock
+
+import pytest
+
+from src.routes import sales
+from src.services.database_service import db_service
+
+PRODUCT = {'_id': 'product_1', 'type': 'product', 'name': 'Rice', 'sku': 'RICE',
+           'current_stock': {'warehouse_1': 10}}
+
+@pytest.fixture
+def ledger_service():
+    """db_service in stock-ledger mode whose writes of sales orders fail"""
+    writes = []
+
+    def save_many(documents, buffer=True):
+        documents = [doc.to_dict() if hasattr(doc, 'to_dict') else doc for doc in documents]
+        writes.append(documents)
+        return [{'id': doc['_id'], 'ok': False, 'error': 'forbidden', 'reason': 'rejected'}
+                if doc.get('type') == 'sales_order' else {'id': doc['_id'], 'ok': True, 'rev': '1-a'}
+                for doc in documents]
+
+    with mock.patch.multiple(db_service, db=mock.Mock(), stock_ledger_mode=True,
+                             save_many=save_many, sales_rollups=mock.Mock(),
+                             get_documents=lambda ids: [dict(PRODUCT) for _ in ids],
+                             overlay_ledger_stock=lambda products, all_products=False: products,
+                             _refresh_low_stock=lambda product_ids: None):
+        yield writes
+
+def test_failed_order_movements_are_reversed_in_ledger_mode(ledger_service):
+    order = {'warehouse_id': 'warehouse_1', 'items': [
+        {'product_id': 'product_1', 'quantity': 2, 'unit_price': 5.0},
+        {'product_id': 'product_1', 'quantity': 3, 'unit_price': 5.0}]}
+
+    (body, status), = sales._process_sales_orders([order])
+
+    assert status == 500
+    sale, rollback = ledger_service
+    sold = [doc for doc in sale if doc.get('type') == 'inventory_movement']
+    assert [doc['quantity_change'] for doc in sold] == [-2, -3]
+    # Every written SALE movement is matched by an adjustment for the same order
+    assert all(doc['type'] == 'inventory_movement' for doc in rollback)
+    assert [doc['quantity_change'] for doc in rollback] == [2, 3]
+    assert {doc['movement_type'] for doc in rollback} == {'ADJUSTMENT'}
+    assert {doc['reference_id'] for doc in rollback} == {sold[0]['reference_id']}
+
+def test_order_short_of_stock_after_a_conflict_is_rolled_back():
+    """Another till sells product_2 between the read and the write"""
+    stored = {'product_1': dict(PRODUCT, _id='product_1', _rev='1-a'),
+              'product_2': dict(PRODUCT, _id='product_2', _rev='1-a', current_stock={'warehouse_1': 1})}
+    writes, deleted, removed = [], [], []
+
+    def save_many(documents, buffer=True):
+        documents = [doc.to_dict() if hasattr(doc, 'to_dict') else doc for doc in documents]
+        writes.append(documents)
+        results = []
+        for doc in documents:
+            if doc['_id'] == 'product_2' and len(writes) == 1:
+                stored['product_2'] = dict(stored['product_2'], _rev='2-b', current_stock={'warehouse_1': 0})
+                results.append({'id': doc['_id'], 'ok': False, 'error': 'conflict', 'reason': 'conflict'})
+            else:
+                if doc.get('type') == 'product':
+                    stored[doc['_id']] = doc
+                results.append({'id': doc['_id'], 'ok': True, 'rev': '2-a'})
+        return results
+
+    def bulk_docs(docs):
+        deleted.extend(docs)
+        return [{'id': doc['_id'], 'ok': True, 'rev': '3-a'} for doc in docs]
+
+    order = {'warehouse_id': 'warehouse_1', 'items': [
+        {'product_id': 'product_1', 'quantity': 2, 'unit_price': 5.0},
+        {'product_id': 'product_2', 'quantity': 1, 'unit_price': 5.0}]}
+
+    with mock.patch.multiple(db_service, db=mock.Mock(), stock_ledger_mode=False, stock_update_retries=1,
+                             save_many=save_many, _bulk_docs=bulk_docs, sales_rollups=mock.Mock(),
+                             get_documents=lambda ids: [dict(stored[product_id]) for product_id in ids],
+                             overlay_ledger_stock=lambda products, all_products=False: products,
+                             delete_document=lambda doc_id: removed.append(doc_id) or True):
+        (body, status), = sales._process_sales_orders([order])
+
+    assert status == 400
+    assert 'Insufficient stock' in body['error']
+    sale = writes[0]
+    order_id = sale[0]['_id']
+    # The SALE movement of the product that was not changed is deleted again
+    assert [doc['_id'] for doc in deleted] == [doc['_id'] for doc in sale if doc.get('type') == 'inventory_movement'
+                                               and doc['product_id'] == 'product_2']
+    # The stock product_1 gave is returned, and the order is dropped
+    rollback = writes[-1]
+    assert [(doc.get('product_id', doc['_id']), doc.get('quantity_change')) for doc in rollback] == [
+        ('product_1', None), ('product_1', 2)]
+    assert rollback[0]['current_stock'] == {'warehouse_1': 10}
+    assert removed == [order_id]